@@ -3,81 +3,73 @@
 import os
 import json
 import secrets
+import time
+import threading
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, session
-from flask_socketio import SocketIO, emit, join_room, leave_room
+from flask import Flask, render_template, request, session, jsonify, Response
+from flask_socketio import SocketIO, join_room, leave_room, emit
 
-# Импортируем наш модуль для работы с Google Таблицами
+# Импортируем наш модуль хранилища (Google Таблицы или SQLite)
+import storage
+from storage import LOG_SHEET_NAME, MESSAGES_SHEET_NAME, MESSAGE_COLUMNS, USERS_SHEET_NAME, CONTRACTS_SHEET_NAME, REQUESTS_SHEET_NAME
+from data_store import DataStore, CLOSED_CONTRACT_STATUSES
+from log_sink import LogSink
+from message_history import MessageHistory, SYNC_INTERVAL as MESSAGE_HISTORY_SYNC_INTERVAL
+from presence import PresenceRegistry, user_room, has_squad, SYNDICATE_ROOM
+from shared_state import create_shared_state
+from command_registry import CommandRegistry, CommandContext
+from outbound import Outbound
+from delivery import Delivery
+from rate_limit import RateLimiter
+from resume_tokens import ResumeTokens
+from snapshot import Snapshotter
+from log_archive import LogArchive
+from render_cache import RenderCache
+from listing import Listing, Paginator, sort_key
+from contract_watch import ContractBoard, CHANGE_LABELS
+from latency import LatencyTracker, is_degraded, RTT_UNSTABLE_JITTER_MS
 import google_sheets_api
-
-# --- Константы для названий листов ---
-LOG_SHEET_NAME = "Логи"
-MESSAGES_SHEET_NAME = "Сообщения"
+import metrics
 
 # --- Глобальные переменные и константы ---
-ROLE_PERMISSIONS = {
-    "guest": ["help", "login", "clear", "ping"],
-    "operative": ["help", "ping", "sendmsg", "msghistory", "contracts", "view_orders", "view_contract", "exit", "clear"],
-    "commander": ["help", "ping", "sendmsg", "msghistory", "contracts", "assign_contract", "view_users_squad", "setchannel", "view_contract", "exit", "clear"],
-    "client": ["help", "ping", "create_request", "view_my_requests", "exit", "clear"],
-    "syndicate": [
-        "help", "ping", "sendmsg", "resetkeys", "viewkeys", "register_user",
-        "unregister_user", "view_users", "viewrequests", "acceptrequest",
-        "declinerequest", "contracts", "exit", "clear", "syndicate_assign"
-    ]
-}
-COMMAND_DESCRIPTIONS = {
-    "help": "Отображает список доступных команд.",
-    "login": "Вход в систему. login <UID> <ключ>",
-    "clear": "Очищает окно терминала.",
-    "ping": "Проверяет соединение.",
-    "sendmsg": "Отправляет сообщение. sendmsg <сообщение> | sendmsg <UID> <сообщение>",
-    "msghistory": "Показывает последние 20 сообщений в чате вашего отряда.",
-    "contracts": "Просмотр всех активных и назначенных контрактов.",
-    "view_contract": "Просмотр деталей контракта. view_contract <ID_контракта>",
-    "view_orders": "Просмотр ваших контрактов.",
-    "assign_contract": "Назначить контракт оперативнику (или себе). assign_contract <ID_контракта> <UID>",
-    "view_users_squad": "Просмотр оперативников в отряде.",
-    "setchannel": "Установить новую частоту отряда. setchannel <частота>",
-    "create_request": "Создать запрос. create_request <ID_Discord> <Причина> <Текст запроса>",
-    "view_my_requests": "Просмотр ваших запросов.",
-    "resetkeys": "Сбросить ключи доступа. resetkeys <роль>",
-    "viewkeys": "Просмотр текущих ключей доступа.",
-    "register_user": "Зарегистрировать пользователя. register_user <ключ> <UID> <позывной> <отряд>",
-    "unregister_user": "Деактивировать пользователя. unregister_user <UID>",
-    "view_users": "Просмотр всех пользователей.",
-    "viewrequests": "Просмотр запросов клиентов.",
-    "acceptrequest": "Принять запрос. acceptrequest <ID> <название> <описание> <награда>",
-    "declinerequest": "Отклонить запрос. declinerequest <ID>",
-    "exit": "Выход из сессии.",
-    "syndicate_assign": "Назначить контракт отряду(ам). syndicate_assign <ID> <alpha|beta|alpha,beta>"
-}
+ALL_ROLES = frozenset({"guest", "operative", "commander", "client", "syndicate"})
+# Таблица команд терминала; команды регистрируются ниже декоратором @commands.command.
+commands = CommandRegistry()
 ACCESS_KEYS = {}
 KEY_TO_ROLE = {}
-REGISTERED_USERS = {}
-CONTRACTS = []
-PENDING_REQUESTS = []
+data_store = DataStore()
+# Готовые ответы команд-списков; сбрасываются по версиям листов DataStore.
+render_cache = RenderCache(data_store)
+paginator = Paginator(render_cache)
+contract_board = ContractBoard(data_store)
+log_sink = LogSink()
+message_history = MessageHistory(MESSAGES_SHEET_NAME)
+MSGHISTORY_DEFAULT_PAGE = 20
 SQUAD_FREQUENCIES = {
     "alpha": "142.7 МГц",
     "beta": "148.8 МГц"
 }
+# Ответ на команду, чья запись столкнулась с чужой правкой той же строки.
+WRITE_CONFLICT_OUTPUT = "⚠️ Запись уже изменена другим пользователем. Данные обновлены — проверьте их и повторите команду.\n"
+rate_limiter = RateLimiter()
+latency = LatencyTracker()
 dossiers = {}
-active_operatives = {}
-active_users = {}
+shared_state = create_shared_state(SQUAD_FREQUENCIES)
+presence = PresenceRegistry(shared_state if shared_state.distributed else None)
 
 def log_terminal_event(event_type, user_info, message):
     """
-    Формирует запись лога и отправляет ее в Google Таблицу.
+    Формирует запись лога и ставит ее в очередь на запись в Google Таблицу.
     Также выводит лог в консоль сервера для отладки в реальном времени.
     """
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     console_log_entry = f"[{timestamp}] [{event_type.upper()}] [Пользователь: {user_info}] {message}"
     print(console_log_entry)
     sheet_row_data = [timestamp, event_type.upper(), user_info, message]
-    google_sheets_api.append_row(LOG_SHEET_NAME, sheet_row_data)
+    log_sink.enqueue(LOG_SHEET_NAME, sheet_row_data)
 
 def log_message_to_sheet(sender_uid, sender_callsign, sender_squad, recipient_type, recipient_id, message_text):
-    """Сохраняет отправленное сообщение в лист 'Сообщения'."""
+    """Ставит отправленное сообщение в очередь на запись в лист 'Сообщения'."""
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     message_row = [
         timestamp,
@@ -88,7 +80,10 @@ def log_message_to_sheet(sender_uid, sender_callsign, sender_squad, recipient_ty
         recipient_id,
         message_text
     ]
-    google_sheets_api.append_row(MESSAGES_SHEET_NAME, message_row)
+    log_sink.enqueue(MESSAGES_SHEET_NAME, message_row)
+    message = dict(zip(MESSAGE_COLUMNS, (str(value) for value in message_row)))
+    message_history.add(message)
+    shared_state.publish('message', message)
 
 
 def load_access_keys():
@@ -109,101 +104,323 @@ def load_access_keys():
         for key in keys_list:
             KEY_TO_ROLE[key] = role
 
-def load_data_from_sheets():
-    """Загружает все необходимые данные из Google Таблиц в кэш."""
-    global REGISTERED_USERS, CONTRACTS, PENDING_REQUESTS
-    print("Загрузка данных из Google Таблиц...")
-    users_data = google_sheets_api.get_all_records('Пользователи')
-    REGISTERED_USERS = {str(user.get('UID')): user for user in users_data if user.get('UID')}
-    CONTRACTS.clear()
-    contracts_data = google_sheets_api.get_all_records('Контракты')
-    for contract in contracts_data:
-        try:
-            contract['ID'] = int(contract.get('ID'))
-            CONTRACTS.append(contract)
-        except (ValueError, TypeError):
-            continue
-    PENDING_REQUESTS.clear()
-    requests_data = google_sheets_api.get_all_records('Запросы Клиентов')
-    for req in requests_data:
-        try:
-            req['ID Запроса'] = int(req.get('ID Запроса'))
-            PENDING_REQUESTS.append(req)
-        except (ValueError, TypeError):
-            continue
-    print("Данные успешно загружены.")
-
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'a_very_temporary_secret_key_for_dev_only')
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
+# Очередь сообщений Socket.IO не используется: рассылку между воркерами ведет delivery через shared_state.
 socketio = SocketIO(app)
+resume_tokens = ResumeTokens(app.config['SECRET_KEY'])
+
+def client_queue_depth(sid):
+    """Сколько пакетов ждет отправки в соединение клиента (очередь engine.io)."""
+    try:
+        eio_sid = socketio.server.manager.eio_sid_from_sid(sid, '/')
+        return socketio.server.eio.sockets[eio_sid].queue.qsize()
+    except (AttributeError, KeyError, TypeError):
+        return 0
+
+# Все исходящие события идут через outbound: адресаты — локальные sid, поэтому мимо общей очереди сообщений.
+outbound = Outbound(
+    lambda event, payload, sid: socketio.server.emit(event, payload, to=sid, namespace='/', ignore_queue=True),
+    client_queue_depth,
+    lambda sid: socketio.server.disconnect(sid, namespace='/', ignore_queue=True),
+)
+
+delivery = Delivery(presence, outbound, shared_state)
+deliver = delivery.deliver
+
+def start_daemon_task(target, *args):
+    """
+    Фоновая задача-демон. socketio.start_background_task создает обычные потоки,
+    и интерпретатор ждет их вечно при остановке, так и не дойдя до atexit-сброса очередей.
+    Под eventlet threading пропатчен, и это такой же зеленый поток.
+    """
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+# --- Старт: данные из локального снимка сразу, сверка с хранилищем в фоне ---
+STORAGE_INIT_RETRY_MAX_DELAY = float(os.environ.get('STORAGE_INIT_RETRY_MAX_DELAY', 60))
+snapshotter = Snapshotter(data_store, message_history)
+log_archive = LogArchive()
+# data: none — данных нет, snapshot — обслуживаем из снимка, storage — данные сверены с хранилищем.
+startup_state = {'data': 'none', 'snapshot_age': None, 'started_at': time.time(), 'reconciled_at': None}
+
+def reconcile_with_storage(sleep):
+    """Подключает хранилище (с повторами), перечитывает данные и только потом запускает циклы, которым оно нужно."""
+    delay = 1.0
+    while not storage.init_storage():
+        print(f"❌ Не удалось инициализировать хранилище '{storage.STORAGE_BACKEND}'. Повтор через {delay:.0f} с.")
+        sleep(delay)
+        delay = min(STORAGE_INIT_RETRY_MAX_DELAY, delay * 2)
+    data_store.refresh()
+    message_history.sync()
+    if data_store.users:
+        startup_state['data'] = 'storage'
+    startup_state['reconciled_at'] = time.time()
+    snapshotter.save()
+    start_daemon_task(data_store.run_refresh_loop, sleep)
+    start_daemon_task(storage.run_replication_loop, sleep)
+    if MESSAGE_HISTORY_SYNC_INTERVAL > 0:
+        start_daemon_task(message_history.run_sync_loop, sleep, MESSAGE_HISTORY_SYNC_INTERVAL)
+    if log_archive.enabled:
+        start_daemon_task(log_archive.run_loop, sleep)
+    print(f"✅ Данные сверены с хранилищем за {time.time() - startup_state['started_at']:.1f} с после старта.")
 
-if not google_sheets_api.init_google_sheets():
-    print("❌ КРИТИЧЕСКАЯ ОШИБКА: Не удалось инициализировать Google Таблицы.")
 load_access_keys()
-load_data_from_sheets()
+log_archive.load_manifest()
+startup_state['snapshot_age'] = snapshotter.restore()
+if startup_state['snapshot_age'] is not None:
+    startup_state['data'] = 'snapshot'
+
+start_daemon_task(reconcile_with_storage, socketio.sleep)
+start_daemon_task(log_sink.run_flush_loop)
+start_daemon_task(outbound.run_flush_loop, socketio.sleep)
+start_daemon_task(metrics.run_loop_lag_probe, socketio.sleep)
+if snapshotter.enabled:
+    start_daemon_task(snapshotter.run_loop, socketio.sleep)
+
+def handle_shared_event(event, payload):
+    """События от других воркеров: их записи в хранилище и отправленные сообщения."""
+    if event == 'invalidate':
+        # Перечитываются только измененные листы, а серия записей других воркеров — одним перечитыванием.
+        data_store.request_refresh(payload.get('sheets'))
+    elif event == 'message':
+        message_history.add(payload)
+    elif event == 'deliver':
+        delivery.receive(payload)
+
+if shared_state.distributed:
+    data_store.change_listeners.append(
+        lambda version, sheet_names: shared_state.publish('invalidate', {'version': version, 'sheets': sheet_names}))
+    start_daemon_task(shared_state.run_listener, handle_shared_event)
+    start_daemon_task(shared_state.run_heartbeat, presence.logged_in_sessions, socketio.sleep)
+log_sink.register_shutdown()
+snapshotter.register_shutdown()
+
+# --- Метрики (GET /metrics, формат Prometheus) ---
+# Вызовы google_sheets_api оборачиваются на уровне модуля: storage обращается к ним через атрибуты модуля.
+metrics.instrument_sheets_api(google_sheets_api, (
+    'get_last_update_time', 'get_all_records', 'append_row', 'append_rows',
+    'update_row_by_key', 'delete_row_by_key', 'apply_writes', 'delete_leading_rows',
+))
+
+def count_by(index):
+    return {(key,): len(sids) for key, sids in list(index.items())}
+
+def room_sizes():
+    sizes = {(room,): len(presence.sids_for_room(room)) for room in list(presence.by_squad)}
+    sizes[(SYNDICATE_ROOM,)] = len(presence.sids_for_room(SYNDICATE_ROOM))
+    return sizes
+
+metrics.registry.gauge("webterminal_connected_sockets", "Подключения этого воркера по ролям.", ["role"],
+                       lambda: count_by(presence.by_role))
+metrics.registry.gauge("webterminal_room_members", "Участники комнат отрядов и Синдиката на этом воркере.", ["room"], room_sizes)
+metrics.registry.counter("webterminal_sheets_cache_requests_total", "Обращения к кэшам листов, заголовков и индексов строк.",
+                         ["cache", "result"], lambda: dict(google_sheets_api.cache_stats))
+metrics.registry.gauge("webterminal_data_version", "Версия снимка данных DataStore.", callback=lambda: data_store.version)
+metrics.registry.gauge("webterminal_outbound_queued_payloads", "Сообщения в исходящих очередях клиентов.",
+                       callback=lambda: outbound.stats()['queued_payloads'])
+metrics.registry.counter("webterminal_outbound_dropped_total", "Сообщения, отброшенные у медленных клиентов.",
+                         callback=lambda: outbound.dropped)
+metrics.registry.gauge("webterminal_sheets_pool_pending", "Вызовы Google API в очереди пула.",
+                       callback=lambda: google_sheets_api.pool.pending)
+metrics.registry.gauge("webterminal_log_sink_pending", "Записи лога, ожидающие пакетной отправки.", callback=log_sink.pending)
+metrics.registry.counter("webterminal_render_cache_requests_total", "Обращения к кэшу отрисованных ответов команд.", ["result"],
+                         lambda: {('hit',): render_cache.hits, ('miss',): render_cache.misses})
+metrics.registry.gauge("webterminal_render_cache_entries", "Записи в кэше отрисованных ответов.",
+                       callback=lambda: render_cache.stats()['entries'])
+metrics.registry.counter("webterminal_rate_limited_total", "Отклоненные ограничителем команды по области.", ["scope"],
+                         lambda: {(scope,): count for scope, count in rate_limiter.throttled.items()})
+
+def command_metric_label(data):
+    """Метка команды: только известные имена, чтобы произвольный ввод не плодил серии метрик."""
+    name = str(data.get('command', '')).strip().split(" ", 1)[0].lower() if isinstance(data, dict) else ''
+    return (name if name in commands.commands or name == 'login' else 'unknown',)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики воркера в текстовом формате Prometheus. Если задан METRICS_TOKEN, нужен заголовок Authorization: Bearer <токен>."""
+    metrics_token = os.environ.get('METRICS_TOKEN')
+    if metrics_token and request.headers.get('Authorization') != f"Bearer {metrics_token}":
+        return jsonify({'error': 'forbidden'}), 403
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/healthz')
+def healthz():
+    """Живость: процесс отвечает на HTTP. Не зависит от хранилища."""
+    return jsonify({'status': 'alive'})
+
+@app.route('/readyz')
+def readyz():
+    """
+    Готовность: есть данные для обслуживания (из снимка или из хранилища). 503, пока данных нет.
+    storage_ready — подключено ли хранилище (до этого команды с записью недоступны).
+    """
+    ready = startup_state['data'] != 'none'
+    return jsonify({
+        'ready': ready,
+        'data_source': startup_state['data'],
+        'storage_ready': storage.is_ready(),
+        'snapshot_age_s': None if startup_state['snapshot_age'] is None else round(startup_state['snapshot_age'], 1),
+        'reconciled_at': startup_state['reconciled_at'],
+        'data_version': data_store.version,
+    }), 200 if ready else 503
+
+@app.route('/admin/refresh', methods=['POST'])
+def admin_refresh():
+    """Принудительное обновление кэша данных. Требует заголовок X-Admin-Token."""
+    admin_token = os.environ.get('ADMIN_TOKEN')
+    if not admin_token or request.headers.get('X-Admin-Token') != admin_token:
+        return jsonify({'error': 'forbidden'}), 403
+    version = data_store.refresh()
+    return jsonify({'version': version})
+
+@app.route('/admin/storage_stats')
+def admin_storage_stats():
+    """Состояние хранилища: очередь и время ожидания пула вызовов Google Таблиц, размыкатель. Требует X-Admin-Token."""
+    admin_token = os.environ.get('ADMIN_TOKEN')
+    if not admin_token or request.headers.get('X-Admin-Token') != admin_token:
+        return jsonify({'error': 'forbidden'}), 403
+    return jsonify(storage.stats())
+
+@app.route('/admin/outbound_stats')
+def admin_outbound_stats():
+    """Очереди исходящих сообщений: глубина по клиентам, отложенные и отброшенные отправки. Требует X-Admin-Token."""
+    admin_token = os.environ.get('ADMIN_TOKEN')
+    if not admin_token or request.headers.get('X-Admin-Token') != admin_token:
+        return jsonify({'error': 'forbidden'}), 403
+    return jsonify(outbound.stats())
+
 @socketio.on('connect')
-def handle_connect():
+def handle_connect(auth=None):
+    presence.connect(request.sid)
+    log_terminal_event("connection", f"SID:{request.sid}", "Новое подключение.")
+    # Переподключение с токеном возобновления: роль, комнаты и интерфейс восстанавливаются сразу, без хранилища.
+    resumed = resume_tokens.verify(auth.get('resume_token')) if isinstance(auth, dict) else None
+    user = data_store.resume_user(*resumed, resume_tokens.fingerprint) if resumed else None
+    if user is not None:
+        start_session(user)
+        log_terminal_event("session_resumed", f"UID:{session['uid']}, Callsign:{session['callsign']}, SID:{request.sid}", "Сессия возобновлена по токену.")
+        return
     session['role'] = 'guest'
     session['uid'] = None
     session['callsign'] = None
     session['squad'] = None
-    active_users[request.sid] = {'uid': None, 'callsign': None, 'role': 'guest', 'squad': None}
-    emit('update_ui_state', {'role': 'guest', 'show_ui_panel': False, 'squad': None})
-    log_terminal_event("connection", f"SID:{request.sid}", "Новое подключение.")
+    outbound.send(request.sid, 'update_ui_state', {'role': 'guest', 'show_ui_panel': False, 'squad': None})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     uid_disconnected = session.get('uid', 'N/A')
     callsign_disconnected = session.get('callsign', 'N/A')
-    if request.sid in active_operatives:
-        del active_operatives[request.sid]
-    if request.sid in active_users:
-        del active_users[request.sid]
+    presence.disconnect(request.sid)
+    outbound.discard(request.sid)
+    rate_limiter.forget_sid(request.sid)
+    latency.forget(request.sid)
+    paginator.forget(request.sid)
     log_terminal_event("disconnection", f"UID:{uid_disconnected}, Callsign:{callsign_disconnected}, SID:{request.sid}", "Пользователь отключился.")
 
+def client_transport(sid):
+    """Текущий транспорт клиента: websocket или polling (не перешедший на WebSocket клиент)."""
+    try:
+        return socketio.server.transport(socketio.server.manager.eio_sid_from_sid(sid, '/'))
+    except (KeyError, TypeError):
+        return None
+
+@socketio.on('ping_check')
+def handle_ping_check(data=None):
+    """
+    Ответ на пинг клиента уходит сразу, мимо пакетной очереди outbound, и с запросом подтверждения:
+    время до подтверждения — RTT, измеренный сервером.
+    """
+    sid = request.sid
+    sent_at = time.monotonic()
+
+    def on_ack(*args):
+        rtt = time.monotonic() - sent_at
+        transport = client_transport(sid)
+        latency.record(sid, rtt * 1000, transport)
+        metrics.CLIENT_RTT_SECONDS.observe(rtt, transport or 'unknown')
+
+    emit('pong_response', {}, callback=on_ack)
+
+def leave_session_rooms(info):
+    """Выводит текущий sid из комнат, в которые он вошел при логине."""
+    if not info or info['uid'] is None:
+        return
+    leave_room(user_room(info['uid']))
+    if has_squad(info['squad']):
+        leave_room(info['squad'])
+    if info['role'] == "syndicate":
+        leave_room(SYNDICATE_ROOM)
+
+def throttle_reply(sid, throttled):
+    scope, wait = throttled
+    if scope == 'storage':
+        output = f"⏳ Хранилище перегружено командами. Повторите через {wait:.1f} с.\n"
+    else:
+        output = f"⏳ Слишком много команд. Притормозите: следующая через {wait:.1f} с.\n"
+    outbound.send(sid, 'terminal_output', {'output': output + '\n'})
+
 @socketio.on('login')
+@metrics.timed(metrics.LOGIN_SECONDS, lambda data: ())
+def handle_login_event(data):
+    throttled = rate_limiter.throttle(request.sid, None, 1)
+    if throttled is not None:
+        throttle_reply(request.sid, throttled)
+        return
+    login(data)
+
 def login(data):
     uid = str(data.get('uid'))
     key = data.get('key')
-    user_info = f"UID: {uid}, Key: {key}"
-    load_data_from_sheets()
-    if uid in REGISTERED_USERS and REGISTERED_USERS[uid].get("Ключ Доступа") == key:
-        session['uid'] = uid
-        session['role'] = REGISTERED_USERS[uid].get("Роль")
-        session['callsign'] = REGISTERED_USERS[uid].get("Позывной")
-        session['squad'] = REGISTERED_USERS[uid].get("Отряд")
-        session.permanent = True
-        active_users[request.sid] = {'uid': session['uid'], 'callsign': session['callsign'], 'role': session['role'], 'squad': session['squad']}
-        if session['role'] in ["operative", "commander"]:
-            active_operatives[request.sid] = {'uid': session['uid'], 'callsign': session['callsign'], 'squad': session['squad']}
-            if session['squad'] and session['squad'].lower() != 'none':
-                join_room(session['squad'])
-        if session['role'] == "syndicate":
-            join_room("syndicate_room")
+    user_info = f"UID: {uid}"
+    user = data_store.authenticate(uid, key)
+    if user is not None:
+        start_session(user)
         log_terminal_event("login_success", user_info, f"Пользователь '{session['callsign']}' успешно вошел как {session['role'].upper()}.")
         welcome_message = f"✅ Добро пожаловать, {session['callsign']}! Вы вошли как {session['role'].upper()}.\n"
-        emit('terminal_output', {'output': welcome_message})
-        ui_data = {'role': session['role'], 'callsign': session['callsign'], 'squad': session['squad'], 'show_ui_panel': True}
-        if session['role'] == 'syndicate':
-            ui_data['squad_frequencies'] = SQUAD_FREQUENCIES
-            ui_data['channel_frequency'] = "Н/Д"
-        else:
-            ui_data['channel_frequency'] = SQUAD_FREQUENCIES.get(session.get('squad'), '--:--')
-        emit('update_ui_state', ui_data, room=request.sid)
+        outbound.send(request.sid, 'terminal_output', {'output': welcome_message})
         return
     log_terminal_event("login_failure", user_info, "Попытка входа не удалась: неверный UID или ключ доступа.")
-    emit('login_failure', {'message': "❌ Ошибка: Неверный UID или ключ доступа. Повторите попытку."}, room=request.sid)
+    outbound.send(request.sid, 'login_failure', {'message': "❌ Ошибка: Неверный UID или ключ доступа. Повторите попытку."})
+
+def start_session(user):
+    """
+    Открывает сессию пользователя на текущем sid (вход по ключу или по токену возобновления):
+    сессия, присутствие, комнаты и состояние интерфейса вместе с новым токеном возобновления.
+    """
+    uid = str(user.get('UID'))
+    session['uid'] = uid
+    session['role'] = user.get("Роль")
+    session['callsign'] = user.get("Позывной")
+    session['squad'] = user.get("Отряд")
+    session.permanent = True
+    leave_session_rooms(presence.get(request.sid))
+    presence.set_session(request.sid, session['uid'], session['callsign'], session['role'], session['squad'])
+    join_room(user_room(session['uid']))
+    if session['role'] in ["operative", "commander"]:
+        if has_squad(session['squad']):
+            join_room(session['squad'])
+    if session['role'] == "syndicate":
+        join_room(SYNDICATE_ROOM)
+    ui_data = {'role': session['role'], 'callsign': session['callsign'], 'squad': session['squad'], 'show_ui_panel': True,
+               'resume_token': resume_tokens.issue(uid, data_store.key_digest(uid))}
+    squad_frequencies = shared_state.frequencies()
+    if session['role'] == 'syndicate':
+        ui_data['squad_frequencies'] = squad_frequencies
+        ui_data['channel_frequency'] = "Н/Д"
+    else:
+        ui_data['channel_frequency'] = squad_frequencies.get(session.get('squad'), '--:--')
+    outbound.send(request.sid, 'update_ui_state', ui_data)
 
 @socketio.on('terminal_input')
+@metrics.timed(metrics.COMMAND_SECONDS, command_metric_label)
 def handle_terminal_input(data):
-    global ROLE_PERMISSIONS, COMMAND_DESCRIPTIONS, SQUAD_FREQUENCIES, ACCESS_KEYS, KEY_TO_ROLE
-
     command = data.get('command', '').strip()
     current_role = session.get('role', 'guest')
     user_uid = session.get('uid', 'N/A')
@@ -211,510 +428,673 @@ def handle_terminal_input(data):
     user_squad = session.get('squad', 'None')
     user_info = f"UID:{user_uid}, Callsign:{user_callsign}, Role:{current_role}"
 
-    log_terminal_event("command_input", user_info, f"Команда: '{command}'")
-
     parts = command.split(" ", 1)
     base_command = parts[0].lower()
     args = parts[1] if len(parts) > 1 else ""
 
-    output = ""
+    # Лимит проверяется до записи в лог: зажатый Enter не должен расходовать квоту API.
+    cost, writes_storage = commands.cost_of(base_command, current_role)
+    throttled = rate_limiter.throttle(request.sid, session.get('uid'), cost, cost if writes_storage else 0)
+    if throttled is not None:
+        throttle_reply(request.sid, throttled)
+        return
+
+    log_terminal_event("command_input", user_info, f"Команда: '{command}'")
 
     if base_command == "login":
         login_parts = args.split(" ")
         if len(login_parts) == 2:
             uid, key = login_parts
             login({'uid': uid, 'key': key})
-            return
         else:
-            output = "ℹ️ Использование: login <UID> <ключ_доступа>\n"
-            emit('terminal_output', {'output': output + '\n'}, room=request.sid)
-            return
-
-    if base_command not in ROLE_PERMISSIONS.get(current_role, []):
-        output = (f"❓ Неизвестная команда: '{base_command}' или недоступна для вашей роли ({current_role}).\n"
-                  "Введите 'help' для списка команд.\n")
-    elif base_command == "help":
-        output = "--- 📖 СПИСОК ДОСТУПНЫХ КОМАНД ---\n"
-        for cmd in sorted(ROLE_PERMISSIONS.get(current_role, [])):
-            description = COMMAND_DESCRIPTIONS.get(cmd, "Нет описания.")
-            output += f"- {cmd}: {description}\n"
-        output += "---------------------------------\n"
-    elif base_command == "clear":
-        emit('terminal_output', {'output': "<CLEAR_TERMINAL>\n"}, room=request.sid)
+            outbound.send(request.sid, 'terminal_output', {'output': "ℹ️ Использование: login <UID> <ключ_доступа>\n\n"})
         return
-    elif base_command == "ping":
-        output = "📡 Пинг: 42мс (стабильно)\n"
-
-    elif base_command == "sendmsg":
-        if current_role not in ["operative", "commander", "syndicate"]:
-            output = "❌ Ошибка: Команда 'sendmsg' доступна только для Оперативников, Командиров и Синдиката.\n"
-        elif not args:
-            output = "ℹ️ Использование: sendmsg <сообщение> ИЛИ sendmsg <UID_получателя> <сообщение>\n"
-        else:
-            msg_parts = args.split(" ", 1)
-            target_id_or_msg = msg_parts[0]
-            message_text_if_private = msg_parts[1] if len(msg_parts) > 1 else ""
-            load_data_from_sheets()
-
-            if message_text_if_private and target_id_or_msg in REGISTERED_USERS:
-                target_uid = target_id_or_msg
-                target_callsign = REGISTERED_USERS[target_uid]['Позывной']
-                target_sid = next((sid for sid, user_data in active_users.items() if user_data.get('uid') == target_uid), None)
-                if target_sid:
-                    log_message_to_sheet(user_uid, user_callsign, user_squad, 'private', target_uid, message_text_if_private)
-                    emit('terminal_output', {'output': f"💬 [ЛИЧНО] От {user_callsign}: {message_text_if_private}\n"}, room=target_sid)
-                    output = f"✅ Сообщение отправлено '{target_callsign}'.\n"
-                    log_terminal_event("message_sent", user_info, f"Личное сообщение для {target_callsign} (UID:{target_uid}): '{message_text_if_private}'")
-                else:
-                    output = f"❌ Ошибка: Пользователь '{target_callsign}' (UID: {target_uid}) не в сети.\n"
-            else:
-                full_message = args
-                if current_role == "syndicate":
-                    log_message_to_sheet(user_uid, user_callsign, user_squad, 'global', 'all', full_message)
-                    emit('terminal_output', {'output': f"📢 [ГЛОБАЛ] Синдикат {user_callsign}: {full_message}\n"}, broadcast=True)
-                    output = "✅ Глобальное сообщение отправлено.\n"
-                    log_terminal_event("message_sent", user_info, f"Глобальное сообщение: '{full_message}'")
-                elif user_squad and user_squad.lower() != 'none':
-                    log_message_to_sheet(user_uid, user_callsign, user_squad, 'squad', user_squad, full_message)
-                    message_to_send = f"💬 [{user_squad.upper()}] {user_callsign}: {full_message}\n"
-                    emit('terminal_output', {'output': message_to_send}, room=user_squad)
-                    output = f"✅ Сообщение отправлено в отряд {user_squad.upper()}.\n"
-                    log_terminal_event("message_sent", user_info, f"Сообщение в отряд {user_squad}: '{full_message}'")
-                else:
-                    output = "❌ Ошибка: Не указан получатель или вы не состоите в отряде.\n"
-
-    elif base_command == "msghistory" and current_role in ["operative", "commander"]:
-        if not user_squad or user_squad.lower() == 'none':
-            output = "❌ Ошибка: Вы не состоите в отряде, чтобы просматривать историю сообщений.\n"
-        else:
-            output = f"--- 📜 ИСТОРИЯ СООБЩЕНИЙ ОТРЯДА: {user_squad.upper()} (последние 20) ---\n"
-            all_messages = google_sheets_api.get_all_records(MESSAGES_SHEET_NAME)
-            
-            squad_messages = [
-                msg for msg in all_messages
-                if msg.get('Recipient_Type') == 'squad' and msg.get('Recipient_ID') == user_squad
-            ]
-
-            if not squad_messages:
-                output += "  Сообщений пока нет.\n"
-            else:
-                squad_messages.sort(key=lambda x: x.get('Timestamp', ''))
-                recent_messages = squad_messages[-20:]
-                
-                for msg in recent_messages:
-                    ts = msg.get('Timestamp', '----')
-                    sender = msg.get('Sender_Callsign', 'Неизвестный')
-                    text = msg.get('Message_Text', '')
-                    output += f"  [{ts}] {sender}: {text}\n"
-
-            output += "--------------------------------------------------------\n"
-
-    elif base_command == "exit":
-        if current_role == "guest":
-            output = "ℹ️ Вы уже находитесь в режиме Гостя. Для входа в систему используйте 'login'.\n"
-        else:
-            if session.get('squad') and session['squad'].lower() != 'none':
-                leave_room(session['squad'])
-            if current_role == "syndicate":
-                leave_room("syndicate_room")
-            
-            if request.sid in active_operatives:
-                del active_operatives[request.sid]
-            
-            if request.sid in active_users:
-                active_users[request.sid] = {'uid': None, 'callsign': None, 'role': 'guest', 'squad': None}
-
-            log_terminal_event("logout", user_info, "Выход из системы.")
-            session.clear()
-            session['role'] = 'guest'
-            session['uid'] = None
-            session['callsign'] = None
-            session['squad'] = None
-            output = "🔌 Вы вышли из системы. Роль сброшена до гостя.\n"
-            socketio.emit('update_ui_state', {'role': 'guest', 'show_ui_panel': False}, room=request.sid)
-
-    elif base_command == "resetkeys" and current_role == "syndicate":
-        role_to_reset = args.strip().lower()
-        if role_to_reset == "заказчик":
-            role_to_reset = "client"
-
-        if not role_to_reset or role_to_reset not in ["operative", "commander", "client"]:
-            output = "ℹ️ Использование: resetkeys <operative | commander | client>\n"
-        elif role_to_reset not in ACCESS_KEYS:
-            output = f"❌ Ошибка: Роль '{role_to_reset}' не найдена в системе ключей.\n"
-        else:
-            num_keys = len(ACCESS_KEYS[role_to_reset])
-            if num_keys == 0:
-                output = f"ℹ️ Для роли '{role_to_reset}' не задано количество ключей. Сброс невозможен.\n"
-            else:
-                new_keys_for_role = [secrets.token_hex(4) for _ in range(num_keys)]
-                ACCESS_KEYS[role_to_reset] = new_keys_for_role
-
-                KEY_TO_ROLE.clear()
-                for role, keys_list in ACCESS_KEYS.items():
-                    for key in keys_list:
-                        KEY_TO_ROLE[key] = role
-                
-                output = f"--- 🔑 Сгенерированы новые ключи для роли '{role_to_reset.upper()}'. ---\n"
-                output += "ВНИМАНИЕ: Для применения этих ключей обновите переменную окружения 'ACCESS_KEYS_JSON' и перезапустите приложение.\n"
-                output += f"{role_to_reset.upper()}: {', '.join(new_keys_for_role)}\n"
-                log_terminal_event("syndicate_action", user_info, f"Сгенерированы новые ключи для роли: {role_to_reset}.")
-
-    elif base_command == "viewkeys" and current_role == "syndicate":
-        output = "--- 🔑 ТЕКУЩИЕ АКТИВНЫЕ КЛЮЧИ ДОСТУПА ---\n"
-        for role, keys in ACCESS_KEYS.items():
-            if role == "guest": continue
-            output += f"{role.upper()}: {', '.join(keys)}\n"
-        output += "--------------------------------------\n"
-
-    elif base_command == "register_user" and current_role == "syndicate":
-        reg_parts = args.split(" ", 3)
-        if len(reg_parts) < 4:
-            output = "ℹ️ Использование: register_user <ключ> <UID> <позывной> <отряд|NONE>\n"
-        else:
-            key, uid, callsign, squad_input = reg_parts
-            squad_input = squad_input.lower()
-
-            load_data_from_sheets() 
-
-            key_is_used = any(user.get("Ключ Доступа") == key for user in REGISTERED_USERS.values())
-            
-            if key_is_used:
-                output = f"❌ Ошибка: Ключ '{key}' уже используется другим пользователем.\n"
-            elif uid in REGISTERED_USERS:
-                output = f"❌ Ошибка: Пользователь с UID '{uid}' уже зарегистрирован.\n"
-            else:
-                role_from_key = KEY_TO_ROLE.get(key)
-                if not role_from_key:
-                    output = "❌ Ошибка: Указанный ключ доступа недействителен.\n"
-                else:
-                    squad_to_assign = "None"
-                    if role_from_key in ["operative", "commander"]:
-                        if squad_input not in ["alpha", "beta"]:
-                            output = "❌ Ошибка: Для оперативника/командира отряд должен быть 'alpha' или 'beta'.\n"; emit('terminal_output', {'output': output}); return
-                        squad_to_assign = squad_input
-                        
-                        commander_count = sum(1 for u in REGISTERED_USERS.values() if u.get('Роль') == 'commander' and u.get('Отряд') == squad_to_assign)
-                        if role_from_key == "commander" and commander_count >= 1:
-                            output = f"❌ Ошибка: В отряде '{squad_to_assign}' уже есть Командир.\n"; emit('terminal_output', {'output': output}); return
-
-                    user_data_row = [uid, key, role_from_key, callsign, squad_to_assign]
-                    if google_sheets_api.append_row('Пользователи', user_data_row):
-                        REGISTERED_USERS[uid] = {"UID": uid, "Ключ Доступа": key, "Роль": role_from_key, "Позывной": callsign, "Отряд": squad_to_assign}
-                        output = f"✅ Пользователь '{callsign}' (UID: {uid}) с ролью '{role_from_key.upper()}' зарегистрирован.\n"
-                        if squad_to_assign not in [None, "None", "none"]:
-                            output += f"Привязан к отряду: {squad_to_assign.upper()}.\n"
-                        log_terminal_event("syndicate_action", user_info, f"Зарегистрирован пользователь: UID={uid}, Callsign={callsign}.")
-                    else:
-                        output = "❌ Ошибка: Не удалось зарегистрировать пользователя в Google Таблицах.\n"
-
-    elif base_command == "unregister_user" and current_role == "syndicate":
-        target_uid = args.strip()
-        if not target_uid:
-            output = "ℹ️ Использование: unregister_user <UID>\n"
-        else:
-            load_data_from_sheets()
-            if target_uid not in REGISTERED_USERS:
-                output = f"❌ Ошибка: Пользователь с UID '{target_uid}' не найден.\n"
-            else:
-                callsign_to_remove = REGISTERED_USERS[target_uid].get('Позывной')
-                if google_sheets_api.delete_row_by_key('Пользователи', 'UID', target_uid):
-                    del REGISTERED_USERS[target_uid]
-                    output = f"✅ Пользователь '{callsign_to_remove}' (UID: {target_uid}) успешно деактивирован.\n"
-                    log_terminal_event("syndicate_action", user_info, f"Дерегистрирован пользователь: UID={target_uid}.")
-                else:
-                    output = "❌ Ошибка: Не удалось деактивировать пользователя в Google Таблицах.\n"
-
-    elif base_command == "setchannel" and current_role == "commander":
-        new_frequency = args.strip()
-        user_squad = session.get('squad')
-
-        if not new_frequency:
-            output = "ℹ️ Использование: setchannel <новая_частота>\n"
-        elif not user_squad or user_squad not in SQUAD_FREQUENCIES:
-            output = "❌ Ошибка: Вы не приписаны к отряду, для которого можно сменить частоту.\n"
-        else:
-            SQUAD_FREQUENCIES[user_squad] = new_frequency
-            output = f"✅ Частота для отряда {user_squad.upper()} установлена на {new_frequency}.\n"
-            log_terminal_event("commander_action", user_info, f"Сменил частоту отряда {user_squad} на {new_frequency}")
-
-            for sid, user_data in list(active_users.items()):
-                if user_data.get('squad') == user_squad:
-                    socketio.emit('update_ui_state', {'channel_frequency': new_frequency}, room=sid, namespace='/')
-                    if sid != request.sid:
-                        socketio.emit('terminal_output', {'output': f"📢 КОМАНДИР {session['callsign']} сменил частоту вашего отряда на {new_frequency}.\n"}, room=sid, namespace='/')
-            
-            socketio.emit('update_ui_state', {'squad_frequencies': SQUAD_FREQUENCIES}, room='syndicate_room', namespace='/')
-    
-    elif base_command == "view_users" and current_role == "syndicate":
-        output = "--- 👥 ЗАРЕГИСТРИРОВАННЫЕ ПОЛЬЗОВАТЕЛИ ---\n"
-        load_data_from_sheets() 
-        if REGISTERED_USERS:
-            for uid, user_data in REGISTERED_USERS.items():
-                output += (f"  UID: {user_data.get('UID', 'N/A')}, Позывной: {user_data.get('Позывной', 'N/A')}, "
-                           f"Роль: {user_data.get('Роль', 'N/A').upper()}, Отряд: {user_data.get('Отряд', 'N/A').upper()}\n")
-        else:
-            output += "  Нет зарегистрированных пользователей.\n"
-        output += "---------------------------------------\n"
-    
-    elif base_command == "view_users_squad" and current_role == "commander":
-        output = f"--- 👥 ОПЕРАТИВНИКИ В ОТЯДЕ {session['squad'].upper()} ---\n"
-        load_data_from_sheets()
-        found_operatives = False
-        for uid, user_data in REGISTERED_USERS.items():
-            if user_data.get('Роль') == 'operative' and user_data.get('Отряд') == session['squad']:
-                output += (f"  UID: {user_data.get('UID', 'N/A')}, Позывной: {user_data.get('Позывной', 'N/A')}\n")
-                found_operatives = True
-        if not found_operatives:
-            output += "  Нет оперативников в вашем отряде.\n"
-        output += "---------------------------------------\n"
-
-    elif base_command == "contracts":
-        load_data_from_sheets() 
-        output = "--- 📋 Активные контракты ---\n"
-        found = False
-        user_squad = session.get('squad')
-        for contract in CONTRACTS:
-            status = str(contract.get('Статус', '')).lower()
-            if status not in ["провален", "выполнен", "failed", "completed"]:
-                assignee = contract.get('Назначено', 'None')
-                assignee_display = assignee if assignee != 'None' else "Никому"
-                
-                if assignee != 'None' and assignee not in ['alpha', 'beta', 'alpha,beta'] and current_role != 'syndicate':
-                    assignee_squad = next((u.get('Отряд') for u in REGISTERED_USERS.values() if u.get('Позывной') == assignee), None)
-                    if user_squad and assignee_squad and user_squad != assignee_squad:
-                         assignee_display = "(другой отряд)"
-                         
-                output += f"ID: {contract.get('ID')}, Название: {contract.get('Название')}, Статус: {status.upper()}, Назначен: {assignee_display}\n"
-                found = True
-        if not found:
-            output += "  Нет контрактов в работе.\n"
-        output += "--------------------------\n"
-    
-    elif base_command == "assign_contract" and current_role == "commander":
-        assign_parts = args.split(" ")
-        if len(assign_parts) < 2:
-            output = "ℹ️ Использование: assign_contract <ID_контракта> <UID_оперативника>\n"
-        else:
-            try:
-                contract_id = int(assign_parts[0])
-                target_uid = assign_parts[1]
-                load_data_from_sheets()
-                target_contract = next((c for c in CONTRACTS if c.get('ID') == contract_id), None)
-                
-                if not target_contract:
-                    output = f"❌ Контракт с ID '{contract_id}' не найден.\n"
-                else:
-                    is_self_assign = (target_uid == session.get('uid'))
-                    target_user_data = REGISTERED_USERS.get(target_uid)
-                    
-                    target_callsign = None
-                    if is_self_assign:
-                        target_callsign = session.get('callsign')
-                    elif target_user_data and target_user_data.get('Роль') == 'operative' and target_user_data.get('Отряд') == session.get('squad'):
-                        target_callsign = target_user_data.get('Позывной')
-                    
-                    if target_callsign:
-                        updates = {'Назначено': target_callsign, 'Статус': 'Назначен'}
-                        if google_sheets_api.update_row_by_key('Контракты', 'ID', contract_id, updates):
-                            output = f"✅ Контракт ID:{contract_id} назначен: {target_callsign}.\n"
-                            log_terminal_event("commander_action", user_info, f"Назначил контракт {contract_id} на {target_uid}")
-                        else:
-                            output = "❌ Ошибка обновления контракта в Google Sheets.\n"
-                    else:
-                        output = f"❌ UID '{target_uid}' не является оперативником вашего отряда или неверный.\n"
-
-            except ValueError:
-                output = "❌ ID контракта должен быть числом.\n"
-
-    elif base_command == "view_orders" and current_role == "operative":
-        output = "--- 📝 ВАШИ НАЗНАЧЕНИЯ ---\n"
-        load_data_from_sheets() 
-        found_orders = False
-        for contract in CONTRACTS:
-            if contract.get('Назначено') == session['callsign']:
-                output += (f"  ID: {contract.get('ID', 'N/A')}, Название: {contract.get('Название', 'N/A')},\n"
-                           f"  Описание: {contract.get('Описание', 'N/A')},\n"
-                           f"  Награда: {contract.get('Награда', 'N/A')}, Статус: {contract.get('Статус', 'N/A')}\n")
-                found_orders = True
-        if not found_orders: output += "  У вас нет текущих назначений.\n"
-        output += "---------------------------\n"
-        
-    elif base_command == "view_contract" and current_role in ["operative", "commander"]:
-        contract_id_str = args.strip()
-        if not contract_id_str:
-            output = "ℹ️ Использование: view_contract <ID_контракта>\n"
-        else:
-            try:
-                contract_id = int(contract_id_str)
-                load_data_from_sheets()
-                target_contract = next((c for c in CONTRACTS if c.get('ID') == contract_id), None)
-
-                if not target_contract:
-                    output = f"❌ Контракт с ID '{contract_id}' не найден.\n"
-                else:
-                    user_squad = session.get('squad')
-                    user_callsign = session.get('callsign')
-                    assignee = str(target_contract.get('Назначено', '')).lower()
-                    
-                    can_view = False
-                    if assignee == user_callsign.lower():
-                        can_view = True
-                    elif user_squad and user_squad in assignee.split(','):
-                        can_view = True
-                    
-                    if not can_view:
-                        output = f"❌ У вас нет доступа к деталям этого контракта (ID: {contract_id}).\n"
-                    else:
-                        output = f"--- 📜 ДЕТАЛИ КОНТРАКТА ID: {target_contract.get('ID')} ---\n"
-                        output += f"  Название: {target_contract.get('Название', 'Н/Д')}\n"
-                        output += f"  Описание: {target_contract.get('Описание', 'Н/Д')}\n"
-                        output += f"  Награда:  {target_contract.get('Награда', 'Н/Д')}\n"
-                        output += f"  Статус:   {target_contract.get('Статус', 'Н/Д').upper()}\n"
-                        output += f"  Назначен: {target_contract.get('Назначено', 'Н/Д')}\n"
-                        output += "--------------------------------------\n"
-                        log_terminal_event("action", user_info, f"Просмотрел детали контракта ID:{contract_id}")
-
-            except ValueError:
-                output = "❌ ID контракта должен быть числом.\n"
-                
-    elif base_command == "create_request" and current_role == "client":
-        req_parts = args.split(" ", 2)
-        if len(req_parts) < 3:
-            output = "ℹ️ Использование: create_request <ID_Discord> <Причина> <Текст запроса>\n"
-        else:
-            discord_id, reason, request_text = req_parts
-            load_data_from_sheets()
-            valid_ids = [req.get('ID Запроса', 0) for req in PENDING_REQUESTS if isinstance(req.get('ID Запроса'), int)]
-            next_request_id = max(valid_ids) + 1 if valid_ids else 1
-            
-            request_data_row = [next_request_id, session['uid'], session['callsign'], discord_id, reason, request_text, 'Новый']
-            
-            if google_sheets_api.append_row('Запросы Клиентов', request_data_row):
-                output = f"✅ Ваш запрос (ID: {next_request_id}) отправлен.\n"
-                log_terminal_event("client_action", user_info, f"Создан запрос ID={next_request_id}")
-                socketio.emit('terminal_output', {'output': f"🔔 Новый запрос от клиента {session['callsign']} (ID: {next_request_id})!\n"}, room="syndicate_room")
-            else:
-                output = "❌ Ошибка создания запроса в Google Sheets.\n"
-    
-    elif base_command == "syndicate_assign" and current_role == "syndicate":
-        assign_parts = args.split(" ")
-        if len(assign_parts) != 2:
-            output = "ℹ️ Использование: syndicate_assign <ID_контракта> <alpha|beta|alpha,beta>\n"
-        else:
-            try:
-                contract_id = int(assign_parts[0])
-                squads_str = assign_parts[1].lower()
-                
-                if not all(s in ["alpha", "beta"] for s in squads_str.split(',')):
-                    output = "❌ Неверное имя отряда. Допустимы: alpha, beta, alpha,beta.\n"
-                else:
-                    load_data_from_sheets()
-                    if any(c.get('ID') == contract_id for c in CONTRACTS):
-                        updates = {'Назначено': squads_str, 'Статус': 'Назначен'}
-                        if google_sheets_api.update_row_by_key('Контракты', 'ID', contract_id, updates):
-                             output = f"✅ Контракт ID:{contract_id} назначен отряду(ам): {squads_str}.\n"
-                             log_terminal_event("syndicate_action", user_info, f"Назначил контракт {contract_id} на {squads_str}")
-                        else:
-                            output = "❌ Ошибка обновления контракта в Google Sheets.\n"
-                    else:
-                        output = f"❌ Контракт с ID '{contract_id}' не найден.\n"
-            except ValueError:
-                output = "❌ ID контракта должен быть числом.\n"
-        
-    elif base_command == "view_my_requests" and current_role == "client":
-        output = "--- ✉️ ВАШИ ЗАПРОСЫ ---\n"
-        load_data_from_sheets() 
-        found_requests = False
-        for req in PENDING_REQUESTS:
-            if req.get('UID Клиента') == session['uid']:
-                output += (f"  ID: {req.get('ID Запроса', 'N/A')}, Статус: {req.get('Статус', 'N/A')},\n"
-                           f"  Текст: {req.get('Текст Запроса', 'N/A')}\n")
-                found_requests = True
-        if not found_requests: output += "  У вас пока нет запросов.\n"
-        output += "-----------------------\n"
-
-    elif base_command == "viewrequests" and current_role == "syndicate":
-        output = "--- ✉️ ЗАПРОСЫ КЛИЕНТОВ (ОЖИДАЮЩИЕ) ---\n"
-        load_data_from_sheets() 
-        found_requests = False
-        for req in PENDING_REQUESTS:
-            if req.get('Статус', '').lower() == 'новый':
-                output += (f"  ID: {req.get('ID Запроса', 'N/A')}, От: {req.get('Позывной Клиента', 'N/A')} (UID: {req.get('UID Клиента', 'N/A')}),\n"
-                           f"  Текст: {req.get('Текст Запроса', 'N/A')}\n")
-                found_requests = True
-        if not found_requests: output += "  Нет ожидающих запросов.\n"
-        output += "--------------------------------------\n"
-
-    elif base_command == "acceptrequest" and current_role == "syndicate":
-        req_parts = args.split(" ", 3)
-        if len(req_parts) < 4:
-            output = "ℹ️ Использование: acceptrequest <ID_запроса> <название_контракта> <описание> <награда>\n"
-        else:
-            try:
-                request_id = int(req_parts[0])
-                contract_title, contract_description, contract_reward = req_parts[1], req_parts[2], req_parts[3]
-                load_data_from_sheets() 
-                target_request = next((r for r in PENDING_REQUESTS if r.get('ID Запроса') == request_id), None)
-                if not target_request:
-                    output = f"❌ Ошибка: Запрос с ID '{request_id}' не найден.\n"
-                elif target_request.get('Статус', '').lower() != 'новый':
-                    output = f"❌ Ошибка: Запрос с ID '{request_id}' уже был обработан.\n"
-                else:
-                    if google_sheets_api.update_row_by_key('Запросы Клиентов', 'ID Запроса', request_id, {'Статус': 'Принят'}):
-                        valid_c_ids = [c['ID'] for c in CONTRACTS if isinstance(c.get('ID'), int)]
-                        next_contract_id = max(valid_c_ids) + 1 if valid_c_ids else 1
-                        contract_data_row = [next_contract_id, contract_title, contract_description, contract_reward, 'active', 'None']
-                        if google_sheets_api.append_row('Контракты', contract_data_row):
-                            target_request['Статус'] = 'Принят'
-                            CONTRACTS.append({"ID": next_contract_id, "Название": contract_title, "Описание": contract_description, "Награда": contract_reward, "Статус": "active", "Назначено": "None"})
-                            output = (f"✅ Запрос ID:{request_id} принят. Создан контракт (ID: {next_contract_id}) '{contract_title}'.\n")
-                            log_terminal_event("syndicate_action", user_info, f"Принят запрос ID:{request_id}, создан контракт ID:{next_contract_id}.")
-                            client_sid = next((sid for sid, data in active_users.items() if data.get('uid') == target_request.get('UID Клиента')), None)
-                            if client_sid:
-                                socketio.emit('terminal_output', {'output': f"🔔 Ваш запрос (ID: {request_id}) был ПРИНЯТ Синдикатом!\n"}, room=client_sid)
-                        else:
-                            google_sheets_api.update_row_by_key('Запросы Клиентов', 'ID Запроса', request_id, {'Статус': 'Новый'})
-                            output = "❌ Ошибка: Не удалось создать контракт в Google Таблицах.\n"
-                    else:
-                        output = "❌ Ошибка: Не удалось обновить статус запроса в Google Таблицах.\n"
-            except ValueError:
-                output = "❌ Ошибка: ID запроса должен быть числом.\n"
-                emit('terminal_output', {'output': output})
-                return
-
-    elif base_command == "declinerequest" and current_role == "syndicate":
-        parts = args.split(" ")
-        if not parts or not parts[0]:
-            output = "ℹ️ Использование: declinerequest <ID_запроса>\n"
-        else:
-            try:
-                request_id = int(parts[0])
-                load_data_from_sheets() 
-                target_request = next((r for r in PENDING_REQUESTS if r.get('ID Запроса') == request_id), None)
-                if not target_request:
-                    output = f"❌ Ошибка: Запрос с ID '{request_id}' не найден.\n"
-                elif target_request.get('Статус', '').lower() != 'новый':
-                    output = f"❌ Ошибка: Запрос с ID '{request_id}' уже был обработан.\n"
-                else:
-                    if google_sheets_api.update_row_by_key('Запросы Клиентов', 'ID Запроса', request_id, {'Статус': 'Отклонен'}):
-                        target_request['Статус'] = 'Отклонен'
-                        output = f"✅ Запрос ID:{request_id} отклонен.\n"
-                        log_terminal_event("syndicate_action", user_info, f"Отклонен запрос ID:{request_id}.")
-                        client_sid = next((sid for sid, data in active_users.items() if data.get('uid') == target_request.get('UID Клиента')), None)
-                        if client_sid:
-                            socketio.emit('terminal_output', {'output': f"🔔 Ваш запрос (ID: {request_id}) был ОТКЛОНЕН Синдикатом!\n"}, room=client_sid)
-                    else:
-                        output = "❌ Ошибка: Не удалось отклонить запрос в Google Таблицах.\n"
-            except ValueError:
-                output = "❌ Ошибка: ID запроса должен быть числом.\n"
-                emit('terminal_output', {'output': output})
-                return
+
+    ctx = CommandContext(request.sid, current_role, user_uid, user_callsign, user_squad, args)
+    output = commands.dispatch(base_command, ctx, storage.is_available)
+    if output is not None:
+        outbound.send(request.sid, 'terminal_output', {'output': output + '\n'})
+
+# --- Команды терминала ---
+# Каждая команда регистрируется в таблице commands: роли, описание для help и разбор аргументов.
+# Обработчик получает CommandContext и список аргументов и возвращает текст ответа.
+
+@commands.command("help", roles=ALL_ROLES, description="Отображает список доступных команд.")
+def cmd_help(ctx, argv):
+    return commands.help_text(ctx.role)
+
+@commands.command("login", roles=("guest",), description="Вход в систему. login <UID> <ключ>")
+def cmd_login(ctx, argv):
+    # Обрабатывается в handle_terminal_input до проверки прав; запись нужна для help.
+    return None
+
+@commands.command("clear", roles=ALL_ROLES, description="Очищает окно терминала.")
+def cmd_clear(ctx, argv):
+    outbound.send(ctx.sid, 'terminal_output', {'output': "<CLEAR_TERMINAL>\n"})
+    return None
+
+@commands.command("ping", roles=ALL_ROLES, description="Проверяет соединение.")
+def cmd_ping(ctx, argv):
+    stats = latency.stats(ctx.sid)
+    if stats is None:
+        return "📡 Пинг: замеров еще нет, повторите через несколько секунд.\n"
+    quality = "нестабильно" if stats['jitter'] > RTT_UNSTABLE_JITTER_MS else "стабильно"
+    output = f"📡 Пинг: {stats['last']:.0f}мс ({quality})\n"
+    output += f"  Среднее {stats['avg']:.0f}мс, p95 {stats['p95']:.0f}мс, джиттер {stats['jitter']:.0f}мс "
+    output += f"по {stats['samples']} замерам, транспорт: {stats['transport'] or 'неизвестен'}\n"
+    return output
+
+@commands.command("refresh", roles=("syndicate",), description="Принудительно перечитать данные из хранилища.",
+                  writes_storage=True, cost=5)
+def cmd_refresh(ctx, argv):
+    version = data_store.refresh()
+    log_terminal_event("syndicate_action", ctx.user_info, "Принудительное обновление данных.")
+    return f"✅ Данные перечитаны из хранилища (версия {version}).\n"
+
+@commands.command("sendmsg", roles=("operative", "commander", "syndicate"),
+                  description="Отправляет сообщение. sendmsg <сообщение> | sendmsg <UID> <сообщение>",
+                  usage="sendmsg <сообщение> ИЛИ sendmsg <UID_получателя> <сообщение>", min_args=1, maxsplit=1, cost=2)
+def cmd_sendmsg(ctx, argv):
+    target_id_or_msg = argv[0]
+    message_text_if_private = argv[1] if len(argv) > 1 else ""
+    registered_users = data_store.users
+
+    if message_text_if_private and target_id_or_msg in registered_users:
+        target_uid = target_id_or_msg
+        target_callsign = registered_users[target_uid]['Позывной']
+        if not presence.is_online(target_uid):
+            return f"❌ Ошибка: Пользователь '{target_callsign}' (UID: {target_uid}) не в сети.\n"
+        log_message_to_sheet(ctx.uid, ctx.callsign, ctx.squad, 'private', target_uid, message_text_if_private)
+        deliver(user_room(target_uid), 'terminal_output', {'output': f"💬 [ЛИЧНО] От {ctx.callsign}: {message_text_if_private}\n"})
+        log_terminal_event("message_sent", ctx.user_info, f"Личное сообщение для {target_callsign} (UID:{target_uid}): '{message_text_if_private}'")
+        return f"✅ Сообщение отправлено '{target_callsign}'.\n"
+
+    full_message = ctx.args
+    if ctx.role == "syndicate":
+        log_message_to_sheet(ctx.uid, ctx.callsign, ctx.squad, 'global', 'all', full_message)
+        deliver(None, 'terminal_output', {'output': f"📢 [ГЛОБАЛ] Синдикат {ctx.callsign}: {full_message}\n"})
+        log_terminal_event("message_sent", ctx.user_info, f"Глобальное сообщение: '{full_message}'")
+        return "✅ Глобальное сообщение отправлено.\n"
+    if has_squad(ctx.squad):
+        log_message_to_sheet(ctx.uid, ctx.callsign, ctx.squad, 'squad', ctx.squad, full_message)
+        deliver(ctx.squad, 'terminal_output', {'output': f"💬 [{ctx.squad.upper()}] {ctx.callsign}: {full_message}\n"})
+        log_terminal_event("message_sent", ctx.user_info, f"Сообщение в отряд {ctx.squad}: '{full_message}'")
+        return f"✅ Сообщение отправлено в отряд {ctx.squad.upper()}.\n"
+    return "❌ Ошибка: Не указан получатель или вы не состоите в отряде.\n"
+
+@commands.command("msghistory", roles=("operative", "commander"),
+                  description="Показывает сообщения чата вашего отряда. msghistory [количество] [before <время>]",
+                  maxsplit=None, cost=2)
+def cmd_msghistory(ctx, argv):
+    if not has_squad(ctx.squad):
+        return "❌ Ошибка: Вы не состоите в отряде, чтобы просматривать историю сообщений.\n"
+    history_parts = ctx.args.split()
+    limit = MSGHISTORY_DEFAULT_PAGE
+    before = None
+    if history_parts and history_parts[0].isdigit():
+        limit = max(1, min(int(history_parts[0]), message_history.capacity))
+        history_parts = history_parts[1:]
+    if len(history_parts) > 1 and history_parts[0].lower() == "before":
+        before = " ".join(history_parts[1:])
+        history_parts = []
+    if history_parts:
+        return "ℹ️ Использование: msghistory [количество] [before <ГГГГ-ММ-ДД ЧЧ:ММ:СС>]\n"
+
+    output = f"--- 📜 ИСТОРИЯ СООБЩЕНИЙ ОТРЯДА: {ctx.squad.upper()} (последние {limit}) ---\n"
+    squad_messages = message_history.page('squad', ctx.squad, limit, before)
+    if not squad_messages:
+        output += "  Сообщений пока нет.\n"
+    else:
+        for msg in squad_messages:
+            ts = msg.get('Timestamp', '----')
+            sender = msg.get('Sender_Callsign', 'Неизвестный')
+            text = msg.get('Message_Text', '')
+            output += f"  [{ts}] {sender}: {text}\n"
+        oldest_ts = squad_messages[0].get('Timestamp')
+        if message_history.page('squad', ctx.squad, 1, oldest_ts):
+            output += f"  Более ранние: msghistory {limit} before {oldest_ts}\n"
+    output += "--------------------------------------------------------\n"
+    return output
+
+@commands.command("exit", roles=ALL_ROLES - {"guest"}, description="Выход из сессии.")
+def cmd_exit(ctx, argv):
+    leave_session_rooms(presence.get(ctx.sid))
+    presence.connect(ctx.sid)
+
+    log_terminal_event("logout", ctx.user_info, "Выход из системы.")
+    session.clear()
+    session['role'] = 'guest'
+    session['uid'] = None
+    session['callsign'] = None
+    session['squad'] = None
+    outbound.send(ctx.sid, 'update_ui_state', {'role': 'guest', 'show_ui_panel': False})
+    return "🔌 Вы вышли из системы. Роль сброшена до гостя.\n"
+
+@commands.command("resetkeys", roles=("syndicate",), description="Сбросить ключи доступа. resetkeys <роль>",
+                  usage="resetkeys <operative | commander | client>", min_args=1, maxsplit=None)
+def cmd_resetkeys(ctx, argv):
+    role_to_reset = argv[0].lower()
+    if role_to_reset == "заказчик":
+        role_to_reset = "client"
+
+    if role_to_reset not in ["operative", "commander", "client"]:
+        return "ℹ️ Использование: resetkeys <operative | commander | client>\n"
+    if role_to_reset not in ACCESS_KEYS:
+        return f"❌ Ошибка: Роль '{role_to_reset}' не найдена в системе ключей.\n"
+    num_keys = len(ACCESS_KEYS[role_to_reset])
+    if num_keys == 0:
+        return f"ℹ️ Для роли '{role_to_reset}' не задано количество ключей. Сброс невозможен.\n"
+
+    new_keys_for_role = [secrets.token_hex(4) for _ in range(num_keys)]
+    ACCESS_KEYS[role_to_reset] = new_keys_for_role
+    KEY_TO_ROLE.clear()
+    for role, keys_list in ACCESS_KEYS.items():
+        for key in keys_list:
+            KEY_TO_ROLE[key] = role
+
+    output = f"--- 🔑 Сгенерированы новые ключи для роли '{role_to_reset.upper()}'. ---\n"
+    output += "ВНИМАНИЕ: Для применения этих ключей обновите переменную окружения 'ACCESS_KEYS_JSON' и перезапустите приложение.\n"
+    output += f"{role_to_reset.upper()}: {', '.join(new_keys_for_role)}\n"
+    log_terminal_event("syndicate_action", ctx.user_info, f"Сгенерированы новые ключи для роли: {role_to_reset}.")
+    return output
+
+@commands.command("viewlimits", roles=("syndicate",), description="Счетчики ограничения частоты команд.")
+def cmd_viewlimits(ctx, argv):
+    stats = rate_limiter.stats()
+    throttled = stats['throttled']
+    output = "--- ⏳ ОГРАНИЧЕНИЕ ЧАСТОТЫ КОМАНД ---\n"
+    output += f"  Выполнено: {stats['allowed']}, отклонено: {sum(throttled.values())} "
+    output += f"(сессия: {throttled.get('sid', 0)}, пользователь: {throttled.get('uid', 0)}, хранилище: {throttled.get('storage', 0)})\n"
+    output += f"  Бюджет хранилища: {stats['storage_tokens']} из {stats['storage_capacity']} токенов\n"
+    if stats['top_throttled']:
+        output += "  Чаще всего ограничивались:\n"
+        for key, count in stats['top_throttled']:
+            user = data_store.users.get(key)
+            name = f"{user.get('Позывной')} (UID: {key})" if user else key
+            output += f"    {name}: {count}\n"
+    output += "--------------------------------------\n"
+    return output
+
+@commands.command("netstat", roles=("syndicate",), description="Задержка подключений (RTT) по ролям и отрядам.", cost=2)
+def cmd_netstat(ctx, argv):
+    sessions = dict(presence.sessions)
+    output = "--- 📶 СОСТОЯНИЕ ПОДКЛЮЧЕНИЙ (этот воркер) ---\n"
+    for title, key in (("Роль", lambda info: info['role']),
+                       ("Отряд", lambda info: info['squad'] if has_squad(info['squad']) else '-')):
+        groups = latency.group_stats(sessions, key)
+        output += f"  {title:<12}{'подкл.':>7}{'p50 мс':>9}{'p95 мс':>9}{'ws':>5}{'poll':>6}{'плохих':>8}\n"
+        for name, group in sorted(groups.items()):
+            output += (f"  {str(name):<12}{group['connections']:>7}{group['p50']:>9.0f}{group['p95']:>9.0f}"
+                       f"{group['websocket']:>5}{group['polling']:>6}{group['degraded']:>8}\n")
+        if not groups:
+            output += "  Замеров пока нет.\n"
+    degraded = []
+    for sid, info in sessions.items():
+        stats = latency.stats(sid)
+        if stats is not None and is_degraded(stats['p95'], stats['transport']):
+            degraded.append((stats['p95'], info, stats))
+    if degraded:
+        output += "  Деградировавшие подключения:\n"
+        for p95, info, stats in sorted(degraded, key=lambda item: item[0], reverse=True)[:10]:
+            who = f"{info['callsign']} (UID: {info['uid']})" if info['uid'] is not None else "гость"
+            output += f"    {who}, {info['role']}: p95 {p95:.0f}мс, джиттер {stats['jitter']:.0f}мс, {stats['transport'] or '?'}\n"
+    output += "--------------------------------------\n"
+    return output
+
+@commands.command("viewkeys", roles=("syndicate",), description="Просмотр текущих ключей доступа.")
+def cmd_viewkeys(ctx, argv):
+    output = "--- 🔑 ТЕКУЩИЕ АКТИВНЫЕ КЛЮЧИ ДОСТУПА ---\n"
+    for role, keys in ACCESS_KEYS.items():
+        if role == "guest": continue
+        output += f"{role.upper()}: {', '.join(keys)}\n"
+    output += "--------------------------------------\n"
+    return output
+
+@commands.command("register_user", roles=("syndicate",),
+                  description="Зарегистрировать пользователя. register_user <ключ> <UID> <позывной> <отряд>",
+                  usage="register_user <ключ> <UID> <позывной> <отряд|NONE>", min_args=4, maxsplit=3,
+                  writes_storage=True, cost=3)
+def cmd_register_user(ctx, argv):
+    key, uid, callsign, squad_input = argv
+    squad_input = squad_input.lower()
+
+    if data_store.get_user_by_key(key) is not None:
+        return f"❌ Ошибка: Ключ '{key}' уже используется другим пользователем.\n"
+    if uid in data_store.users:
+        return f"❌ Ошибка: Пользователь с UID '{uid}' уже зарегистрирован.\n"
+    role_from_key = KEY_TO_ROLE.get(key)
+    if not role_from_key:
+        return "❌ Ошибка: Указанный ключ доступа недействителен.\n"
+
+    squad_to_assign = "None"
+    if role_from_key in ["operative", "commander"]:
+        if squad_input not in ["alpha", "beta"]:
+            return "❌ Ошибка: Для оперативника/командира отряд должен быть 'alpha' или 'beta'.\n"
+        squad_to_assign = squad_input
+        if role_from_key == "commander" and data_store.get_squad_commander(squad_to_assign):
+            return f"❌ Ошибка: В отряде '{squad_to_assign}' уже есть Командир.\n"
+
+    new_user = {"UID": uid, "Ключ Доступа": key, "Роль": role_from_key, "Позывной": callsign, "Отряд": squad_to_assign}
+    if not data_store.add_user(new_user):
+        return "❌ Ошибка: Не удалось зарегистрировать пользователя в Google Таблицах.\n"
+    output = f"✅ Пользователь '{callsign}' (UID: {uid}) с ролью '{role_from_key.upper()}' зарегистрирован.\n"
+    if has_squad(squad_to_assign):
+        output += f"Привязан к отряду: {squad_to_assign.upper()}.\n"
+    log_terminal_event("syndicate_action", ctx.user_info, f"Зарегистрирован пользователь: UID={uid}, Callsign={callsign}.")
+    return output
+
+@commands.command("unregister_user", roles=("syndicate",), description="Деактивировать пользователя. unregister_user <UID>",
+                  usage="unregister_user <UID>", min_args=1, maxsplit=None, writes_storage=True, cost=3)
+def cmd_unregister_user(ctx, argv):
+    target_uid = argv[0]
+    if target_uid not in data_store.users:
+        return f"❌ Ошибка: Пользователь с UID '{target_uid}' не найден.\n"
+    callsign_to_remove = data_store.users[target_uid].get('Позывной')
+    if not data_store.remove_user(target_uid):
+        return "❌ Ошибка: Не удалось деактивировать пользователя в Google Таблицах.\n"
+    log_terminal_event("syndicate_action", ctx.user_info, f"Дерегистрирован пользователь: UID={target_uid}.")
+    return f"✅ Пользователь '{callsign_to_remove}' (UID: {target_uid}) успешно деактивирован.\n"
+
+@commands.command("setchannel", roles=("commander",), description="Установить новую частоту отряда. setchannel <частота>",
+                  usage="setchannel <новая_частота>", min_args=1, maxsplit=None)
+def cmd_setchannel(ctx, argv):
+    new_frequency = argv[0]
+    if not ctx.squad or ctx.squad not in SQUAD_FREQUENCIES:
+        return "❌ Ошибка: Вы не приписаны к отряду, для которого можно сменить частоту.\n"
+    shared_state.set_frequency(ctx.squad, new_frequency)
+    log_terminal_event("commander_action", ctx.user_info, f"Сменил частоту отряда {ctx.squad} на {new_frequency}")
+
+    deliver(ctx.squad, 'update_ui_state', {'channel_frequency': new_frequency})
+    deliver(ctx.squad, 'terminal_output', {'output': f"📢 КОМАНДИР {ctx.callsign} сменил частоту вашего отряда на {new_frequency}.\n"}, skip_sid=ctx.sid)
+    deliver(SYNDICATE_ROOM, 'update_ui_state', {'squad_frequencies': shared_state.frequencies()})
+    return f"✅ Частота для отряда {ctx.squad.upper()} установлена на {new_frequency}.\n"
+
+def send_listing(ctx, name, argv, defaults=None):
+    """
+    Страница списка по аргументам команды. Все куски, кроме последнего, уходят клиенту сразу, каждый
+    в своем окне сброса outbound (иначе он склеил бы их в один кадр); последний возвращается как ответ.
+    """
+    try:
+        chunks = paginator.page(name, ctx, argv, defaults)
+    except ValueError as e:
+        return f"❌ {e}\n"
+    return stream_chunks(ctx, chunks)
+
+def stream_chunks(ctx, chunks):
+    """Отправляет куски страницы, кроме последнего, отдельными кадрами сразу; последний возвращает команде."""
+    for chunk in chunks[:-1]:
+        outbound.send(ctx.sid, 'terminal_output', {'output': chunk})
+        outbound.flush((ctx.sid,))
+    return chunks[-1]
+
+def user_line(ctx, user_data):
+    return (f"  UID: {user_data.get('UID', 'N/A')}, Позывной: {user_data.get('Позывной', 'N/A')}, "
+            f"Роль: {user_data.get('Роль', 'N/A').upper()}, Отряд: {user_data.get('Отряд', 'N/A').upper()}\n")
+
+def user_rows(ctx, filters):
+    users = data_store.users_in_squad(filters['squad']) if 'squad' in filters else data_store.users.values()
+    if 'role' in filters:
+        users = [user for user in users if str(user.get('Роль', '')).lower() == filters['role']]
+    return sorted(users, key=lambda user: sort_key(user.get('UID')))
+
+paginator.register(Listing(
+    "view_users", header=lambda filters: "--- 👥 ЗАРЕГИСТРИРОВАННЫЕ ПОЛЬЗОВАТЕЛИ ---\n",
+    footer="---------------------------------------\n", empty="  Нет зарегистрированных пользователей.\n",
+    rows=user_rows, line=user_line, key=lambda user: user.get('UID'), filters=("squad", "role"), sheets=(USERS_SHEET_NAME,)))
+
+@commands.command("view_users", roles=("syndicate",),
+                  description="Просмотр всех пользователей. view_users [--squad S] [--role R] [--page N] [--size N]", cost=3)
+def cmd_view_users(ctx, argv):
+    return send_listing(ctx, "view_users", argv)
+
+@commands.command("view_users_squad", roles=("commander",), description="Просмотр оперативников в отряде.", cost=2)
+@render_cache.cached(lambda ctx: ctx.squad, USERS_SHEET_NAME)
+def cmd_view_users_squad(ctx, argv):
+    output = f"--- 👥 ОПЕРАТИВНИКИ В ОТЯДЕ {ctx.squad.upper()} ---\n"
+    found_operatives = False
+    for user_data in data_store.users_in_squad(ctx.squad):
+        if user_data.get('Роль') == 'operative':
+            output += (f"  UID: {user_data.get('UID', 'N/A')}, Позывной: {user_data.get('Позывной', 'N/A')}\n")
+            found_operatives = True
+    if not found_operatives:
+        output += "  Нет оперативников в вашем отряде.\n"
+    output += "---------------------------------------\n"
+    return output
+
+def contract_line(contract, role, squad):
+    """Строка контракта в списке. Назначение на бойца чужого отряда видит только Синдикат."""
+    status = str(contract.get('Статус', '')).lower()
+    assignee = contract.get('Назначено', 'None')
+    assignee_display = assignee if assignee != 'None' else "Никому"
+
+    if assignee != 'None' and assignee not in ['alpha', 'beta', 'alpha,beta'] and role != 'syndicate':
+        assignee_user = data_store.get_user_by_callsign(assignee)
+        assignee_squad = assignee_user.get('Отряд') if assignee_user else None
+        if squad and assignee_squad and squad != assignee_squad:
+            assignee_display = "(другой отряд)"
+
+    return f"ID: {contract.get('ID')}, Название: {contract.get('Название')}, Статус: {status.upper()}, Назначен: {assignee_display}"
+
+def contract_rows(ctx, filters):
+    """
+    Открытые контракты после фильтров. --status выбирает корзину индекса по статусу (закрытые статусы
+    доступны только Синдикату), --squad — контракты отряда и его бойцов (не Синдикату — только своего отряда).
+    """
+    status = filters.get('status')
+    if status is None:
+        contracts = data_store.open_contracts()
+    elif status in CLOSED_CONTRACT_STATUSES and ctx.role != 'syndicate':
+        contracts = []
+    else:
+        contracts = data_store.contracts_with_status(status)
+    squad = filters.get('squad')
+    if squad is not None:
+        if ctx.role != 'syndicate' and squad != str(ctx.squad).lower():
+            raise ValueError("Фильтр --squad доступен только для своего отряда.")
+        ids = {contract['ID'] for contract in data_store.contracts_for_squad(squad)}
+        for user in data_store.users_in_squad(squad):
+            ids.update(contract['ID'] for contract in data_store.contracts_for_assignee(user.get('Позывной')))
+        contracts = [contract for contract in contracts if contract['ID'] in ids]
+    return sorted(contracts, key=lambda contract: sort_key(contract['ID']))
+
+# Синдикат видит назначения как есть, остальным чужие отряды скрываются — отрисовка зависит от отряда.
+paginator.register(Listing(
+    "contracts", header=lambda filters: "--- 📋 Активные контракты ---\n", footer="--------------------------\n",
+    empty="  Нет контрактов в работе.\n", rows=contract_rows,
+    line=lambda ctx, contract: contract_line(contract, ctx.role, ctx.squad) + "\n", key=lambda contract: contract['ID'],
+    filters=("status", "squad"), sheets=(CONTRACTS_SHEET_NAME, USERS_SHEET_NAME),
+    scope=lambda ctx: None if ctx.role == 'syndicate' else ctx.squad))
+
+@commands.command("contracts", roles=("operative", "commander", "syndicate"),
+                  description="Просмотр активных и назначенных контрактов. contracts [--status S] [--squad S] [--page N] [--size N]",
+                  cost=3)
+def cmd_contracts(ctx, argv):
+    return send_listing(ctx, "contracts", argv)
+
+@commands.command("more", roles=("operative", "commander", "syndicate"), description="Следующая страница последнего списка.")
+def cmd_more(ctx, argv):
+    chunks = paginator.more(ctx)
+    if chunks is None:
+        return "ℹ️ Продолжать нечего: последний список показан полностью.\n"
+    return stream_chunks(ctx, chunks)
+
+@commands.command("watch", roles=("operative", "commander", "syndicate"),
+                  description="Подписка на изменения доски контрактов. watch contracts", usage="watch contracts",
+                  min_args=1, max_args=1, cost=3)
+def cmd_watch(ctx, argv):
+    if argv[0].lower() != "contracts":
+        return "ℹ️ Использование: watch contracts\n"
+    presence.watch(ctx.sid)
+    return cmd_contracts(ctx, []) + "📡 Подписка включена: изменения доски будут приходить сами. Отключить: unwatch\n"
+
+@commands.command("unwatch", roles=("operative", "commander", "syndicate"), description="Отключить подписку на доску контрактов.")
+def cmd_unwatch(ctx, argv):
+    presence.watch(ctx.sid, False)
+    return "📡 Подписка на доску контрактов отключена.\n"
+
+def push_contract_changes(sheet_names):
+    """
+    Рассылает подписчикам только изменения доски, по одной отрисовке на аудиторию (Синдикат, каждый отряд)
+    с теми же правилами видимости, что у contracts. Каждый воркер сам видит изменения данных (свои записи
+    или перечитывание по invalidate), поэтому рассылка идет только своим клиентам, без shared_state.
+    """
+    if CONTRACTS_SHEET_NAME not in sheet_names:
+        return
+    changes = contract_board.changes()
+    if not changes:
+        return
+    for squad, sids in presence.watchers_by_audience().items():
+        role = 'syndicate' if squad is None else 'operative'
+        output = "".join(f"📡 [ДОСКА] {CHANGE_LABELS[kind]}: {contract_line(contract, role, squad)}\n"
+                         for kind, contract in changes)
+        outbound.send_many(sids, 'terminal_output', {'output': output})
+
+# Снимок к этому моменту уже поднят: доска сравнивается с ним, а без снимка — с пустой доской до первой загрузки.
+contract_board.seed()
+data_store.sheet_listeners.append(push_contract_changes)
+
+@commands.command("assign_contract", roles=("commander",),
+                  description="Назначить контракт оперативнику (или себе). assign_contract <ID_контракта> <UID>",
+                  usage="assign_contract <ID_контракта> <UID_оперативника>", min_args=2, writes_storage=True, cost=3)
+def cmd_assign_contract(ctx, argv):
+    try:
+        contract_id = int(argv[0])
+    except ValueError:
+        return "❌ ID контракта должен быть числом.\n"
+    target_uid = argv[1]
+    if not data_store.get_contract(contract_id):
+        return f"❌ Контракт с ID '{contract_id}' не найден.\n"
+
+    target_user_data = data_store.users.get(target_uid)
+    target_callsign = None
+    if target_uid == ctx.uid:
+        target_callsign = ctx.callsign
+    elif target_user_data and target_user_data.get('Роль') == 'operative' and target_user_data.get('Отряд') == ctx.squad:
+        target_callsign = target_user_data.get('Позывной')
+    if not target_callsign:
+        return f"❌ UID '{target_uid}' не является оперативником вашего отряда или неверный.\n"
+
+    mutation = data_store.mutation()
+    mutation.update_contract(contract_id, {'Назначено': target_callsign, 'Статус': 'Назначен'})
+    if not mutation.commit():
+        return WRITE_CONFLICT_OUTPUT if mutation.conflict else "❌ Ошибка обновления контракта в Google Sheets.\n"
+    log_terminal_event("commander_action", ctx.user_info, f"Назначил контракт {contract_id} на {target_uid}")
+    return f"✅ Контракт ID:{contract_id} назначен: {target_callsign}.\n"
+
+@commands.command("view_orders", roles=("operative",), description="Просмотр ваших контрактов.", cost=2)
+@render_cache.cached(lambda ctx: ctx.callsign, CONTRACTS_SHEET_NAME)
+def cmd_view_orders(ctx, argv):
+    output = "--- 📝 ВАШИ НАЗНАЧЕНИЯ ---\n"
+    found_orders = False
+    for contract in data_store.contracts_for_assignee(ctx.callsign):
+        output += (f"  ID: {contract.get('ID', 'N/A')}, Название: {contract.get('Название', 'N/A')},\n"
+                   f"  Описание: {contract.get('Описание', 'N/A')},\n"
+                   f"  Награда: {contract.get('Награда', 'N/A')}, Статус: {contract.get('Статус', 'N/A')}\n")
+        found_orders = True
+    if not found_orders: output += "  У вас нет текущих назначений.\n"
+    output += "---------------------------\n"
+    return output
+
+@commands.command("view_contract", roles=("operative", "commander"),
+                  description="Просмотр деталей контракта. view_contract <ID_контракта>",
+                  usage="view_contract <ID_контракта>", min_args=1, maxsplit=None)
+def cmd_view_contract(ctx, argv):
+    try:
+        contract_id = int(argv[0])
+    except ValueError:
+        return "❌ ID контракта должен быть числом.\n"
+    target_contract = data_store.get_contract(contract_id)
+    if not target_contract:
+        return f"❌ Контракт с ID '{contract_id}' не найден.\n"
+
+    assignee = str(target_contract.get('Назначено', '')).lower()
+    can_view = assignee == ctx.callsign.lower() or bool(ctx.squad and ctx.squad in assignee.split(','))
+    if not can_view:
+        return f"❌ У вас нет доступа к деталям этого контракта (ID: {contract_id}).\n"
+
+    output = f"--- 📜 ДЕТАЛИ КОНТРАКТА ID: {target_contract.get('ID')} ---\n"
+    output += f"  Название: {target_contract.get('Название', 'Н/Д')}\n"
+    output += f"  Описание: {target_contract.get('Описание', 'Н/Д')}\n"
+    output += f"  Награда:  {target_contract.get('Награда', 'Н/Д')}\n"
+    output += f"  Статус:   {target_contract.get('Статус', 'Н/Д').upper()}\n"
+    output += f"  Назначен: {target_contract.get('Назначено', 'Н/Д')}\n"
+    output += "--------------------------------------\n"
+    log_terminal_event("action", ctx.user_info, f"Просмотрел детали контракта ID:{contract_id}")
+    return output
+
+@commands.command("create_request", roles=("client",),
+                  description="Создать запрос. create_request <ID_Discord> <Причина> <Текст запроса>",
+                  usage="create_request <ID_Discord> <Причина> <Текст запроса>", min_args=3, maxsplit=2,
+                  writes_storage=True, cost=3)
+def cmd_create_request(ctx, argv):
+    discord_id, reason, request_text = argv
+    next_request_id = data_store.allocate_request_id()
+    new_request = {"ID Запроса": next_request_id, "UID Клиента": ctx.uid, "Позывной Клиента": ctx.callsign,
+                   "Discord ID": discord_id, "Причина": reason, "Текст Запроса": request_text, "Статус": 'Новый'}
+    if not data_store.add_request(new_request):
+        return "❌ Ошибка создания запроса в Google Sheets.\n"
+    log_terminal_event("client_action", ctx.user_info, f"Создан запрос ID={next_request_id}")
+    deliver(SYNDICATE_ROOM, 'terminal_output', {'output': f"🔔 Новый запрос от клиента {ctx.callsign} (ID: {next_request_id})!\n"})
+    return f"✅ Ваш запрос (ID: {next_request_id}) отправлен.\n"
+
+@commands.command("syndicate_assign", roles=("syndicate",),
+                  description="Назначить контракт отряду(ам). syndicate_assign <ID> <alpha|beta|alpha,beta>",
+                  usage="syndicate_assign <ID_контракта> <alpha|beta|alpha,beta>", min_args=2, max_args=2,
+                  writes_storage=True, cost=3)
+def cmd_syndicate_assign(ctx, argv):
+    try:
+        contract_id = int(argv[0])
+    except ValueError:
+        return "❌ ID контракта должен быть числом.\n"
+    squads_str = argv[1].lower()
+    if not all(s in ["alpha", "beta"] for s in squads_str.split(',')):
+        return "❌ Неверное имя отряда. Допустимы: alpha, beta, alpha,beta.\n"
+    if not data_store.get_contract(contract_id):
+        return f"❌ Контракт с ID '{contract_id}' не найден.\n"
+    mutation = data_store.mutation()
+    mutation.update_contract(contract_id, {'Назначено': squads_str, 'Статус': 'Назначен'})
+    if not mutation.commit():
+        return WRITE_CONFLICT_OUTPUT if mutation.conflict else "❌ Ошибка обновления контракта в Google Sheets.\n"
+    log_terminal_event("syndicate_action", ctx.user_info, f"Назначил контракт {contract_id} на {squads_str}")
+    return f"✅ Контракт ID:{contract_id} назначен отряду(ам): {squads_str}.\n"
+
+@commands.command("view_my_requests", roles=("client",), description="Просмотр ваших запросов.", cost=2)
+@render_cache.cached(lambda ctx: ctx.uid, REQUESTS_SHEET_NAME)
+def cmd_view_my_requests(ctx, argv):
+    output = "--- ✉️ ВАШИ ЗАПРОСЫ ---\n"
+    found_requests = False
+    for req in data_store.requests_for_client(ctx.uid):
+        output += (f"  ID: {req.get('ID Запроса', 'N/A')}, Статус: {req.get('Статус', 'N/A')},\n"
+                   f"  Текст: {req.get('Текст Запроса', 'N/A')}\n")
+        found_requests = True
+    if not found_requests: output += "  У вас пока нет запросов.\n"
+    output += "-----------------------\n"
+    return output
+
+def request_line(ctx, req):
+    return (f"  ID: {req.get('ID Запроса', 'N/A')}, От: {req.get('Позывной Клиента', 'N/A')} (UID: {req.get('UID Клиента', 'N/A')}),\n"
+            f"  Текст: {req.get('Текст Запроса', 'N/A')}\n")
+
+def request_header(filters):
+    status = "ОЖИДАЮЩИЕ" if filters['status'] == 'новый' else filters['status'].upper()
+    return f"--- ✉️ ЗАПРОСЫ КЛИЕНТОВ ({status}) ---\n"
+
+paginator.register(Listing(
+    "viewrequests", header=request_header, footer="--------------------------------------\n",
+    empty="  Нет запросов с таким статусом.\n",
+    rows=lambda ctx, filters: sorted(data_store.requests_with_status(filters['status']), key=lambda req: sort_key(req['ID Запроса'])),
+    line=request_line, key=lambda req: req['ID Запроса'], filters=("status",), sheets=(REQUESTS_SHEET_NAME,)))
+
+@commands.command("viewrequests", roles=("syndicate",),
+                  description="Просмотр запросов клиентов. viewrequests [--status S] [--page N] [--size N]", cost=2)
+def cmd_viewrequests(ctx, argv):
+    return send_listing(ctx, "viewrequests", argv, defaults={'status': 'новый'})
+
+def notify_client(target_request, text):
+    client_uid = str(target_request.get('UID Клиента'))
+    if presence.is_online(client_uid):
+        deliver(user_room(client_uid), 'terminal_output', {'output': text})
+
+@commands.command("acceptrequest", roles=("syndicate",),
+                  description="Принять запрос. acceptrequest <ID> <название> <описание> <награда>",
+                  usage="acceptrequest <ID_запроса> <название_контракта> <описание> <награда>", min_args=4, maxsplit=3,
+                  writes_storage=True, cost=3)
+def cmd_acceptrequest(ctx, argv):
+    try:
+        request_id = int(argv[0])
+    except ValueError:
+        return "❌ Ошибка: ID запроса должен быть числом.\n"
+    contract_title, contract_description, contract_reward = argv[1], argv[2], argv[3]
+    target_request = data_store.get_request(request_id)
+    if not target_request:
+        return f"❌ Ошибка: Запрос с ID '{request_id}' не найден.\n"
+    if target_request.get('Статус', '').lower() != 'новый':
+        return f"❌ Ошибка: Запрос с ID '{request_id}' уже был обработан.\n"
+
+    # Смена статуса запроса и новый контракт уходят в хранилище одним пакетом: либо оба, либо ничего.
+    next_contract_id = data_store.allocate_contract_id()
+    new_contract = {"ID": next_contract_id, "Название": contract_title, "Описание": contract_description, "Награда": contract_reward, "Статус": "active", "Назначено": "None"}
+    mutation = data_store.mutation()
+    mutation.update_request(request_id, {'Статус': 'Принят'})
+    mutation.add_contract(new_contract)
+    if not mutation.commit():
+        return WRITE_CONFLICT_OUTPUT if mutation.conflict else "❌ Ошибка: Не удалось принять запрос и создать контракт в Google Таблицах.\n"
+    log_terminal_event("syndicate_action", ctx.user_info, f"Принят запрос ID:{request_id}, создан контракт ID:{next_contract_id}.")
+    notify_client(target_request, f"🔔 Ваш запрос (ID: {request_id}) был ПРИНЯТ Синдикатом!\n")
+    return f"✅ Запрос ID:{request_id} принят. Создан контракт (ID: {next_contract_id}) '{contract_title}'.\n"
+
+@commands.command("declinerequest", roles=("syndicate",), description="Отклонить запрос. declinerequest <ID>",
+                  usage="declinerequest <ID_запроса>", min_args=1, writes_storage=True, cost=3)
+def cmd_declinerequest(ctx, argv):
+    if not argv[0]:
+        return "ℹ️ Использование: declinerequest <ID_запроса>\n"
+    try:
+        request_id = int(argv[0])
+    except ValueError:
+        return "❌ Ошибка: ID запроса должен быть числом.\n"
+    target_request = data_store.get_request(request_id)
+    if not target_request:
+        return f"❌ Ошибка: Запрос с ID '{request_id}' не найден.\n"
+    if target_request.get('Статус', '').lower() != 'новый':
+        return f"❌ Ошибка: Запрос с ID '{request_id}' уже был обработан.\n"
+    mutation = data_store.mutation()
+    mutation.update_request(request_id, {'Статус': 'Отклонен'})
+    if not mutation.commit():
+        return WRITE_CONFLICT_OUTPUT if mutation.conflict else "❌ Ошибка: Не удалось отклонить запрос в Google Таблицах.\n"
+    log_terminal_event("syndicate_action", ctx.user_info, f"Отклонен запрос ID:{request_id}.")
+    notify_client(target_request, f"🔔 Ваш запрос (ID: {request_id}) был ОТКЛОНЕН Синдикатом!\n")
+    return f"✅ Запрос ID:{request_id} отклонен.\n"
+
+def parse_log_time(value):
+    """Граница периода для logsearch: ГГГГ-ММ-ДД или ГГГГ-ММ-ДДTЧЧ:ММ[:СС] в формате меток времени листов."""
+    value = value.replace('T', ' ')
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            datetime.strptime(value, fmt)
+            return value
+        except ValueError:
+            continue
+    return None
+
+@commands.command("logsearch", roles=("syndicate",),
+                  description="Поиск по логам (архив и текущий лист). logsearch <с> <по> [UID|позывной]",
+                  usage="logsearch <ГГГГ-ММ-ДД[TЧЧ:ММ]> <ГГГГ-ММ-ДД[TЧЧ:ММ]> [UID|позывной]", min_args=2, max_args=3, cost=5)
+def cmd_logsearch(ctx, argv):
+    since, until = parse_log_time(argv[0]), parse_log_time(argv[1])
+    if since is None or until is None:
+        return "❌ Ошибка: Период задается как ГГГГ-ММ-ДД или ГГГГ-ММ-ДДTЧЧ:ММ.\n"
+    uid = None
+    if len(argv) > 2:
+        user = data_store.get_user_by_callsign(argv[2])
+        uid = argv[2] if argv[2] in data_store.users else (str(user.get('UID')) if user else None)
+        if uid is None:
+            return f"❌ Ошибка: Пользователь '{argv[2]}' не найден.\n"
+    records, total = log_archive.query(LOG_SHEET_NAME, since, until, uid)
+    output = f"--- 🗄️ ЛОГИ {since} — {until}" + (f" (UID: {uid})" if uid else "") + " ---\n"
+    if not records:
+        output += "  Записей не найдено.\n"
     else:
-        output = (f"❓ Неизвестная команда: '{base_command}' или недоступна для вашей роли ({current_role}).\n"
-                  "Введите 'help' для списка команд.\n")
+        if total > len(records):
+            output += f"  Найдено {total}, показаны последние {len(records)}.\n"
+        for record in records:
+            output += f"  [{record.get('Timestamp')}] [{record.get('Event_Type')}] [{record.get('User_Info')}] {record.get('Message')}\n"
+    stats = log_archive.stats()
+    output += f"  Архив: {stats['files']} файлов, {stats['rows']} строк.\n"
+    output += "--------------------------------------\n"
+    return output
 
-    emit('terminal_output', {'output': output + '\n'}, room=request.sid)
+@commands.command("rotatelogs", roles=("syndicate",), description="Перенести старые строки логов и сообщений в архив.",
+                  writes_storage=True, cost=10)
+def cmd_rotatelogs(ctx, argv):
+    if not log_archive.enabled:
+        return "❌ Ошибка: Архив отключен (ARCHIVE_DIR не задан).\n"
+    rotated = log_archive.rotate_all()
+    log_terminal_event("syndicate_action", ctx.user_info, f"Ротация листов-журналов: {rotated}.")
+    output = "--- 🗄️ РОТАЦИЯ ЛИСТОВ-ЖУРНАЛОВ ---\n"
+    for sheet_name, count in rotated.items():
+        output += f"  {sheet_name}: перенесено в архив {count} строк\n"
+    output += "--------------------------------------\n"
+    return output
 
 if __name__ == '__main__':
     print("Запуск в режиме локальной отладки...")
@@ -0,0 +1,192 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+try:
+    import eventlet
+    import eventlet.tpool
+except ImportError:
+    eventlet = None
+
+# Счетчики пула меняются и в потоках ОС (по завершении вызова), поэтому блокировка — настоящая, не зеленая.
+_native_threading = eventlet.patcher.original('threading') if eventlet is not None else threading
+
+# --- Настройки пула блокирующих вызовов ---
+POOL_SIZE = int(os.environ.get('SHEETS_POOL_SIZE', 8))
+POOL_MAX_PENDING = int(os.environ.get('SHEETS_POOL_MAX_PENDING', 64))
+CALL_TIMEOUT = float(os.environ.get('SHEETS_CALL_TIMEOUT', 20))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('SHEETS_BREAKER_FAILURES', 5))
+BREAKER_RESET_TIMEOUT = float(os.environ.get('SHEETS_BREAKER_RESET_TIMEOUT', 30))
+
+
+class BackendUnavailable(Exception):
+    """Вызов отклонен без обращения к API: пул переполнен или размыкатель открыт."""
+
+
+class CallTimeout(Exception):
+    """Вызов не уложился в отведенное время."""
+
+
+def is_transport_error(error):
+    """Ошибки, говорящие о недоступности бэкенда (сеть, сокеты), в отличие от ошибок самого вызова."""
+    return isinstance(error, OSError)
+
+
+class CircuitBreaker:
+    """
+    Размыкатель: после failure_threshold ошибок подряд вызовы отклоняются сразу,
+    через reset_timeout пропускается один пробный вызов (half-open).
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probe_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+
+class BlockingPool:
+    """
+    Выполняет блокирующие вызовы (gspread/requests) в настоящих потоках ОС,
+    чтобы медленный ответ API не останавливал хаб eventlet и остальные терминалы.
+    Под eventlet используется eventlet.tpool, иначе — обычный ThreadPoolExecutor.
+    Вызов занимает место в пуле, пока поток ОС действительно не вернется: при таймауте ждущий
+    получает CallTimeout, но зависший вызов продолжает считаться в pending. Вызов, который к моменту
+    таймаута еще не начался, при старте пропускается. Размыкатель учитывают только таймауты
+    и ошибки, для которых is_failure(ошибка) истинно (транспорт, API), а не ошибки самих аргументов.
+    """
+
+    def __init__(self, size=POOL_SIZE, max_pending=POOL_MAX_PENDING, timeout=CALL_TIMEOUT, breaker=None,
+                 is_failure=is_transport_error):
+        self.size = size
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.is_failure = is_failure
+        self.pending = 0
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = _native_threading.Lock()
+        self._executor = None
+        self._tpool_sized = False
+
+    @staticmethod
+    def _green():
+        return eventlet is not None and eventlet.patcher.is_monkey_patched('thread')
+
+    def _submit(self, fn, args, kwargs, timeout):
+        if self._green():
+            if not self._tpool_sized:
+                eventlet.tpool.set_num_threads(self.size)
+                self._tpool_sized = True
+            with eventlet.Timeout(timeout, CallTimeout()):
+                return eventlet.tpool.execute(fn, *args, **kwargs)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="sheets")
+        future = self._executor.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise CallTimeout()
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        """Выполняет fn в пуле. Бросает BackendUnavailable, CallTimeout или исключение самой fn."""
+        with self._lock:
+            if not self.breaker.allow():
+                self.rejected += 1
+                raise BackendUnavailable("Google Таблицы временно недоступны (размыкатель открыт).")
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise BackendUnavailable("Очередь запросов к Google Таблицам переполнена.")
+            self.pending += 1
+            self.calls += 1
+        submitted_at = time.monotonic()
+        state = {'abandoned': False}
+
+        def timed():
+            # Выполняется в потоке пула; место освобождается только здесь, когда поток действительно свободен.
+            try:
+                if state['abandoned']:
+                    return None
+                state['started_at'] = time.monotonic()
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.pending -= 1
+
+        try:
+            result = self._submit(timed, (), {}, timeout or self.timeout)
+        except CallTimeout:
+            state['abandoned'] = True
+            with self._lock:
+                self.timeouts += 1
+                self.breaker.record_failure()
+            raise CallTimeout(f"Вызов {getattr(fn, '__name__', fn)} не завершился за {timeout or self.timeout} с.")
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+                if self.is_failure(e):
+                    self.breaker.record_failure()
+                else:
+                    # Бэкенд ответил: ошибка вызова не говорит о его недоступности.
+                    self.breaker.record_success()
+            raise
+        finally:
+            wait = state.get('started_at', time.monotonic()) - submitted_at
+            with self._lock:
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+        with self._lock:
+            self.breaker.record_success()
+        return result
+
+    def is_available(self):
+        return self.breaker.state != "open"
+
+    def stats(self):
+        return {
+            'pending': self.pending,
+            'size': self.size,
+            'max_pending': self.max_pending,
+            'calls': self.calls,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected,
+            'wait_avg_ms': round(1000 * self.wait_total / self.calls, 2) if self.calls else 0.0,
+            'wait_max_ms': round(1000 * self.wait_max, 2),
+            'breaker': self.breaker.state,
+        }
@@ -0,0 +1,142 @@
+import time
+
+UNKNOWN_COMMAND_OUTPUT = ("❓ Неизвестная команда: '{name}' или недоступна для вашей роли ({role}).\n"
+                          "Введите 'help' для списка команд.\n")
+
+
+class Command:
+    """
+    Описание команды терминала: обработчик, допустимые роли (frozenset — проверка O(1)),
+    разбор аргументов и строка для help.
+    maxsplit=None — обработчик получает всю строку аргументов одним элементом,
+    иначе аргументы режутся по пробелу как args.split(" ", maxsplit).
+    cost — сколько токенов команда списывает у ограничителя частоты.
+    """
+
+    def __init__(self, name, handler, roles, description, usage=None, min_args=0, max_args=None,
+                 maxsplit=-1, writes_storage=False, cost=1):
+        self.name = name
+        self.handler = handler
+        self.roles = frozenset(roles)
+        self.description = description
+        self.usage = usage
+        self.min_args = min_args
+        self.max_args = max_args
+        self.maxsplit = maxsplit
+        self.writes_storage = writes_storage
+        self.cost = cost
+
+    def parse_args(self, args):
+        """Список аргументов или None, если их число не подходит под спецификацию."""
+        if self.maxsplit is None:
+            args = args.strip()
+            argv = [args] if args else []
+        else:
+            argv = args.split(" ", self.maxsplit) if args else []
+        if len(argv) < self.min_args or (self.max_args is not None and len(argv) > self.max_args):
+            return None
+        return argv
+
+
+class CommandContext:
+    """Данные вызывающей сессии, которые нужны обработчикам команд."""
+
+    def __init__(self, sid, role, uid, callsign, squad, args):
+        self.sid = sid
+        self.role = role
+        self.uid = uid
+        self.callsign = callsign
+        self.squad = squad
+        self.args = args
+        self.user_info = f"UID:{uid}, Callsign:{callsign}, Role:{role}"
+
+
+class CommandRegistry:
+    """
+    Таблица команд терминала: имя -> Command. Поиск и проверка прав — два обращения
+    к словарю/множеству вместо цепочки if/elif, поэтому стоимость диспетчеризации
+    не зависит от числа команд. Текст help собирается для роли один раз и кэшируется.
+    """
+
+    def __init__(self):
+        self.commands = {}
+        self._help_cache = {}
+
+    def command(self, name, roles, description, **spec):
+        """Декоратор регистрации обработчика: @registry.command("ping", roles=..., description=...)."""
+        def decorator(handler):
+            self.commands[name] = Command(name, handler, roles, description, **spec)
+            self._help_cache.clear()
+            return handler
+        return decorator
+
+    def get(self, name, role):
+        """Команда, если она существует и доступна роли, иначе None."""
+        command = self.commands.get(name)
+        if command is None or role not in command.roles:
+            return None
+        return command
+
+    def cost_of(self, name, role):
+        """(стоимость, пишет ли в хранилище) для ограничителя; неизвестная команда стоит 1 токен."""
+        command = self.get(name, role)
+        if command is None:
+            return 1, False
+        return command.cost, command.writes_storage
+
+    def names_for_role(self, role):
+        return sorted(name for name, command in self.commands.items() if role in command.roles)
+
+    def help_text(self, role):
+        text = self._help_cache.get(role)
+        if text is None:
+            text = "--- 📖 СПИСОК ДОСТУПНЫХ КОМАНД ---\n"
+            for name in self.names_for_role(role):
+                text += f"- {name}: {self.commands[name].description}\n"
+            text += "---------------------------------\n"
+            self._help_cache[role] = text
+        return text
+
+    def dispatch(self, name, ctx, is_storage_available=None):
+        """
+        Выполняет команду и возвращает текст ответа (None — ответ обработчик отправил сам).
+        is_storage_available вызывается только для команд с writes_storage.
+        """
+        command = self.get(name, ctx.role)
+        if command is None:
+            return UNKNOWN_COMMAND_OUTPUT.format(name=name, role=ctx.role)
+        if command.writes_storage and is_storage_available is not None and not is_storage_available():
+            return "⚠️ Хранилище временно недоступно (Google Таблицы не отвечают). Повторите команду позже.\n"
+        argv = command.parse_args(ctx.args)
+        if argv is None:
+            return f"ℹ️ Использование: {command.usage}\n"
+        return command.handler(ctx, argv)
+
+
+def benchmark(iterations=100000, command_count=25):
+    """
+    Микробенчмарк диспетчеризации: стоимость поиска команды, проверки прав и разбора
+    аргументов на один вызов при пустых обработчиках. Запуск: python command_registry.py
+    """
+    roles = ("guest", "operative", "commander", "client", "syndicate")
+    registry = CommandRegistry()
+    for i in range(command_count):
+        registry.command(f"cmd{i}", roles=roles[1:], description="", min_args=1)(lambda ctx, argv: "")
+    ctx = CommandContext("sid", "syndicate", "1", "Bench", "alpha", "arg1 arg2")
+    names = [f"cmd{i}" for i in range(command_count)] + ["unknown"]
+    results = {}
+    for name in (names[0], names[-2], names[-1]):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            registry.dispatch(name, ctx)
+        results[name] = (time.perf_counter() - started) / iterations * 1e6
+    started = time.perf_counter()
+    for _ in range(iterations):
+        registry.help_text("syndicate")
+    results["help (кэш)"] = (time.perf_counter() - started) / iterations * 1e6
+    return results
+
+
+if __name__ == '__main__':
+    for name, cost in benchmark().items():
+        print(f"{name:>12}: {cost:.3f} мкс/вызов")
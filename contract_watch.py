@@ -0,0 +1,59 @@
+import threading
+
+# Виды изменений доски в порядке вывода и их подписи в терминале.
+CHANGE_LABELS = {
+    'new': "Новый контракт",
+    'reassigned': "Переназначен",
+    'status': "Сменил статус",
+    'updated': "Обновлен",
+    'closed': "Снят с доски",
+}
+
+
+class ContractBoard:
+    """
+    Доска контрактов для подписки watch contracts: запоминает открытые контракты (название, статус, назначение)
+    и при каждом изменении листа контрактов отдает только разницу с прошлым состоянием —
+    новые, переназначенные, сменившие статус и ушедшие с доски (выполнены, провалены, удалены).
+    """
+
+    def __init__(self, data_store):
+        self.data_store = data_store
+        self._board = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _state(contract):
+        return str(contract.get('Название')), str(contract.get('Статус', '')).lower(), str(contract.get('Назначено', 'None'))
+
+    def seed(self):
+        """Запоминает текущую доску как исходную: вызывается, когда данные подняты из снимка или хранилища."""
+        board = {contract['ID']: self._state(contract) for contract in self.data_store.open_contracts()}
+        with self._lock:
+            self._board = board
+
+    def changes(self):
+        """[(вид, контракт), ...] с прошлого вызова (или seed) по возрастанию ID."""
+        board = {contract['ID']: contract for contract in self.data_store.open_contracts()}
+        with self._lock:
+            previous = self._board
+            self._board = {contract_id: self._state(contract) for contract_id, contract in board.items()}
+        changes = []
+        for contract_id, contract in board.items():
+            old = previous.get(contract_id)
+            state = self._state(contract)
+            if old is None:
+                changes.append(('new', contract))
+            elif old[2] != state[2]:
+                changes.append(('reassigned', contract))
+            elif old[1] != state[1]:
+                changes.append(('status', contract))
+            elif old[0] != state[0]:
+                changes.append(('updated', contract))
+        for contract_id, (title, status, assignee) in previous.items():
+            if contract_id not in board:
+                contract = self.data_store.get_contract(contract_id) or {
+                    'ID': contract_id, 'Название': title, 'Статус': 'удален', 'Назначено': assignee}
+                changes.append(('closed', contract))
+        changes.sort(key=lambda change: change[1]['ID'])
+        return changes
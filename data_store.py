@@ -0,0 +1,535 @@
+import os
+import hmac
+import time
+import hashlib
+import secrets
+import threading
+
+import storage
+from storage import (
+    USERS_SHEET_NAME, CONTRACTS_SHEET_NAME, REQUESTS_SHEET_NAME,
+    USER_COLUMNS, VERSION_COLUMN,
+)
+
+SQUADS = ("alpha", "beta")
+# Листы, которые DataStore держит в памяти, в порядке аргументов load_records.
+SHEET_NAMES = (USERS_SHEET_NAME, CONTRACTS_SHEET_NAME, REQUESTS_SHEET_NAME)
+CLOSED_CONTRACT_STATUSES = ("провален", "выполнен", "failed", "completed")
+INDEX_NAMES = (
+    "users_by_callsign", "users_by_key", "key_hash_by_uid", "users_by_squad", "commander_by_squad",
+    "contracts_by_assignee", "contracts_by_squad", "contracts_by_status",
+    "requests_by_client", "requests_by_status",
+)
+
+# Хэш для неизвестных UID: сравнение идет всегда, и время ответа не выдает, существует ли UID.
+_UNKNOWN_KEY_HASH = hashlib.sha256(secrets.token_bytes(32)).digest()
+
+# --- Настройки фонового обновления (в секундах) ---
+REFRESH_INTERVAL = float(os.environ.get('DATA_REFRESH_INTERVAL', 300))
+CHANGE_CHECK_INTERVAL = float(os.environ.get('DATA_CHANGE_CHECK_INTERVAL', 15))
+# Окно, за которое оповещения об изменениях листов от других воркеров собираются в одно перечитывание.
+INVALIDATE_DEBOUNCE = float(os.environ.get('DATA_INVALIDATE_DEBOUNCE', 0.25))
+
+
+def key_hash(key):
+    return hashlib.sha256(str(key).encode('utf-8')).digest()
+
+
+def next_version(version):
+    """Следующая версия строки; у строк без версии (созданных до ее появления) она считается нулевой."""
+    try:
+        return int(version or 0) + 1
+    except (ValueError, TypeError):
+        return 1
+
+
+class Mutation:
+    """
+    Изменения контрактов и запросов, сделанные одной командой. commit() отправляет их в хранилище
+    одним атомарным пакетом и только потом применяет к кэшу. Каждое обновление проверяет, что версия
+    строки в хранилище совпадает с версией в кэше; иначе commit() возвращает False и выставляет conflict.
+    SQLite (и mirror) проверяет версии и пишет в одной транзакции. Google Таблицы условной записи не умеют:
+    проверка — отдельный запрос перед записью, и две команды, прочитавшие одну версию почти одновременно,
+    обе проходят проверку — сохраняется последняя запись. Перечитывание после записи этого не ловит:
+    обе записывают одну и ту же следующую версию.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.writes = []
+        self.conflict = False
+
+    def _append(self, sheet_name, record):
+        record[VERSION_COLUMN] = 1
+        self.writes.append(("append", sheet_name, record))
+
+    def _update(self, sheet_name, key_column, key_value, current, updates):
+        fields = dict(updates)
+        expected = None
+        if current is not None:
+            version = current.get(VERSION_COLUMN, '')
+            fields[VERSION_COLUMN] = next_version(version)
+            expected = {VERSION_COLUMN: version}
+        self.writes.append(("update", sheet_name, key_column, key_value, fields, expected))
+
+    def add_contract(self, contract):
+        self._append(CONTRACTS_SHEET_NAME, contract)
+
+    def update_contract(self, contract_id, updates):
+        self._update(CONTRACTS_SHEET_NAME, 'ID', contract_id, self.store.get_contract(contract_id), updates)
+
+    def add_request(self, req):
+        self._append(REQUESTS_SHEET_NAME, req)
+
+    def update_request(self, request_id, updates):
+        self._update(REQUESTS_SHEET_NAME, 'ID Запроса', request_id, self.store.get_request(request_id), updates)
+
+    def commit(self):
+        return self.store.commit(self)
+
+
+class DataStore:
+    """
+    Версионированный кэш пользователей, контрактов и запросов клиентов со вторичными индексами.
+    Команды читают данные из памяти без обращения к Google Таблицам,
+    собственные изменения записываются сквозь кэш (write-through),
+    а фоновый цикл подтягивает внешние правки по таймеру или по времени изменения таблицы.
+    """
+
+    def __init__(self, refresh_interval=REFRESH_INTERVAL, check_interval=CHANGE_CHECK_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.check_interval = check_interval
+        self.version = 0
+        self.users = {}
+        self.contracts = {}
+        self.requests = {}
+        self._set_indexes(self._build_indexes({}, {}, {}))
+        self.last_refresh = 0.0
+        self.last_modified = None
+        self._own_write_pending = False
+        self._lock = threading.RLock()
+        self._refresh_requested = threading.Event()
+        # Листы, которые фоновый цикл перечитает при следующем пробуждении.
+        self._pending_sheets = set()
+        # Следующие свободные ID: выдаются из памяти процесса и никогда не уменьшаются.
+        self._next_ids = {CONTRACTS_SHEET_NAME: 1, REQUESTS_SHEET_NAME: 1}
+        # Вызываются после каждой собственной записи с (версия, измененные листы) — например, чтобы оповестить другие воркеры.
+        self.change_listeners = []
+        # Версии отдельных листов: растут, только когда меняется содержимое листа.
+        self.sheet_versions = dict.fromkeys(SHEET_NAMES, 0)
+        # Вызываются с множеством измененных листов (например, для сброса кэша отрисованных ответов).
+        self.sheet_listeners = []
+
+    # --- Загрузка ---
+
+    def refresh(self, sheet_names=None):
+        """
+        Перечитывает листы (по умолчанию все три) и атомарно подменяет содержимое кэша и индексов;
+        записи остальных листов берутся из памяти.
+        """
+        if not storage.is_ready():
+            print("⚠️ Хранилище еще не подключено — обновление данных пропущено.")
+            return self.version
+        sheet_names = set(sheet_names or SHEET_NAMES)
+        print("Загрузка данных из хранилища..." if sheet_names == set(SHEET_NAMES) else
+              f"Загрузка листов из хранилища: {', '.join(sorted(sheet_names))}...")
+        # Внешние правки могли сдвинуть строки — индексы строк строим заново.
+        storage.invalidate_cache()
+        with self._lock:
+            current = {USERS_SHEET_NAME: list(self.users.values()), CONTRACTS_SHEET_NAME: list(self.contracts.values()),
+                       REQUESTS_SHEET_NAME: list(self.requests.values())}
+            last_refresh = self.last_refresh
+        records = {sheet_name: storage.get_all_records(sheet_name) if sheet_name in sheet_names else current[sheet_name]
+                   for sheet_name in SHEET_NAMES}
+        if not records[USERS_SHEET_NAME] and self.users:
+            # Пустой лист пользователей — почти наверняка ошибка чтения, а не реальные данные.
+            print("⚠️ Хранилище вернуло пустой лист пользователей — данные в памяти сохранены.")
+            return self.version
+        self.load_records(*(records[sheet_name] for sheet_name in SHEET_NAMES))
+        if sheet_names != set(SHEET_NAMES):
+            # Частичное перечитывание не заменяет периодическое полное.
+            self.last_refresh = last_refresh
+        print(f"Данные успешно загружены (версия {self.version}).")
+        return self.version
+
+    def load_records(self, users_data, contracts_data, requests_data):
+        """Подменяет кэш и индексы записями листов (из хранилища или из снимка)."""
+        users = {str(user.get('UID')): user for user in users_data if user.get('UID')}
+        contracts = {}
+        for contract in contracts_data:
+            try:
+                contract['ID'] = int(contract.get('ID'))
+                contracts[contract['ID']] = contract
+            except (ValueError, TypeError):
+                continue
+        requests = {}
+        for req in requests_data:
+            try:
+                req['ID Запроса'] = int(req.get('ID Запроса'))
+                requests[req['ID Запроса']] = req
+            except (ValueError, TypeError):
+                continue
+        indexes = self._build_indexes(users, contracts, requests)
+
+        with self._lock:
+            changed = {sheet_name for sheet_name, old, new in (
+                (USERS_SHEET_NAME, self.users, users), (CONTRACTS_SHEET_NAME, self.contracts, contracts),
+                (REQUESTS_SHEET_NAME, self.requests, requests)) if old != new}
+            self.users = users
+            self.contracts = contracts
+            self.requests = requests
+            self._set_indexes(indexes)
+            self._seed_ids()
+            self.last_refresh = time.monotonic()
+            self._own_write_pending = False
+            self.version += 1
+            self._sheets_changed(changed)
+        return self.version
+
+    def export_records(self):
+        """Текущие записи для снимка: {'users': [...], 'contracts': [...], 'requests': [...]}."""
+        with self._lock:
+            return {
+                'users': list(self.users.values()),
+                'contracts': list(self.contracts.values()),
+                'requests': list(self.requests.values()),
+            }
+
+    # --- Выдача ID ---
+
+    def _seed_ids(self):
+        self._next_ids[CONTRACTS_SHEET_NAME] = max(self._next_ids[CONTRACTS_SHEET_NAME], max(self.contracts, default=0) + 1)
+        self._next_ids[REQUESTS_SHEET_NAME] = max(self._next_ids[REQUESTS_SHEET_NAME], max(self.requests, default=0) + 1)
+
+    def _allocate_id(self, sheet_name):
+        with self._lock:
+            next_id = self._next_ids[sheet_name]
+            self._next_ids[sheet_name] = next_id + 1
+            return next_id
+
+    def allocate_contract_id(self):
+        return self._allocate_id(CONTRACTS_SHEET_NAME)
+
+    def allocate_request_id(self):
+        return self._allocate_id(REQUESTS_SHEET_NAME)
+
+    # --- Вторичные индексы ---
+
+    def _build_indexes(self, users, contracts, requests):
+        indexes = {name: {} for name in INDEX_NAMES}
+        for user in users.values():
+            self._index_user(user, indexes)
+        for contract in contracts.values():
+            self._index_contract(contract, indexes)
+        for req in requests.values():
+            self._index_request(req, indexes)
+        return indexes
+
+    def _set_indexes(self, indexes):
+        for name in INDEX_NAMES:
+            setattr(self, name, indexes[name])
+
+    def _indexes(self):
+        return {name: getattr(self, name) for name in INDEX_NAMES}
+
+    @staticmethod
+    def _bucket_add(index, key, item_id, item):
+        index.setdefault(key, {})[item_id] = item
+
+    @staticmethod
+    def _bucket_remove(index, key, item_id):
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.pop(item_id, None)
+            if not bucket:
+                del index[key]
+
+    def _index_user(self, user, indexes=None, remove=False):
+        indexes = indexes or self._indexes()
+        uid = str(user.get('UID'))
+        callsign, key = user.get('Позывной'), user.get('Ключ Доступа')
+        squad = str(user.get('Отряд', ''))
+        if remove:
+            if indexes['users_by_callsign'].get(callsign) is user:
+                del indexes['users_by_callsign'][callsign]
+            if indexes['users_by_key'].get(key) is user:
+                del indexes['users_by_key'][key]
+            indexes['key_hash_by_uid'].pop(uid, None)
+            self._bucket_remove(indexes['users_by_squad'], squad, uid)
+            if indexes['commander_by_squad'].get(squad) is user:
+                del indexes['commander_by_squad'][squad]
+                for other in indexes['users_by_squad'].get(squad, {}).values():
+                    if other.get('Роль') == 'commander':
+                        indexes['commander_by_squad'][squad] = other
+                        break
+            return
+        indexes['users_by_callsign'][callsign] = user
+        if key:
+            indexes['users_by_key'][key] = user
+            indexes['key_hash_by_uid'][uid] = key_hash(key)
+        if user.get('Роль') == 'commander':
+            indexes['commander_by_squad'].setdefault(squad, user)
+        self._bucket_add(indexes['users_by_squad'], squad, uid, user)
+
+    def _index_contract(self, contract, indexes=None, remove=False):
+        indexes = indexes or self._indexes()
+        contract_id = contract['ID']
+        assignee = str(contract.get('Назначено', 'None'))
+        status = str(contract.get('Статус', '')).lower()
+        keys = [('contracts_by_assignee', assignee), ('contracts_by_status', status)]
+        keys += [('contracts_by_squad', squad) for squad in assignee.lower().split(',') if squad in SQUADS]
+        for index_name, key in keys:
+            if remove:
+                self._bucket_remove(indexes[index_name], key, contract_id)
+            else:
+                self._bucket_add(indexes[index_name], key, contract_id, contract)
+
+    def _index_request(self, req, indexes=None, remove=False):
+        indexes = indexes or self._indexes()
+        request_id = req['ID Запроса']
+        keys = [('requests_by_client', str(req.get('UID Клиента'))), ('requests_by_status', str(req.get('Статус', '')).lower())]
+        for index_name, key in keys:
+            if remove:
+                self._bucket_remove(indexes[index_name], key, request_id)
+            else:
+                self._bucket_add(indexes[index_name], key, request_id, req)
+
+    # --- Запросы по индексам: стоимость пропорциональна размеру результата ---
+
+    def get_user_by_callsign(self, callsign):
+        return self.users_by_callsign.get(callsign)
+
+    def get_user_by_key(self, key):
+        return self.users_by_key.get(key)
+
+    def authenticate(self, uid, key):
+        """
+        Пользователь, если ключ доступа верен, иначе None. Только память: хэш ключа из индекса UID -> хэш
+        сравнивается за постоянное время, без обращения к хранилищу.
+        """
+        uid = str(uid)
+        expected = self.key_hash_by_uid.get(uid, _UNKNOWN_KEY_HASH)
+        if not hmac.compare_digest(expected, key_hash(key if key is not None else '')):
+            return None
+        return self.users.get(uid)
+
+    def key_digest(self, uid):
+        """Хэш текущего ключа пользователя (для отпечатка в токене возобновления) или None."""
+        return self.key_hash_by_uid.get(str(uid))
+
+    def resume_user(self, uid, fingerprint, fingerprint_of):
+        """
+        Пользователь, если отпечаток ключа из токена совпадает с отпечатком текущего ключа, иначе None.
+        fingerprint_of(хэш ключа) — функция отпечатка (ResumeTokens.fingerprint): смена ключа делает старые токены недействительными.
+        """
+        digest = self.key_digest(uid)
+        if digest is None or not hmac.compare_digest(fingerprint_of(digest), str(fingerprint)):
+            return None
+        return self.users.get(str(uid))
+
+    def get_squad_commander(self, squad):
+        return self.commander_by_squad.get(squad)
+
+    def users_in_squad(self, squad):
+        return list(self.users_by_squad.get(squad, {}).values())
+
+    def contracts_for_assignee(self, assignee):
+        return list(self.contracts_by_assignee.get(assignee, {}).values())
+
+    def contracts_for_squad(self, squad):
+        return list(self.contracts_by_squad.get(squad, {}).values())
+
+    def open_contracts(self):
+        """Контракты в работе (не выполнены и не провалены), по возрастанию ID."""
+        found = [
+            contract for status, bucket in self.contracts_by_status.items()
+            if status not in CLOSED_CONTRACT_STATUSES for contract in bucket.values()
+        ]
+        found.sort(key=lambda contract: contract['ID'])
+        return found
+
+    def contracts_with_status(self, status):
+        return list(self.contracts_by_status.get(status.lower(), {}).values())
+
+    def requests_for_client(self, uid):
+        return list(self.requests_by_client.get(str(uid), {}).values())
+
+    def requests_with_status(self, status):
+        return list(self.requests_by_status.get(status.lower(), {}).values())
+
+    def request_refresh(self, sheet_names=None):
+        """
+        Просит фоновый цикл перечитать листы (по умолчанию все). Цикл просыпается сразу, но ждет
+        INVALIDATE_DEBOUNCE, так что серия запросов (например, записи других воркеров) дает одно перечитывание.
+        """
+        with self._lock:
+            self._pending_sheets.update(sheet_names or SHEET_NAMES)
+        self._refresh_requested.set()
+
+    def check_for_changes(self):
+        """Сравнивает время изменения таблицы с запомненным и перечитывает данные при расхождении."""
+        modified = storage.get_last_update_time()
+        if not modified:
+            return False
+        previous = self.last_modified
+        self.last_modified = modified
+        if previous is None or modified == previous:
+            return False
+        if self._own_write_pending:
+            # Изменение вызвано нашей же записью — кэш уже актуален.
+            self._own_write_pending = False
+            return False
+        self.refresh()
+        return True
+
+    def run_refresh_loop(self, sleep=time.sleep):
+        """Фоновый цикл обновления. sleep передается снаружи, чтобы работать и с eventlet, и с потоками."""
+        while True:
+            requested = self._refresh_requested.wait(self.check_interval)
+            try:
+                if requested:
+                    sleep(INVALIDATE_DEBOUNCE)
+                    self._refresh_requested.clear()
+                    with self._lock:
+                        sheet_names, self._pending_sheets = self._pending_sheets, set()
+                    self.refresh(sheet_names)
+                elif time.monotonic() - self.last_refresh >= self.refresh_interval:
+                    self.refresh()
+                else:
+                    self.check_for_changes()
+            except Exception as e:
+                print(f"❌ Ошибка фонового обновления данных: {e}")
+
+    def _sheets_changed(self, sheet_names):
+        for sheet_name in sheet_names:
+            self.sheet_versions[sheet_name] += 1
+        if not sheet_names:
+            return
+        for listener in self.sheet_listeners:
+            try:
+                listener(sheet_names)
+            except Exception as e:
+                print(f"❌ Ошибка оповещения об изменении листов: {e}")
+
+    def _bump(self, sheet_names):
+        self._own_write_pending = True
+        self.version += 1
+        self._sheets_changed(set(sheet_names))
+        for listener in self.change_listeners:
+            try:
+                listener(self.version, sorted(sheet_names))
+            except Exception as e:
+                print(f"❌ Ошибка оповещения об изменении данных: {e}")
+
+    # --- Сквозная запись: пользователи ---
+
+    def add_user(self, user):
+        row = [user.get(column, '') for column in USER_COLUMNS]
+        if not storage.append_row(USERS_SHEET_NAME, row):
+            return False
+        with self._lock:
+            users = dict(self.users)
+            users[str(user['UID'])] = user
+            self.users = users
+            self._index_user(user)
+            self._bump((USERS_SHEET_NAME,))
+        return True
+
+    def remove_user(self, uid):
+        if not storage.delete_row_by_key(USERS_SHEET_NAME, 'UID', uid):
+            return False
+        with self._lock:
+            users = dict(self.users)
+            user = users.pop(str(uid), None)
+            self.users = users
+            if user is not None:
+                self._index_user(user, remove=True)
+            self._bump((USERS_SHEET_NAME,))
+        return True
+
+    # --- Сквозная запись: контракты ---
+
+    def get_contract(self, contract_id):
+        return self.contracts.get(contract_id)
+
+    def add_contract(self, contract):
+        mutation = self.mutation()
+        mutation.add_contract(contract)
+        return mutation.commit()
+
+    def update_contract(self, contract_id, updates):
+        mutation = self.mutation()
+        mutation.update_contract(contract_id, updates)
+        return mutation.commit()
+
+    # --- Сквозная запись: запросы клиентов ---
+
+    def get_request(self, request_id):
+        return self.requests.get(request_id)
+
+    def add_request(self, req):
+        mutation = self.mutation()
+        mutation.add_request(req)
+        return mutation.commit()
+
+    def update_request(self, request_id, updates):
+        mutation = self.mutation()
+        mutation.update_request(request_id, updates)
+        return mutation.commit()
+
+    # --- Транзакции ---
+
+    def mutation(self):
+        return Mutation(self)
+
+    def commit(self, mutation):
+        """
+        Применяет изменения команды к хранилищу одним пакетом, затем к кэшу.
+        При конфликте версий кэш перечитывается, чтобы повтор команды видел актуальные данные.
+        """
+        try:
+            if not storage.apply_writes(mutation.writes):
+                return False
+        except storage.WriteConflict as e:
+            print(f"⚠️ Конфликт записи: {e}")
+            mutation.conflict = True
+            self.refresh()
+            return False
+        with self._lock:
+            for write in mutation.writes:
+                if write[0] == "append":
+                    self._apply_append(write[1], write[2])
+                else:
+                    self._apply_update(write[1], write[3], write[4])
+            self._bump({write[1] for write in mutation.writes})
+        return True
+
+    def _apply_append(self, sheet_name, record):
+        if sheet_name == CONTRACTS_SHEET_NAME:
+            contracts = dict(self.contracts)
+            contracts[record['ID']] = record
+            self.contracts = contracts
+            self._index_contract(record)
+        else:
+            requests = dict(self.requests)
+            requests[record['ID Запроса']] = record
+            self.requests = requests
+            self._index_request(record)
+
+    def _apply_update(self, sheet_name, key_value, fields):
+        # Запись, которую уже держат читатели (списки, снимок, отрисовка), не меняется: ее заменяет копия.
+        if sheet_name == CONTRACTS_SHEET_NAME:
+            records, index = dict(self.contracts), self._index_contract
+        else:
+            records, index = dict(self.requests), self._index_request
+        record = records.get(key_value)
+        if record is None:
+            return
+        updated = {**record, **fields}
+        records[key_value] = updated
+        index(record, remove=True)
+        index(updated)
+        if sheet_name == CONTRACTS_SHEET_NAME:
+            self.contracts = records
+        else:
+            self.requests = records
@@ -0,0 +1,21 @@
+class Delivery:
+    """
+    Рассылка событий в комнаты (см. presence.sids_for_room). Своим клиентам событие уходит через outbound,
+    клиентам других воркеров — через shared_state: каждый воркер получает 'deliver' и отправляет его
+    своим sid из комнаты (receive).
+    """
+
+    def __init__(self, presence, outbound, shared_state):
+        self.presence = presence
+        self.outbound = outbound
+        self.shared_state = shared_state
+
+    def deliver(self, room, event, payload, skip_sid=None):
+        """Рассылка в комнату (None — всем), skip_sid не получает событие."""
+        self.outbound.send_many(self.presence.sids_for_room(room), event, payload, skip_sid)
+        self.shared_state.publish('deliver', {'room': room, 'event': event, 'payload': payload, 'skip_sid': skip_sid})
+
+    def receive(self, payload):
+        """Событие 'deliver' другого воркера — своим клиентам из комнаты."""
+        self.outbound.send_many(self.presence.sids_for_room(payload['room']), payload['event'], payload['payload'],
+                                payload.get('skip_sid'))
@@ -1,16 +1,59 @@
 import os
+import re
 import json
+from collections import Counter
 import gspread
+from gspread.utils import rowcol_to_a1
 from google.oauth2.service_account import Credentials
+from google.auth.exceptions import TransportError
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+
+from blocking_pool import BlockingPool, is_transport_error
 
 # --- Константы ---
 SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 SPREADSHEET_ID = os.environ.get('GOOGLE_SHEET_ID')
 SERVICE_ACCOUNT_JSON = os.environ.get('GOOGLE_CREDENTIALS_JSON')
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files/{}"
+# --- Настройки HTTP-соединений с API ---
+HTTP_POOL_SIZE = int(os.environ.get('SHEETS_HTTP_POOL_SIZE', 10))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('SHEETS_HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.environ.get('SHEETS_HTTP_READ_TIMEOUT', 30))
+APPENDED_RANGE_RE = re.compile(r"![A-Z]+(\d+)")
+# Сколько строк читает за один запрос TailReader.
+TAIL_CHUNK_ROWS = int(os.environ.get('SHEETS_TAIL_CHUNK_ROWS', 500))
+
+
+def is_backend_failure(error):
+    """Для размыкателя: сеть, транспорт авторизации, ответы API 429 и 5xx. Ошибки 4xx — ошибки самого запроса."""
+    if isinstance(error, gspread.exceptions.APIError):
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+        return status is None or status == 429 or status >= 500
+    return isinstance(error, TransportError) or is_transport_error(error)
+
 
 # --- Глобальные переменные ---
 gc = None
 spreadsheet = None
+pool = BlockingPool(is_failure=is_backend_failure)
+_worksheet_cache = {}
+_header_cache = {}
+_row_index_cache = {}
+# Листы, о которых уже предупреждали: в них нет колонки из expected, и проверка версии для них не выполняется.
+_unchecked_sheets = set()
+# Попадания и промахи кэшей листов/заголовков/индексов строк: (кэш, 'hit' | 'miss') -> число
+cache_stats = Counter()
+
+class WriteConflict(Exception):
+    """Строка изменена кем-то другим: значение проверяемой колонки (версии) не совпало с ожидаемым."""
+
+def _make_session(creds):
+    """HTTP-сессия с пулом keep-alive соединений: TLS-рукопожатие не повторяется на каждый запрос."""
+    session = AuthorizedSession(creds)
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    return session
 
 def init_google_sheets():
     global gc, spreadsheet
@@ -22,63 +65,371 @@ def init_google_sheets():
     try:
         creds_dict = json.loads(SERVICE_ACCOUNT_JSON)
         creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPE)
-        gc = gspread.authorize(creds)
+        gc = gspread.Client(auth=creds, session=_make_session(creds))
+        gc.set_timeout((HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
         spreadsheet = gc.open_by_key(SPREADSHEET_ID)
+        invalidate_cache()
         print("✅ Успешное подключение к Google Таблицам.")
         return True
     except Exception as e:
         print(f"❌ Ошибка при инициализации Google Sheets: {e}")
         return False
 
+def get_last_update_time():
+    """Возвращает время последнего изменения таблицы (modifiedTime из Drive API) или None."""
+    try:
+        response = pool.run(
+            gc.request,
+            "get",
+            DRIVE_FILES_URL.format(SPREADSHEET_ID),
+            params={"fields": "modifiedTime", "supportsAllDrives": True},
+        )
+        return response.json().get("modifiedTime")
+    except Exception as e:
+        print(f"❌ Ошибка при получении времени изменения таблицы: {e}")
+        return None
+
+def _worksheet(sheet_name):
+    """
+    Объект листа по названию. Все листы запрашиваются одним вызовом метаданных
+    и кэшируются; если листа нет в кэше (переименован или создан позже), список перечитывается.
+    """
+    worksheet = _worksheet_cache.get(sheet_name)
+    cache_stats['worksheet', 'miss' if worksheet is None else 'hit'] += 1
+    if worksheet is None:
+        _worksheet_cache.clear()
+        _worksheet_cache.update({ws.title: ws for ws in pool.run(spreadsheet.worksheets)})
+        worksheet = _worksheet_cache.get(sheet_name)
+        if worksheet is None:
+            raise gspread.WorksheetNotFound(sheet_name)
+    return worksheet
+
+def _headers(worksheet):
+    """Заголовки листа (первая строка), кэшируются до инвалидации."""
+    headers = _header_cache.get(worksheet.title)
+    cache_stats['headers', 'miss' if headers is None else 'hit'] += 1
+    if headers is None:
+        headers = pool.run(worksheet.row_values, 1)
+        _header_cache[worksheet.title] = headers
+    return headers
+
+def _row_index(worksheet, key_column):
+    """Индекс 'значение ключа -> номер строки' по колонке key_column. Строится одним чтением колонки."""
+    cache_key = (worksheet.title, key_column)
+    index = _row_index_cache.get(cache_key)
+    cache_stats['row_index', 'miss' if index is None else 'hit'] += 1
+    if index is None:
+        headers = _headers(worksheet)
+        if key_column not in headers:
+            return None
+        column = pool.run(worksheet.col_values, headers.index(key_column) + 1)
+        index = {}
+        for row_number, value in enumerate(column[1:], start=2):
+            if value != '':
+                index.setdefault(str(value), row_number)
+        _row_index_cache[cache_key] = index
+    return index
+
+def _find_row(worksheet, key_column, key_value):
+    """Номер строки по ключу. Если ключа нет в индексе, индекс перестраивается один раз (строку могли добавить вручную)."""
+    index = _row_index(worksheet, key_column)
+    if index is None:
+        return None
+    row_number = index.get(str(key_value))
+    if row_number is None:
+        _row_index_cache.pop((worksheet.title, key_column), None)
+        row_number = _row_index(worksheet, key_column).get(str(key_value))
+    return row_number
+
+def _index_appended_rows(worksheet, response, rows):
+    """Дописывает в индексы строки, добавленные через append_row(s), по диапазону из ответа API."""
+    indexed = [key for key in _row_index_cache if key[0] == worksheet.title]
+    if not indexed:
+        return
+    try:
+        updated_range = response['updates']['updatedRange']
+        first_row = int(APPENDED_RANGE_RE.search(updated_range).group(1))
+        headers = _header_cache[worksheet.title]
+    except (KeyError, TypeError, AttributeError, ValueError):
+        invalidate_cache(worksheet.title)
+        return
+    for cache_key in indexed:
+        col = headers.index(cache_key[1]) if cache_key[1] in headers else None
+        if col is None:
+            continue
+        index = _row_index_cache[cache_key]
+        for offset, row in enumerate(rows):
+            if col < len(row) and row[col] != '':
+                index.setdefault(str(row[col]), first_row + offset)
+
+def _unindex_deleted_row(sheet_name, row_number):
+    """Удаляет строку из индексов листа и сдвигает все строки ниже нее на одну вверх."""
+    for cache_key, index in _row_index_cache.items():
+        if cache_key[0] != sheet_name:
+            continue
+        for key in [k for k, n in index.items() if n == row_number]:
+            del index[key]
+        for key, n in index.items():
+            if n > row_number:
+                index[key] = n - 1
+
+def invalidate_cache(sheet_name=None):
+    """Сбрасывает кэш объектов листов, заголовков и индексов строк (для одного листа или для всех)."""
+    if sheet_name is None:
+        _worksheet_cache.clear()
+        _header_cache.clear()
+        _row_index_cache.clear()
+        return
+    _worksheet_cache.pop(sheet_name, None)
+    _header_cache.pop(sheet_name, None)
+    for cache_key in [k for k in _row_index_cache if k[0] == sheet_name]:
+        del _row_index_cache[cache_key]
+
 def get_all_records(sheet_name):
     try:
-        worksheet = spreadsheet.worksheet(sheet_name)
-        return worksheet.get_all_records()
+        worksheet = _worksheet(sheet_name)
+        return pool.run(worksheet.get_all_records)
     except Exception as e:
+        invalidate_cache(sheet_name)
         print(f"❌ Ошибка при получении данных из листа '{sheet_name}': {e}")
         return []
 
 def append_row(sheet_name, row_data):
     try:
-        worksheet = spreadsheet.worksheet(sheet_name)
-        worksheet.append_row(row_data, value_input_option="USER_ENTERED")
+        worksheet = _worksheet(sheet_name)
+        response = pool.run(worksheet.append_row, row_data, value_input_option="USER_ENTERED")
+        _index_appended_rows(worksheet, response, [row_data])
         return True
     except Exception as e:
+        invalidate_cache(sheet_name)
         print(f"❌ Ошибка при добавлении строки в '{sheet_name}': {e}")
         return False
 
-def update_row_by_key(sheet_name, key_column, key_value, updated_fields):
+def append_rows(sheet_name, rows):
+    """Добавляет несколько строк одним запросом к API."""
+    if not rows:
+        return True
     try:
-        worksheet = spreadsheet.worksheet(sheet_name)
-        records = worksheet.get_all_records()
-        headers = worksheet.row_values(1)
-        for idx, row in enumerate(records, start=2):
-            if str(row.get(key_column)) == str(key_value):
-                for field, new_value in updated_fields.items():
-                    if field in headers:
-                        col_idx = headers.index(field) + 1
-                        worksheet.update_cell(idx, col_idx, new_value)
-                return True
-        print(f"⚠️ Строка с {key_column} = {key_value} не найдена в '{sheet_name}'.")
+        worksheet = _worksheet(sheet_name)
+        response = pool.run(worksheet.append_rows, rows, value_input_option="USER_ENTERED")
+        _index_appended_rows(worksheet, response, rows)
+        return True
+    except Exception as e:
+        invalidate_cache(sheet_name)
+        print(f"❌ Ошибка при добавлении {len(rows)} строк в '{sheet_name}': {e}")
         return False
+
+def update_row_by_key(sheet_name, key_column, key_value, updated_fields):
+    """Обновляет поля строки одним batch_update, находя строку по кэшированному индексу ключей."""
+    try:
+        worksheet = _worksheet(sheet_name)
+        row_number = _find_row(worksheet, key_column, key_value)
+        if row_number is None:
+            print(f"⚠️ Строка с {key_column} = {key_value} не найдена в '{sheet_name}'.")
+            return False
+        headers = _headers(worksheet)
+        data = [
+            {'range': rowcol_to_a1(row_number, headers.index(field) + 1), 'values': [[new_value]]}
+            for field, new_value in updated_fields.items() if field in headers
+        ]
+        if data:
+            pool.run(worksheet.batch_update, data, value_input_option="USER_ENTERED")
+        return True
     except Exception as e:
+        invalidate_cache(sheet_name)
         print(f"❌ Ошибка при обновлении строки в '{sheet_name}': {e}")
         return False
 
 def delete_row_by_key(sheet_name, key_column, key_value):
     try:
-        worksheet = spreadsheet.worksheet(sheet_name)
-        records = worksheet.get_all_records()
-        for idx, row in enumerate(records, start=2):
-            if str(row.get(key_column)) == str(key_value):
-                worksheet.delete_rows(idx)
-                return True
-        print(f"⚠️ Строка с {key_column} = {key_value} не найдена.")
-        return False
+        worksheet = _worksheet(sheet_name)
+        row_number = _find_row(worksheet, key_column, key_value)
+        if row_number is None:
+            print(f"⚠️ Строка с {key_column} = {key_value} не найдена.")
+            return False
+        pool.run(worksheet.delete_rows, row_number)
+        _unindex_deleted_row(sheet_name, row_number)
+        return True
     except Exception as e:
+        invalidate_cache(sheet_name)
         print(f"❌ Ошибка при удалении строки из '{sheet_name}': {e}")
         return False
 
+def delete_leading_rows(sheet_name, keys, strict=True):
+    """
+    Удаляет первые строки данных листа одним запросом, если их первая колонка совпадает с keys
+    (строки уже заархивированы). Пустые строки между ними удаляются вместе с ними.
+    strict=False — несовпадение не считается ошибкой (копия листа разошлась с основной базой и чистить нечего).
+    """
+    if not keys:
+        return True
+    try:
+        worksheet = _worksheet(sheet_name)
+        column = pool.run(worksheet.col_values, 1)
+        matched, last_row = 0, None
+        for row_number, value in enumerate(column[1:], start=2):
+            if value == '':
+                continue
+            if matched == len(keys) or value != str(keys[matched]):
+                break
+            matched, last_row = matched + 1, row_number
+        if matched < len(keys):
+            print(f"⚠️ Начало листа '{sheet_name}' изменилось с момента чтения: строки не удалены.")
+            return not strict
+        pool.run(worksheet.delete_rows, 2, last_row)
+        invalidate_cache(sheet_name)
+        return True
+    except Exception as e:
+        invalidate_cache(sheet_name)
+        print(f"❌ Ошибка при удалении {len(keys)} строк из начала листа '{sheet_name}': {e}")
+        return False
+
+def _cell_data(value):
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+def apply_writes(writes):
+    """
+    Применяет записи одной команды одним spreadsheets.batchUpdate — API выполняет его целиком или не выполняет вовсе.
+    writes: ("append", лист, {колонка: значение}) и ("update", лист, ключевая колонка, ключ, {колонка: значение}, expected),
+    где expected — {колонка: ожидаемое значение} или None. Ожидаемые значения всех строк читаются одним
+    values_batch_get до записи; при расхождении бросается WriteConflict и ничего не записывается.
+    Проверка и запись — два запроса: правка другого воркера между ними не обнаруживается, проверка лишь
+    сужает окно гонки. Если в листе нет колонки из expected (например, 'Версия'), проверка для него
+    не выполняется — об этом один раз предупреждается в логе.
+    """
+    touched = set()
+    try:
+        requests, checks = [], []
+        for write in writes:
+            worksheet = _worksheet(write[1])
+            touched.add(worksheet.title)
+            headers = _headers(worksheet)
+            if write[0] == "append":
+                values = [_cell_data(write[2].get(header, '')) for header in headers]
+                requests.append({'appendCells': {'sheetId': worksheet.id, 'rows': [{'values': values}], 'fields': 'userEnteredValue'}})
+                continue
+            _, sheet_name, key_column, key_value, fields, expected = write
+            row_number = _find_row(worksheet, key_column, key_value)
+            if row_number is None:
+                print(f"⚠️ Строка с {key_column} = {key_value} не найдена в '{sheet_name}'.")
+                return False
+            for field, value in (expected or {}).items():
+                if field in headers:
+                    cell = rowcol_to_a1(row_number, headers.index(field) + 1)
+                    checks.append((f"'{worksheet.title}'!{cell}", value, f"{sheet_name}/{key_value}"))
+                elif (sheet_name, field) not in _unchecked_sheets:
+                    _unchecked_sheets.add((sheet_name, field))
+                    print(f"⚠️ В листе '{sheet_name}' нет колонки '{field}': проверка конкурентных правок для него отключена.")
+            for field, value in fields.items():
+                if field not in headers:
+                    continue
+                column = headers.index(field)
+                grid_range = {'sheetId': worksheet.id, 'startRowIndex': row_number - 1, 'endRowIndex': row_number,
+                              'startColumnIndex': column, 'endColumnIndex': column + 1}
+                requests.append({'updateCells': {'range': grid_range, 'rows': [{'values': [_cell_data(value)]}], 'fields': 'userEnteredValue'}})
+        if checks:
+            response = pool.run(spreadsheet.values_batch_get, [cell for cell, _, _ in checks])
+            for (_, value, row), value_range in zip(checks, response.get('valueRanges', [])):
+                current = (value_range.get('values') or [['']])[0][0]
+                if str(current) != str(value):
+                    raise WriteConflict(f"{row}: ожидалось '{value}', в таблице '{current}'")
+        if requests:
+            pool.run(spreadsheet.batch_update, {'requests': requests})
+        return True
+    except WriteConflict:
+        raise
+    except Exception as e:
+        for sheet_name in touched:
+            invalidate_cache(sheet_name)
+        print(f"❌ Ошибка при пакетной записи в Google Таблицы: {e}")
+        return False
+
+def _column_letter(column_number):
+    return re.sub(r"\d+", "", rowcol_to_a1(1, column_number))
+
+class TailReader:
+    """
+    Инкрементальное чтение листа, который только дописывается (Логи, Сообщения): вместо get_all_records
+    всего листа читаются диапазоны A{n}:G{n+k} начиная с последней прочитанной строки.
+    Контрольная точка — номер и содержимое последней прочитанной строки (изначально — заголовок).
+    Каждое чтение начинается с нее самой: если строка на месте не совпала (строки удалены, лист усечен
+    или архивирован), позиция восстанавливается по первой колонке — метке времени, по которой строки упорядочены.
+    iter_new_rows() — генератор: строки отдаются по одной, без списка словарей на весь лист,
+    а контрольная точка сдвигается только за уже отданными строками.
+    """
+
+    engine = "sheets"
+
+    def __init__(self, sheet_name, checkpoint=None, chunk_rows=TAIL_CHUNK_ROWS):
+        self.sheet_name = sheet_name
+        self.chunk_rows = chunk_rows
+        self.row = 1
+        self.values = None
+        self.resyncs = 0
+        if checkpoint and checkpoint.get('engine') == self.engine:
+            self.row = int(checkpoint.get('row', 1))
+            self.values = checkpoint.get('values')
+
+    def checkpoint(self):
+        return {'engine': self.engine, 'row': self.row, 'values': self.values}
+
+    def _read(self, worksheet, first, last, width):
+        rows = pool.run(worksheet.get_values, f"A{first}:{_column_letter(width)}{last}")
+        return [[str(value) for value in (list(row) + [''] * width)[:width]] for row in rows]
+
+    def _resync(self, worksheet, width):
+        """Ищет контрольную строку заново; если ее больше нет — встает после последней строки не позже ее метки времени."""
+        self.resyncs += 1
+        key = self.values[0] if self.values else ''
+        column = pool.run(worksheet.col_values, 1)
+        candidates = [row for row, value in enumerate(column, start=1) if row > 1 and value == key]
+        if candidates:
+            rows = self._read(worksheet, candidates[0], candidates[-1], width)
+            for offset in range(len(rows) - 1, -1, -1):
+                if rows[offset] == self.values:
+                    self.row = candidates[0] + offset
+                    return
+        self.row = max([1] + [row for row, value in enumerate(column, start=1) if row > 1 and value != '' and value <= key])
+        self.values = self._read(worksheet, self.row, self.row, width)[0]
+        print(f"⚠️ Лист '{self.sheet_name}' изменился (удаление или усечение строк): чтение продолжено со строки {self.row + 1}.")
+
+    def iter_new_rows(self):
+        """Новые строки листа после контрольной точки как словари {заголовок: значение}."""
+        try:
+            worksheet = _worksheet(self.sheet_name)
+            headers = _headers(worksheet)
+        except Exception as e:
+            print(f"❌ Ошибка при чтении новых строк листа '{self.sheet_name}': {e}")
+            return
+        width = len(headers)
+        if self.values is None or self.row <= 1:
+            self.row, self.values = 1, [str(header) for header in headers]
+        while True:
+            try:
+                rows = self._read(worksheet, self.row, self.row + self.chunk_rows, width)
+                if not rows or rows[0] != self.values:
+                    self._resync(worksheet, width)
+                    rows = self._read(worksheet, self.row, self.row + self.chunk_rows, width)
+            except Exception as e:
+                invalidate_cache(self.sheet_name)
+                print(f"❌ Ошибка при чтении новых строк листа '{self.sheet_name}': {e}")
+                return
+            first = self.row
+            for offset, values in enumerate(rows[1:], start=1):
+                self.row, self.values = first + offset, values
+                if any(values):
+                    yield dict(zip(headers, values))
+            if len(rows) <= self.chunk_rows:
+                return
+
+def is_available():
+    """False, пока размыкатель пула открыт: вызовы к API отклоняются без ожидания."""
+    return pool.is_available()
+
 # --- Тестовая инициализация (опционально, только при прямом запуске) ---
 if __name__ == "__main__":
     print("🧪 Локальный тест Google Sheets...")
@@ -0,0 +1,99 @@
+import os
+import math
+import threading
+from collections import deque
+
+# --- Настройки измерения задержки до клиентов ---
+# Сколько последних замеров RTT хранится на одно подключение.
+RTT_WINDOW = int(os.environ.get('RTT_WINDOW', 20))
+# Подключение считается деградировавшим, если его p95 RTT выше порога (мс) или оно осталось на long-polling.
+RTT_DEGRADED_MS = float(os.environ.get('RTT_DEGRADED_MS', 300))
+# Джиттер выше порога (мс) — соединение нестабильно.
+RTT_UNSTABLE_JITTER_MS = float(os.environ.get('RTT_UNSTABLE_JITTER_MS', 30))
+
+
+def percentile(values, fraction):
+    """Перцентиль по ближайшему рангу; None для пустого списка."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def is_degraded(p95, transport):
+    return p95 > RTT_DEGRADED_MS or transport == 'polling'
+
+
+class _Connection:
+    """Скользящее окно замеров одного подключения и сглаженный джиттер (как в RFC 3550: J += (|D| - J) / 16)."""
+
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.jitter = 0.0
+        self.transport = None
+
+    def add(self, rtt_ms):
+        if self.samples:
+            self.jitter += (abs(rtt_ms - self.samples[-1]) - self.jitter) / 16
+        self.samples.append(rtt_ms)
+
+
+class LatencyTracker:
+    """
+    RTT до каждого подключения, измеренный сервером: ответ pong_response на ping_check клиента уходит
+    с подтверждением, и время до подтверждения — полный круг сервер -> клиент -> сервер.
+    Хранит последние RTT_WINDOW замеров на sid, джиттер и транспорт (websocket или polling).
+    """
+
+    def __init__(self, window=RTT_WINDOW):
+        self.window = window
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def record(self, sid, rtt_ms, transport=None):
+        with self._lock:
+            connection = self._connections.get(sid)
+            if connection is None:
+                connection = self._connections[sid] = _Connection(self.window)
+            connection.add(rtt_ms)
+            if transport:
+                connection.transport = transport
+
+    def forget(self, sid):
+        with self._lock:
+            self._connections.pop(sid, None)
+
+    def stats(self, sid):
+        """Статистика подключения или None, если замеров еще нет."""
+        with self._lock:
+            connection = self._connections.get(sid)
+            if connection is None or not connection.samples:
+                return None
+            samples = list(connection.samples)
+            jitter, transport = connection.jitter, connection.transport
+        return {'last': samples[-1], 'avg': sum(samples) / len(samples), 'p50': percentile(samples, 0.5),
+                'p95': percentile(samples, 0.95), 'jitter': jitter, 'samples': len(samples), 'transport': transport}
+
+    def group_stats(self, sessions, key):
+        """
+        Сводка по группам подключений: key(info) -> группа (роль, отряд).
+        {группа: {'connections', 'p50', 'p95', 'websocket', 'polling', 'degraded'}}; p50/p95 — по всем замерам группы.
+        """
+        with self._lock:
+            connections = {sid: (list(c.samples), c.transport) for sid, c in self._connections.items() if c.samples}
+        groups = {}
+        for sid, info in sessions.items():
+            if sid not in connections:
+                continue
+            samples, transport = connections[sid]
+            group = groups.setdefault(key(info), {'connections': 0, 'samples': [], 'websocket': 0, 'polling': 0, 'degraded': 0})
+            group['connections'] += 1
+            group['samples'].extend(samples)
+            if transport in ('websocket', 'polling'):
+                group[transport] += 1
+            if is_degraded(percentile(samples, 0.95), transport):
+                group['degraded'] += 1
+        for group in groups.values():
+            samples = group.pop('samples')
+            group['p50'], group['p95'] = percentile(samples, 0.5), percentile(samples, 0.95)
+        return groups
@@ -0,0 +1,147 @@
+import os
+import bisect
+import threading
+
+# --- Настройки постраничного вывода списков ---
+LISTING_PAGE_SIZE = int(os.environ.get('LISTING_PAGE_SIZE', 25))
+LISTING_MAX_PAGE_SIZE = int(os.environ.get('LISTING_MAX_PAGE_SIZE', 200))
+# Сколько строк списка уходит клиенту одним кадром: первые строки страницы приходят, не дожидаясь остальных.
+LISTING_CHUNK_ROWS = int(os.environ.get('LISTING_CHUNK_ROWS', 10))
+
+
+def sort_key(value):
+    """Ключ порядка и курсора: числовые ID сравниваются как числа и идут раньше строковых."""
+    text = str(value)
+    return (0, int(text), '') if text.isdigit() else (1, 0, text)
+
+
+def parse_options(argv, filters, page_size=LISTING_PAGE_SIZE, max_page_size=LISTING_MAX_PAGE_SIZE):
+    """
+    Разбор '--page N --size N --<фильтр> <значение>'; значение фильтра — все слова до следующего '--'.
+    filters — допустимые имена фильтров. Возвращает (страница, размер, {фильтр: значение в нижнем регистре}),
+    при ошибке бросает ValueError с текстом для пользователя.
+    """
+    options = {}
+    name = None
+    for word in argv:
+        if not word:
+            continue
+        if word.startswith('--'):
+            name = word[2:].lower()
+            if name not in filters and name not in ('page', 'size'):
+                raise ValueError(f"Неизвестный параметр '{word}'.")
+            options[name] = []
+        elif name is None:
+            raise ValueError(f"Лишний аргумент '{word}'.")
+        else:
+            options[name].append(word)
+    values = {name: " ".join(words) for name, words in options.items()}
+    for name, value in values.items():
+        if not value:
+            raise ValueError(f"Не указано значение для --{name}.")
+    try:
+        page = int(values.pop('page', 1))
+        size = int(values.pop('size', page_size))
+    except ValueError:
+        raise ValueError("--page и --size должны быть числами.")
+    if page < 1 or size < 1:
+        raise ValueError("--page и --size должны быть больше нуля.")
+    return page, min(size, max_page_size), {name: value.lower() for name, value in values.items()}
+
+
+class Listing:
+    """
+    Описание постраничного списка команды name. rows(ctx, filters) отдает уже отфильтрованные записи
+    (по индексам DataStore, до отрисовки), line(ctx, запись) — текст записи с переводом строки,
+    key(запись) — ключ порядка. header(filters) и footer — рамка списка, empty — текст пустого списка.
+    scope(ctx) — часть ключа кэша, от которой зависит отрисовка (отряд), sheets — листы-источники.
+    """
+
+    def __init__(self, name, header, footer, empty, rows, line, key, filters=(), sheets=(), scope=lambda ctx: None):
+        self.name = name
+        self.header = header
+        self.footer = footer
+        self.empty = empty
+        self.rows = rows
+        self.line = line
+        self.key = key
+        self.filters = tuple(filters)
+        self.sheets = tuple(sheets)
+        self.scope = scope
+
+
+class Paginator:
+    """
+    Страницы списков и курсоры 'more'. Курсор на sid хранит список, фильтры, размер страницы и ключ
+    последней показанной записи: следующая страница начинается строго после этого ключа, поэтому
+    добавление и закрытие записей между запросами не сдвигает ее и не повторяет строк.
+    Отрисованные страницы лежат в RenderCache по ключу (список, роль, область, фильтры, позиция, размер).
+    Страница — кортеж кусков по chunk_rows строк, которые отправляются отдельными кадрами.
+    """
+
+    def __init__(self, render_cache, page_size=LISTING_PAGE_SIZE, max_page_size=LISTING_MAX_PAGE_SIZE,
+                 chunk_rows=LISTING_CHUNK_ROWS):
+        self.render_cache = render_cache
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.chunk_rows = max(1, chunk_rows)
+        self.listings = {}
+        self._cursors = {}
+        self._lock = threading.Lock()
+
+    def register(self, listing):
+        self.listings[listing.name] = listing
+        return listing
+
+    def _render(self, listing, ctx, filters, page, after, size):
+        rows = listing.rows(ctx, filters)
+        keys = [sort_key(listing.key(row)) for row in rows]
+        start = bisect.bisect_right(keys, after) if after is not None else (page - 1) * size
+        shown = rows[start:start + size]
+        total = len(rows)
+        pages = -(-total // size)
+        header = listing.header(filters)
+        if shown and (total > size or start > 0):
+            header += f"  Записи {start + 1}–{start + len(shown)} из {total} (страница {start // size + 1} из {pages})\n"
+        lines = [listing.line(ctx, row) for row in shown]
+        if not lines:
+            lines = [listing.empty if total == 0 else f"  Страница {start // size + 1} пуста: всего записей {total}, страниц {pages}.\n"]
+        has_more = start + len(shown) < total
+        footer = listing.footer
+        if has_more:
+            footer += f"ℹ️ Продолжение: more (или {listing.name} --page N)\n"
+        chunks = ["".join(lines[i:i + self.chunk_rows]) for i in range(0, len(lines), self.chunk_rows)]
+        chunks[0] = header + chunks[0]
+        chunks[-1] += footer
+        last_key = keys[start + len(shown) - 1] if shown else after
+        return tuple(chunks), last_key, has_more
+
+    def _page(self, listing, ctx, filters, page, after, size):
+        key = (listing.name, ctx.role, listing.scope(ctx), tuple(sorted(filters.items())), page, after, size)
+        chunks, last_key, has_more = self.render_cache.get_or_render(
+            key, listing.sheets, lambda: self._render(listing, ctx, filters, page, after, size))
+        with self._lock:
+            if has_more:
+                self._cursors[ctx.sid] = (listing.name, ctx.uid, filters, size, last_key)
+            else:
+                self._cursors.pop(ctx.sid, None)
+        return chunks
+
+    def page(self, name, ctx, argv, defaults=None):
+        """Куски страницы списка по аргументам команды; ошибки разбора — ValueError."""
+        listing = self.listings[name]
+        page, size, filters = parse_options(argv, listing.filters, self.page_size, self.max_page_size)
+        return self._page(listing, ctx, {**(defaults or {}), **filters}, page, None, size)
+
+    def more(self, ctx):
+        """Куски следующей страницы последнего списка этого sid или None, если продолжать нечего."""
+        with self._lock:
+            cursor = self._cursors.get(ctx.sid)
+        if cursor is None or cursor[1] != ctx.uid:
+            return None
+        name, uid, filters, size, last_key = cursor
+        return self._page(self.listings[name], ctx, filters, None, last_key, size)
+
+    def forget(self, sid):
+        with self._lock:
+            self._cursors.pop(sid, None)
@@ -0,0 +1,590 @@
+"""
+Нагрузочный тест WebTerminal без Google Таблиц.
+
+Настоящее приложение запускается в этом процессе, а вместо gspread подставляется таблица в памяти
+с искусственной задержкой и ошибками квоты. Код google_sheets_api (кэши, пул вызовов, размыкатель)
+работает как в бою. N клиентов python-socketio входят как оперативники, командиры и Синдикат
+и выполняют типичный набор команд; на выходе — пропускная способность, p50/p99 и число вызовов API по командам.
+
+    python loadtest.py --clients 40 --commands 30 --latency-ms 80 --save baseline.json
+    python loadtest.py --clients 40 --commands 30 --latency-ms 80 --compare baseline.json
+
+С --compare код выхода 1, если результат хуже базового сверх допуска (--tolerance).
+Клиенту нужен python-socketio[client] (requests и websocket-client).
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+
+from gspread.utils import a1_to_rowcol, numericise_all
+
+import google_sheets_api
+from storage import (USERS_SHEET_NAME, CONTRACTS_SHEET_NAME, REQUESTS_SHEET_NAME, LOG_SHEET_NAME, MESSAGES_SHEET_NAME,
+                     USER_COLUMNS, CONTRACT_COLUMNS, REQUEST_COLUMNS, LOG_COLUMNS, MESSAGE_COLUMNS)
+
+# Реальный sleep: вызовы API выполняются в потоках ОС пула, где зеленый sleep не нужен.
+real_sleep = eventlet.patcher.original('time').sleep
+
+# Набор команд по ролям: (команда, вес). {contract}, {operative}, {uid} подставляются для каждого вызова.
+COMMAND_MIX = {
+    "operative": [("contracts", 3), ("sendmsg отряд, на связи", 3), ("msghistory", 3), ("view_orders", 1)],
+    "commander": [("contracts", 2), ("sendmsg отряд, сбор", 2), ("msghistory", 2), ("assign_contract {contract} {operative}", 3)],
+    "syndicate": [("contracts", 3), ("sendmsg {uid} проверка связи", 2), ("viewrequests", 1), ("sendmsg всем постам", 1)],
+}
+DEFAULT_ROLE_SHARES = "operative:0.7,commander:0.2,syndicate:0.1"
+FIRST_UID = 1000
+CONTRACT_COUNT = 50
+REQUEST_COUNT = 20
+MESSAGE_COUNT = 300
+# Ответ команды всегда заканчивается пустой строкой (output + '\n'), рассылки отряду/всем — нет.
+REPLY_END = "\n\n"
+# Абсолютный допуск задержки: на малых величинах относительный допуск ловит шум.
+LATENCY_FLOOR_MS = 5.0
+# p99 по паре замеров — шум; задержка сравнивается только для команд с достаточной выборкой.
+MIN_LATENCY_SAMPLES = 20
+
+
+class QuotaExceeded(Exception):
+    """Искусственная ошибка квоты, как APIError 429 от Google."""
+
+
+class FakeBackend:
+    """Общие настройки и счетчики подставной таблицы: задержка, доля ошибок квоты, вызовы по методам."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, quota_error_rate=0.0, seed=0):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.quota_error_rate = quota_error_rate
+        self.calls = Counter()
+        self.quota_errors = 0
+        self.modified_at = datetime.now(timezone.utc)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def call(self, method):
+        with self._lock:
+            self.calls[method] += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fail = self._random.random() < self.quota_error_rate
+            if fail:
+                self.quota_errors += 1
+        if delay > 0:
+            real_sleep(delay)
+        if fail:
+            raise QuotaExceeded(f"APIError: [429]: Quota exceeded ({method}, искусственная ошибка)")
+
+    def touch(self):
+        with self._lock:
+            self.modified_at = datetime.now(timezone.utc)
+
+
+class FakeWorksheet:
+    """Лист в памяти с подмножеством методов gspread.Worksheet, которые вызывает google_sheets_api."""
+
+    def __init__(self, backend, sheet_id, title, rows):
+        self.backend = backend
+        self.id = sheet_id
+        self.title = title
+        self.rows = [[str(value) for value in row] for row in rows]
+        self._lock = threading.Lock()
+
+    def get_all_records(self):
+        self.backend.call('get_all_records')
+        with self._lock:
+            headers = self.rows[0]
+            return [dict(zip(headers, numericise_all(row + [''] * (len(headers) - len(row))))) for row in self.rows[1:]]
+
+    def row_values(self, row_number):
+        self.backend.call('row_values')
+        with self._lock:
+            return list(self.rows[row_number - 1]) if row_number <= len(self.rows) else []
+
+    def col_values(self, col_number):
+        self.backend.call('col_values')
+        with self._lock:
+            return [row[col_number - 1] if col_number <= len(row) else '' for row in self.rows]
+
+    def get_values(self, range_name=None, **kwargs):
+        self.backend.call('get_values')
+        with self._lock:
+            if not range_name:
+                return [list(row) for row in self.rows]
+            start, end = range_name.split(':')
+            first, _ = a1_to_rowcol(start)
+            last, last_col = a1_to_rowcol(end)
+            return [list(row[:last_col]) for row in self.rows[first - 1:last]]
+
+    def _append(self, rows):
+        with self._lock:
+            first = len(self.rows) + 1
+            self.rows.extend([str(value) for value in row] for row in rows)
+            last = len(self.rows)
+        self.backend.touch()
+        return {'updates': {'updatedRange': f"'{self.title}'!A{first}:Z{last}"}}
+
+    def append_row(self, row, value_input_option=None, **kwargs):
+        self.backend.call('append_row')
+        return self._append([row])
+
+    def append_rows(self, rows, value_input_option=None, **kwargs):
+        self.backend.call('append_rows')
+        return self._append(rows)
+
+    def set_cell(self, row_number, col_number, value):
+        with self._lock:
+            while len(self.rows) < row_number:
+                self.rows.append([])
+            row = self.rows[row_number - 1]
+            row.extend([''] * (col_number - len(row)))
+            row[col_number - 1] = str(value)
+
+    def get_cell(self, row_number, col_number):
+        with self._lock:
+            if row_number > len(self.rows) or col_number > len(self.rows[row_number - 1]):
+                return ''
+            return self.rows[row_number - 1][col_number - 1]
+
+    def batch_update(self, data, value_input_option=None, **kwargs):
+        self.backend.call('batch_update')
+        for item in data:
+            row_number, col_number = a1_to_rowcol(item['range'])
+            self.set_cell(row_number, col_number, item['values'][0][0])
+        self.backend.touch()
+
+    def delete_rows(self, row_number, end_index=None):
+        self.backend.call('delete_rows')
+        with self._lock:
+            del self.rows[row_number - 1:(end_index or row_number)]
+        self.backend.touch()
+
+
+class FakeSpreadsheet:
+    """Таблица в памяти: листы плюс пакетные методы spreadsheets.batchUpdate и values.batchGet."""
+
+    def __init__(self, backend, sheets):
+        self.backend = backend
+        self.sheets = {title: FakeWorksheet(backend, sheet_id, title, rows)
+                       for sheet_id, (title, rows) in enumerate(sheets.items(), start=1)}
+        self._by_id = {worksheet.id: worksheet for worksheet in self.sheets.values()}
+
+    def worksheets(self):
+        self.backend.call('worksheets')
+        return list(self.sheets.values())
+
+    def values_batch_get(self, ranges, params=None):
+        self.backend.call('values_batch_get')
+        value_ranges = []
+        for cell_range in ranges:
+            title, cell = cell_range.rsplit('!', 1)
+            value = self.sheets[title.strip("'")].get_cell(*a1_to_rowcol(cell))
+            value_ranges.append({'range': cell_range, 'values': [[value]]} if value != '' else {'range': cell_range})
+        return {'valueRanges': value_ranges}
+
+    def batch_update(self, body):
+        self.backend.call('spreadsheet_batch_update')
+        for request in body.get('requests', []):
+            if 'appendCells' in request:
+                spec = request['appendCells']
+                worksheet = self._by_id[spec['sheetId']]
+                rows = [[_cell_value(cell) for cell in row['values']] for row in spec['rows']]
+                worksheet._append(rows)
+            elif 'updateCells' in request:
+                spec = request['updateCells']
+                worksheet = self._by_id[spec['range']['sheetId']]
+                worksheet.set_cell(spec['range']['startRowIndex'] + 1, spec['range']['startColumnIndex'] + 1,
+                                   _cell_value(spec['rows'][0]['values'][0]))
+        self.backend.touch()
+        return {}
+
+
+class FakeDriveResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+class FakeClient:
+    """Вместо gspread.Client: только запрос modifiedTime к Drive API."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def request(self, method, url, params=None, **kwargs):
+        self.backend.call('drive_modified_time')
+        return FakeDriveResponse({'modifiedTime': self.backend.modified_at.isoformat()})
+
+
+def _cell_value(cell):
+    value = cell.get('userEnteredValue', {})
+    return next(iter(value.values()), '')
+
+
+def seed_sheets(users, squads):
+    """Начальные данные: пользователи нагрузочного теста, контракты, запросы и история сообщений отрядов."""
+    contracts = [CONTRACT_COLUMNS] + [
+        [i, f"Контракт {i}", "Сопровождение груза", 100 * i, "active", "None", 1] for i in range(1, CONTRACT_COUNT + 1)]
+    requests = [REQUEST_COLUMNS] + [
+        [i, FIRST_UID, "Клиент", f"client#{i}", "Охрана", "Нужна охрана склада", "Новый", 1] for i in range(1, REQUEST_COUNT + 1)]
+    started = datetime.now() - timedelta(hours=1)
+    messages = [MESSAGE_COLUMNS]
+    for i in range(MESSAGE_COUNT):
+        squad = squads[i % len(squads)]
+        timestamp = (started + timedelta(seconds=i)).strftime('%Y-%m-%d %H:%M:%S')
+        messages.append([timestamp, FIRST_UID, "Архив", squad, "squad", squad, f"сообщение {i}"])
+    return {
+        USERS_SHEET_NAME: [USER_COLUMNS] + [[u['uid'], u['key'], u['role'], u['callsign'], u['squad']] for u in users],
+        CONTRACTS_SHEET_NAME: contracts,
+        REQUESTS_SHEET_NAME: requests,
+        LOG_SHEET_NAME: [LOG_COLUMNS],
+        MESSAGES_SHEET_NAME: messages,
+    }
+
+
+def make_users(count, role_shares, squads):
+    """Пользователи по долям ролей; оперативники и командиры распределяются по отрядам по кругу."""
+    users = []
+    roles = []
+    for role, share in role_shares.items():
+        roles += [role] * max(1, round(count * share)) if share > 0 else []
+    roles = (roles + ["operative"] * count)[:count]
+    for i, role in enumerate(roles):
+        uid = str(FIRST_UID + i)
+        squad = squads[i % len(squads)] if role in ("operative", "commander") else "None"
+        users.append({'uid': uid, 'key': f"bench-{uid}", 'role': role, 'callsign': f"{role[:3]}{uid}", 'squad': squad})
+    return users
+
+
+def parse_role_shares(text):
+    shares = {}
+    for part in text.split(","):
+        role, _, share = part.partition(":")
+        if role.strip() not in COMMAND_MIX:
+            raise argparse.ArgumentTypeError(f"Неизвестная роль '{role}'. Доступны: {', '.join(COMMAND_MIX)}")
+        shares[role.strip()] = float(share or 0)
+    return shares
+
+
+def install_fake_sheets(backend, sheets):
+    """Подменяет подключение google_sheets_api: дальше работают его настоящие функции поверх таблицы в памяти."""
+    spreadsheet = FakeSpreadsheet(backend, sheets)
+
+    def init_google_sheets():
+        google_sheets_api.gc = FakeClient(backend)
+        google_sheets_api.spreadsheet = spreadsheet
+        google_sheets_api.invalidate_cache()
+        print("✅ Подставная таблица в памяти подключена.")
+        return True
+
+    google_sheets_api.init_google_sheets = init_google_sheets
+    return spreadsheet
+
+
+class SimulatedClient:
+    """Клиент socket.io: входит в систему и выполняет команды по одной, замеряя время до ответа."""
+
+    def __init__(self, url, user, users, rng, timeout):
+        import socketio
+        self.url = url
+        self.user = user
+        self.users = users
+        self.rng = rng
+        self.timeout = timeout
+        self.samples = []
+        self.timeouts = Counter()
+        self.connected = False
+        self._reply = eventlet.event.Event()
+        self._logged_in = eventlet.event.Event()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('terminal_output', self._on_output)
+        self.sio.on('update_ui_state', self._on_ui_state)
+        self.sio.on('login_failure', lambda payload: self._logged_in.ready() or self._logged_in.send(False))
+        self.sio.on('batch', self._on_batch)
+
+    def _on_output(self, payload):
+        if REPLY_END in payload.get('output', '') and not self._reply.ready():
+            self._reply.send(True)
+
+    def _on_ui_state(self, payload):
+        if payload.get('role') not in (None, 'guest') and not self._logged_in.ready():
+            self._logged_in.send(True)
+
+    def _on_batch(self, frames):
+        handlers = {'terminal_output': self._on_output, 'update_ui_state': self._on_ui_state}
+        for event, payload in frames:
+            if event in handlers:
+                handlers[event](payload)
+
+    def login(self):
+        self.sio.connect(self.url, transports=['websocket'])
+        self.connected = True
+        self.sio.emit('login', {'uid': self.user['uid'], 'key': self.user['key']})
+        with eventlet.Timeout(self.timeout, False):
+            return self._logged_in.wait()
+        return False
+
+    def next_command(self):
+        mix = COMMAND_MIX[self.user['role']]
+        template = self.rng.choices([command for command, _ in mix], weights=[weight for _, weight in mix])[0]
+        squad_operatives = [u['uid'] for u in self.users if u['role'] == 'operative' and u['squad'] == self.user['squad']]
+        return template.format(
+            contract=self.rng.randint(1, CONTRACT_COUNT),
+            operative=self.rng.choice(squad_operatives) if squad_operatives else self.user['uid'],
+            uid=self.rng.choice(self.users)['uid'],
+        )
+
+    def run(self, count, think):
+        for _ in range(count):
+            command = self.next_command()
+            name = command.split(" ", 1)[0]
+            self._reply = eventlet.event.Event()
+            started = time.perf_counter()
+            self.sio.emit('terminal_input', {'command': command})
+            replied = None
+            with eventlet.Timeout(self.timeout, False):
+                replied = self._reply.wait()
+            if replied is None:
+                self.timeouts[name] += 1
+            else:
+                self.samples.append((name, time.perf_counter() - started))
+            if think:
+                eventlet.sleep(self.rng.uniform(0, 2 * think))
+
+    def close(self):
+        if self.connected:
+            self.sio.disconnect()
+
+
+class ApiCallAttribution:
+    """
+    Относит вызовы API к команде, во время которой они сделаны (обработчик команды — отдельный зеленый поток,
+    поэтому хватает threading.local). Вызовы вне команд — обновление данных, сброс логов — идут в 'background'.
+    """
+
+    def __init__(self, commands, pool):
+        self.calls = Counter()
+        self._context = threading.local()
+        dispatch, run = commands.dispatch, pool.run
+
+        def attributed_dispatch(name, ctx, *args, **kwargs):
+            self._context.command = name
+            try:
+                return dispatch(name, ctx, *args, **kwargs)
+            finally:
+                self._context.command = None
+
+        def counted_run(fn, *args, **kwargs):
+            self.calls[getattr(self._context, 'command', None) or 'background'] += 1
+            return run(fn, *args, **kwargs)
+
+        commands.dispatch = attributed_dispatch
+        pool.run = counted_run
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по ближайшему рангу."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples, timeouts, api_calls, elapsed, backend, config):
+    by_command = defaultdict(list)
+    for name, latency in samples:
+        by_command[name].append(latency * 1000)
+    per_command = {}
+    for name in sorted(set(by_command) | set(timeouts)):
+        latencies = sorted(by_command.get(name, []))
+        count = len(latencies)
+        per_command[name] = {
+            'count': count,
+            'timeouts': timeouts.get(name, 0),
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'mean_ms': round(sum(latencies) / count, 2) if count else 0.0,
+            'api_calls': api_calls.get(name, 0),
+            'api_calls_per_command': round(api_calls.get(name, 0) / count, 3) if count else 0.0,
+        }
+    return {
+        'config': config,
+        'duration_s': round(elapsed, 3),
+        'commands': len(samples),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        'timeouts': sum(timeouts.values()),
+        'per_command': per_command,
+        'background_api_calls': api_calls.get('background', 0),
+        'api_calls_by_method': dict(backend.calls),
+        'quota_errors_injected': backend.quota_errors,
+    }
+
+
+def print_report(result, out=sys.stdout):
+    print(f"\n--- 📈 НАГРУЗОЧНЫЙ ТЕСТ: {result['config']['clients']} клиентов, "
+          f"задержка API {result['config']['latency_ms']} мс ---", file=out)
+    print(f"Команд: {result['commands']} за {result['duration_s']} с, "
+          f"пропускная способность {result['throughput_rps']} ком/с, таймаутов {result['timeouts']}", file=out)
+    print(f"{'команда':<18}{'кол-во':>8}{'p50 мс':>10}{'p99 мс':>10}{'API':>8}{'API/ком':>9}", file=out)
+    for name, stats in result['per_command'].items():
+        print(f"{name:<18}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p99_ms']:>10}"
+              f"{stats['api_calls']:>8}{stats['api_calls_per_command']:>9}", file=out)
+    print(f"Фоновые вызовы API: {result['background_api_calls']}, "
+          f"искусственных ошибок квоты: {result['quota_errors_injected']}", file=out)
+    print(f"Вызовы по методам: {result['api_calls_by_method']}", file=out)
+
+
+def compare(result, baseline, tolerance):
+    """Список регрессий относительно базового прогона (пустой — все в допуске)."""
+    regressions = []
+    if result['throughput_rps'] < baseline['throughput_rps'] * (1 - tolerance):
+        regressions.append(f"пропускная способность {result['throughput_rps']} < {baseline['throughput_rps']} ком/с")
+    if result['timeouts'] > baseline.get('timeouts', 0):
+        regressions.append(f"таймаутов {result['timeouts']} (было {baseline.get('timeouts', 0)})")
+    for name, base in baseline['per_command'].items():
+        current = result['per_command'].get(name)
+        if current is None or not current['count']:
+            continue
+        if (min(current['count'], base['count']) >= MIN_LATENCY_SAMPLES
+                and current['p99_ms'] > base['p99_ms'] * (1 + tolerance)
+                and current['p99_ms'] - base['p99_ms'] > LATENCY_FLOOR_MS):
+            regressions.append(f"{name}: p99 {current['p99_ms']} мс (было {base['p99_ms']})")
+        if current['api_calls_per_command'] > base['api_calls_per_command'] * (1 + tolerance) + 0.01:
+            regressions.append(f"{name}: вызовов API на команду {current['api_calls_per_command']} "
+                               f"(было {base['api_calls_per_command']})")
+    return regressions
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def wait_for_server(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return True
+        except OSError:
+            eventlet.sleep(0.05)
+    return False
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест WebTerminal с таблицей в памяти.")
+    parser.add_argument('--clients', type=int, default=20, help="число одновременных клиентов")
+    parser.add_argument('--commands', type=int, default=30, help="команд на клиента")
+    parser.add_argument('--roles', type=parse_role_shares, default=parse_role_shares(DEFAULT_ROLE_SHARES),
+                        help=f"доли ролей, по умолчанию {DEFAULT_ROLE_SHARES}")
+    parser.add_argument('--squads', default="alpha,beta", help="отряды через запятую")
+    parser.add_argument('--latency-ms', type=float, default=50.0, help="задержка каждого вызова API")
+    parser.add_argument('--jitter-ms', type=float, default=20.0, help="случайная добавка к задержке (0..jitter)")
+    parser.add_argument('--quota-error-rate', type=float, default=0.0, help="доля вызовов API с ошибкой квоты")
+    parser.add_argument('--think-ms', type=float, default=0.0, help="средняя пауза клиента между командами")
+    parser.add_argument('--timeout', type=float, default=15.0, help="сколько секунд ждать ответа на команду")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', metavar='PATH', help="сохранить результат как базовый JSON")
+    parser.add_argument('--compare', metavar='PATH', help="сравнить с базовым JSON")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="допустимое ухудшение (доля)")
+    parser.add_argument('--verbose', action='store_true', help="не глушить консольный лог сервера")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        import socketio
+        socketio.Client
+    except (ImportError, AttributeError):
+        print("❌ Нужен клиент python-socketio: pip install 'python-socketio[client]'")
+        return 2
+
+    squads = [squad.strip() for squad in args.squads.split(",") if squad.strip()]
+    users = make_users(args.clients, args.roles, squads)
+    backend = FakeBackend(args.latency_ms, args.jitter_ms, args.quota_error_rate, args.seed)
+    install_fake_sheets(backend, seed_sheets(users, squads))
+
+    # Приложение настраивается переменными окружения при импорте: хранилище — Google Таблицы (подставные),
+    # без Redis, ограничитель частоты не мешает замеру пропускной способности.
+    os.environ['STORAGE_BACKEND'] = 'sheets'
+    os.environ['SNAPSHOT_PATH'] = ''
+    for name in ('SHARED_STATE_URL', 'REDIS_URL'):
+        os.environ.pop(name, None)
+    os.environ.setdefault('ACCESS_KEYS_JSON', json.dumps({role: [] for role in COMMAND_MIX}))
+    for name in ('RATE_LIMIT_SID_BURST', 'RATE_LIMIT_UID_BURST', 'RATE_LIMIT_GLOBAL_BURST'):
+        os.environ.setdefault(name, '1000000')
+    for name in ('RATE_LIMIT_SID_RATE', 'RATE_LIMIT_UID_RATE', 'RATE_LIMIT_GLOBAL_RATE'):
+        os.environ.setdefault(name, '1000000')
+
+    report_out = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, 'w', encoding='utf-8')
+    try:
+        import WebTerminal
+        attribution = ApiCallAttribution(WebTerminal.commands, google_sheets_api.pool)
+        while WebTerminal.startup_state['reconciled_at'] is None:
+            eventlet.sleep(0.01)
+        port = free_port()
+        eventlet.spawn(WebTerminal.socketio.run, WebTerminal.app, host='127.0.0.1', port=port, log_output=False)
+        if not wait_for_server(port):
+            print("❌ Сервер не запустился.", file=report_out)
+            return 2
+        url = f"http://127.0.0.1:{port}"
+        clients = [SimulatedClient(url, user, users, random.Random(args.seed * 100003 + i), args.timeout)
+                   for i, user in enumerate(users)]
+        green_pool = eventlet.GreenPool(max(1, len(clients)))
+        logged_in = list(green_pool.imap(lambda client: client.login(), clients))
+        if not all(logged_in):
+            print(f"⚠️ Не вошли {logged_in.count(False)} из {len(clients)} клиентов.", file=report_out)
+        active = [client for client, ok in zip(clients, logged_in) if ok]
+
+        attribution.calls.clear()
+        backend.calls.clear()
+        started = time.perf_counter()
+        for _ in green_pool.imap(lambda client: client.run(args.commands, args.think_ms / 1000.0), active):
+            pass
+        elapsed = time.perf_counter() - started
+        for client in clients:
+            client.close()
+    finally:
+        if not args.verbose:
+            sys.stdout.close()
+            sys.stdout = report_out
+
+    samples = [sample for client in active for sample in client.samples]
+    timeouts = sum((client.timeouts for client in active), Counter())
+    config = {key: value for key, value in vars(args).items() if key not in ('save', 'compare', 'verbose')}
+    result = summarize(samples, timeouts, attribution.calls, elapsed, backend, config)
+    print_report(result)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"✅ Результат сохранен в {args.save}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print("❌ Регрессии относительно базового прогона:")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print(f"✅ В пределах допуска {int(args.tolerance * 100)}% от {args.compare}.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import os
+import re
+import gzip
+import itertools
+import json
+import time
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+import storage
+from storage import LOG_SHEET_NAME, MESSAGES_SHEET_NAME, LOG_COLUMNS, MESSAGE_COLUMNS, TABLES
+
+# --- Настройки архива листов-журналов ---
+# Ротация включается только явно заданным каталогом (по умолчанию отключена): перенесенные строки удаляются
+# из живых листов, поэтому каталог должен быть постоянным (не эфемерная ФС контейнера, которая очищается
+# при перезапуске) и общим для всех воркеров — иначе у каждого узла свой неполный архив и logsearch
+# отвечает по-разному.
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', '')
+# Ротация, когда в живом листе больше ARCHIVE_MAX_ROWS строк или есть строки старше ARCHIVE_MAX_AGE секунд.
+ARCHIVE_MAX_ROWS = int(os.environ.get('ARCHIVE_MAX_ROWS', 5000))
+ARCHIVE_MAX_AGE = float(os.environ.get('ARCHIVE_MAX_AGE', 7 * 24 * 3600))
+# Сколько последних строк остается в живом листе после ротации по размеру.
+ARCHIVE_KEEP_ROWS = int(os.environ.get('ARCHIVE_KEEP_ROWS', 1000))
+ARCHIVE_INTERVAL = float(os.environ.get('ARCHIVE_INTERVAL', 3600))
+ARCHIVE_QUERY_LIMIT = int(os.environ.get('ARCHIVE_QUERY_LIMIT', 100))
+MANIFEST_NAME = "manifest.json"
+ARCHIVE_FORMAT = 1
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Лист -> колонки архива (по порядку колонок листа).
+ARCHIVED_SHEETS = {LOG_SHEET_NAME: LOG_COLUMNS, MESSAGES_SHEET_NAME: MESSAGE_COLUMNS}
+_UID_PATTERN = re.compile(r"UID:\s*([^,\s]+)")
+
+
+def record_uids(sheet_name, record):
+    """UID пользователей, к которым относится строка: из User_Info лога или отправитель и получатель личного сообщения."""
+    if sheet_name == LOG_SHEET_NAME:
+        return set(_UID_PATTERN.findall(str(record.get('User_Info', ''))))
+    uids = {str(record.get('Sender_UID', ''))}
+    if record.get('Recipient_Type') == 'private':
+        uids.add(str(record.get('Recipient_ID', '')))
+    return uids - {''}
+
+
+def in_range(timestamp, since, until):
+    """Метки времени сравниваются как строки; until включительно по префиксу ('2024-05-01' — весь день)."""
+    return timestamp >= since and timestamp[:len(until)] <= until
+
+
+class LogArchive:
+    """
+    Ротация листов 'Логи' и 'Сообщения' в локальный сжатый архив. Каждая ротация пишет файл
+    <таблица>-<время>.jsonl.gz (строка JSON на запись) и только после этого удаляет перенесенные строки
+    из начала живого листа, так что лист остается небольшим и быстрым. manifest.json хранит для каждого
+    файла лист, диапазон времени, число строк и UID пользователей — запрос по времени и пользователю
+    открывает только подходящие файлы.
+    Строки живых листов кэшируются вместе с их TailReader: ротация и запрос дочитывают только строки,
+    добавленные после прошлого чтения, а не весь лист.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR, max_rows=ARCHIVE_MAX_ROWS, max_age=ARCHIVE_MAX_AGE,
+                 keep_rows=ARCHIVE_KEEP_ROWS, interval=ARCHIVE_INTERVAL):
+        self.directory = directory
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.keep_rows = min(keep_rows, max_rows)
+        self.interval = interval
+        self.entries = []
+        self.rotated_at = None
+        # Лист -> (TailReader, строки живого листа, прочитанные им).
+        self._live = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    def load_manifest(self):
+        """Читает манифест; файлы архива, которых в нем нет (сбой между записью файла и манифеста), добавляются."""
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path, encoding='utf-8') as f:
+                    self.entries = json.load(f).get('files', [])
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Манифест архива '{self.manifest_path}' не прочитан: {e}")
+            self.entries = []
+        known = {entry['file'] for entry in self.entries}
+        orphans = sorted(name for name in os.listdir(self.directory) if name.endswith('.jsonl.gz') and name not in known)
+        for name in orphans:
+            sheet_name = next((sheet for sheet in ARCHIVED_SHEETS if name.startswith(TABLES[sheet][0] + '-')), None)
+            if sheet_name is not None:
+                self.entries.append(self._describe(name, sheet_name, list(self._read_file(name))))
+        if orphans:
+            self._save_manifest()
+
+    def _save_manifest(self):
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'format': ARCHIVE_FORMAT, 'files': self.entries}, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.manifest_path)
+            return True
+        except OSError as e:
+            print(f"❌ Ошибка записи манифеста архива '{self.manifest_path}': {e}")
+            return False
+
+    @staticmethod
+    def _describe(name, sheet_name, records):
+        uids = set()
+        for record in records:
+            uids |= record_uids(sheet_name, record)
+        return {'file': name, 'sheet': sheet_name, 'rows': len(records),
+                'first': records[0]['Timestamp'] if records else '', 'last': records[-1]['Timestamp'] if records else '',
+                'uids': sorted(uids), 'created': time.time()}
+
+    def _read_file(self, name):
+        with gzip.open(os.path.join(self.directory, name), 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _write_file(self, name, records):
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n")
+        os.replace(tmp_path, path)
+
+    def _live_records(self, sheet_name, archived=0):
+        """
+        Строки живого листа: к кэшу дочитываются новые строки с контрольной точки. archived — сколько строк
+        из начала листа только что удалила своя ротация. Если начало листа изменилось иначе (ротация другого
+        воркера), неизвестно, какие строки ушли, — лист перечитывается целиком. Вызывается под self._lock.
+        """
+        cached = sheet_name in self._live
+        reader, records = self._live[sheet_name] if cached else (storage.tail_reader(sheet_name), [])
+        if archived:
+            records = records[archived:]
+        resyncs = reader.resyncs
+        columns = ARCHIVED_SHEETS[sheet_name]
+        records.extend(dict(zip(columns, row.values())) for row in reader.iter_new_rows())
+        if cached and not archived and reader.resyncs != resyncs:
+            del self._live[sheet_name]
+            return self._live_records(sheet_name)
+        self._live[sheet_name] = (reader, records)
+        return records
+
+    def rotate(self, sheet_name, now=None):
+        """
+        Переносит в архив начало живого листа, если он превысил порог по размеру или возрасту строк.
+        Возвращает число перенесенных строк (0 — ротация не нужна или не удалась).
+        """
+        records = self._live_records(sheet_name)
+        cutoff = datetime.fromtimestamp(now or time.time()) - timedelta(seconds=self.max_age)
+        cutoff = cutoff.strftime(TIMESTAMP_FORMAT)
+        count = len(records) - self.keep_rows if len(records) > self.max_rows else 0
+        # Строки листа упорядочены по времени: старые строки — тоже префикс.
+        while count < len(records) and str(records[count].get('Timestamp', '')) < cutoff:
+            count += 1
+        if count == 0:
+            return 0
+        archived = records[:count]
+        name = f"{TABLES[sheet_name][0]}-{datetime.fromtimestamp(now or time.time()).strftime('%Y%m%d-%H%M%S')}.jsonl.gz"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._write_file(name, archived)
+        except OSError as e:
+            print(f"❌ Ошибка записи архива '{name}': {e}")
+            return 0
+        if not storage.delete_leading_rows(sheet_name, [record['Timestamp'] for record in archived]):
+            # Начало листа могло уже не совпадать с кэшем (его архивировал другой воркер) — следующая
+            # ротация перечитает лист.
+            self._live.pop(sheet_name, None)
+            # Строки остались в живом листе — файл удаляется, чтобы они не попали в архив дважды.
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError as e:
+                print(f"❌ Ошибка удаления неудавшегося архива '{name}': {e}")
+            return 0
+        self.entries.append(self._describe(name, sheet_name, archived))
+        self._save_manifest()
+        self._live_records(sheet_name, count)
+        print(f"✅ Лист '{sheet_name}': {count} строк перенесено в архив {name}, в листе осталось {len(records) - count}.")
+        return count
+
+    def rotate_all(self):
+        """Проверяет все листы-журналы. Возвращает {лист: перенесено строк}."""
+        if not self.enabled or not storage.is_available():
+            return {}
+        with self._lock:
+            result = {sheet_name: self.rotate(sheet_name) for sheet_name in ARCHIVED_SHEETS}
+            self.rotated_at = time.time()
+        return result
+
+    def _entry_records(self, sheet_name, since, until, uid):
+        for entry in sorted(self.entries, key=lambda entry: entry['first']):
+            if entry['sheet'] != sheet_name or entry['last'] < since or entry['first'][:len(until)] > until:
+                continue
+            if uid is not None and uid not in entry['uids']:
+                continue
+            try:
+                yield from self._read_file(entry['file'])
+            except (OSError, ValueError) as e:
+                print(f"❌ Ошибка чтения архива '{entry['file']}': {e}")
+
+    def query(self, sheet_name, since, until, uid=None, limit=ARCHIVE_QUERY_LIMIT, include_live=True):
+        """
+        Записи листа за период [since, until] из архива и (include_live) из живого листа,
+        при uid — только относящиеся к пользователю.
+        Возвращает (последние limit записей от старых к новым, общее число совпадений).
+        """
+        records = self._entry_records(sheet_name, since, until, uid)
+        if include_live and storage.is_available():
+            with self._lock:
+                live = list(self._live_records(sheet_name))
+            records = itertools.chain(records, live)
+        matches = deque(maxlen=limit)
+        total = 0
+        for record in records:
+            if in_range(str(record.get('Timestamp', '')), since, until) and \
+                    (uid is None or uid in record_uids(sheet_name, record)):
+                total += 1
+                matches.append(record)
+        return list(matches), total
+
+    def stats(self):
+        return {'files': len(self.entries), 'rows': sum(entry['rows'] for entry in self.entries),
+                'rotated_at': self.rotated_at}
+
+    def run_loop(self, sleep=time.sleep):
+        """Фоновая проверка порогов ротации."""
+        while True:
+            sleep(self.interval)
+            try:
+                self.rotate_all()
+            except Exception as e:
+                print(f"❌ Ошибка ротации листов-журналов: {e}")
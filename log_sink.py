@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import atexit
+import threading
+from collections import deque
+
+import storage
+
+# --- Настройки пакетной записи ---
+BATCH_SIZE = int(os.environ.get('LOG_SINK_BATCH_SIZE', 50))
+FLUSH_INTERVAL_MS = int(os.environ.get('LOG_SINK_FLUSH_INTERVAL_MS', 2000))
+QUEUE_LIMIT = int(os.environ.get('LOG_SINK_QUEUE_LIMIT', 5000))
+# drop — лишние строки отбрасываются, disk — сбрасываются в файл и дописываются позже
+OVERFLOW_POLICY = os.environ.get('LOG_SINK_OVERFLOW', 'disk')
+SPOOL_PATH = os.environ.get('LOG_SINK_SPOOL_PATH', 'log_sink_spool.jsonl')
+MAX_RETRIES = int(os.environ.get('LOG_SINK_MAX_RETRIES', 5))
+RETRY_BASE_DELAY = float(os.environ.get('LOG_SINK_RETRY_BASE_DELAY', 1.0))
+RETRY_MAX_DELAY = float(os.environ.get('LOG_SINK_RETRY_MAX_DELAY', 60.0))
+
+
+class LogSink:
+    """
+    Фоновый писатель логов и сообщений в хранилище (Google Таблицы или SQLite).
+    Строки складываются в ограниченную очередь и уходят пачками по одному append_rows на лист,
+    поэтому время ответа на команду не зависит от скорости записи в таблицу.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval_ms=FLUSH_INTERVAL_MS, queue_limit=QUEUE_LIMIT,
+                 overflow_policy=OVERFLOW_POLICY, spool_path=SPOOL_PATH):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.queue_limit = queue_limit
+        self.overflow_policy = overflow_policy
+        self.spool_path = spool_path
+        self.flushed = 0
+        self.dropped = 0
+        self.spooled = 0
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._retry_delay = 0.0
+        self._retry_at = 0.0
+        self._failures = 0
+        self._closed = False
+
+    def enqueue(self, sheet_name, row):
+        """Ставит строку в очередь. Никогда не блокирует вызывающего на сетевом вызове."""
+        with self._lock:
+            if len(self._queue) >= self.queue_limit:
+                self._overflow([(sheet_name, row)])
+                return
+            self._queue.append((sheet_name, row))
+            if len(self._queue) >= self.batch_size:
+                self._wake.set()
+
+    def pending(self):
+        return len(self._queue)
+
+    # --- Переполнение ---
+
+    def _overflow(self, items):
+        if self.overflow_policy == 'disk':
+            try:
+                with open(self.spool_path, 'a', encoding='utf-8') as spool:
+                    for sheet_name, row in items:
+                        spool.write(json.dumps({'sheet': sheet_name, 'row': row}, ensure_ascii=False) + '\n')
+                self.spooled += len(items)
+                return
+            except OSError as e:
+                print(f"❌ Ошибка записи очереди логов на диск: {e}")
+        self.dropped += len(items)
+
+    def _restore_spool(self):
+        """Возвращает строки из файла в очередь, пока в ней есть место."""
+        if self.overflow_policy != 'disk' or not os.path.exists(self.spool_path):
+            return
+        try:
+            with open(self.spool_path, encoding='utf-8') as spool:
+                lines = spool.readlines()
+        except OSError as e:
+            print(f"❌ Ошибка чтения очереди логов с диска: {e}")
+            return
+        with self._lock:
+            free = self.queue_limit - len(self._queue)
+            for line in lines[:free]:
+                try:
+                    item = json.loads(line)
+                    self._queue.append((item['sheet'], item['row']))
+                except (ValueError, KeyError):
+                    continue
+            rest = lines[free:]
+        try:
+            if rest:
+                with open(self.spool_path, 'w', encoding='utf-8') as spool:
+                    spool.writelines(rest)
+            else:
+                os.remove(self.spool_path)
+        except OSError as e:
+            print(f"❌ Ошибка обновления очереди логов на диске: {e}")
+
+    # --- Запись ---
+
+    def flush(self, force=False):
+        """
+        Отправляет накопленные строки: по одному append_rows на лист и пачку.
+        При ошибке (обычно превышение квоты) пачка возвращается в начало очереди,
+        а следующая попытка откладывается с экспоненциальной задержкой.
+        """
+        if not force and time.monotonic() < self._retry_at:
+            return 0
+        if not storage.is_ready():
+            # Хранилище еще подключается (старт из снимка): строки ждут в очереди.
+            return 0
+        with self._flush_lock:
+            sent = 0
+            while True:
+                with self._lock:
+                    if not self._queue:
+                        break
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                by_sheet = {}
+                for sheet_name, row in batch:
+                    by_sheet.setdefault(sheet_name, []).append(row)
+                failed = []
+                for sheet_name, rows in by_sheet.items():
+                    if not storage.append_rows(sheet_name, rows):
+                        failed.extend((sheet_name, row) for row in rows)
+                sent += len(batch) - len(failed)
+                if failed:
+                    self._on_failure(failed)
+                    break
+                self._failures = 0
+                self._retry_delay = 0.0
+                self._retry_at = 0.0
+            self.flushed += sent
+        if not self._queue:
+            self._restore_spool()
+        return sent
+
+    def _on_failure(self, failed):
+        self._failures += 1
+        if self._failures > MAX_RETRIES:
+            print(f"❌ Не удалось записать {len(failed)} строк логов после {MAX_RETRIES} попыток.")
+            self._overflow(failed)
+            self._failures = 0
+            self._retry_delay = 0.0
+            return
+        self._retry_delay = min(RETRY_MAX_DELAY, max(RETRY_BASE_DELAY, self._retry_delay * 2))
+        self._retry_at = time.monotonic() + self._retry_delay
+        with self._lock:
+            self._queue.extendleft(reversed(failed))
+            while len(self._queue) > self.queue_limit:
+                self._overflow([self._queue.pop()])
+
+    def run_flush_loop(self):
+        """Фоновый цикл: сброс раз в flush_interval или сразу, как набралась полная пачка."""
+        self._restore_spool()
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Ошибка фоновой записи логов: {e}")
+
+    def close(self):
+        """Останавливает цикл и дописывает остаток очереди (вызывается при завершении процесса)."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        try:
+            self.flush(force=True)
+        except Exception as e:
+            print(f"❌ Ошибка записи логов при завершении: {e}")
+        with self._lock:
+            rest = list(self._queue)
+            self._queue.clear()
+        if rest:
+            self._overflow(rest)
+
+    def register_shutdown(self):
+        atexit.register(self.close)
@@ -0,0 +1,146 @@
+import os
+import time
+import threading
+from bisect import bisect_left, bisect_right
+
+import storage
+from storage import MESSAGE_COLUMNS
+
+# --- Сколько последних сообщений хранится на одного получателя ---
+HISTORY_CAPACITY = int(os.environ.get('MESSAGE_HISTORY_CAPACITY', 500))
+# Период дочитывания новых строк листа 'Сообщения' (сообщения других воркеров, правки вручную); 0 — отключено.
+SYNC_INTERVAL = float(os.environ.get('MESSAGE_HISTORY_SYNC_INTERVAL', 30))
+
+
+def _message_key(message):
+    return tuple(str(message.get(column, '')) for column in MESSAGE_COLUMNS)
+
+
+class _Channel:
+    """Отсортированный по времени кольцевой буфер сообщений одного получателя."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = []
+        self.messages = []
+
+    def add(self, message):
+        """Добавляет сообщение; повтор уже известного (та же секунда, те же поля) не добавляется. True — добавлено."""
+        ts = message.get('Timestamp', '')
+        if not self.timestamps or ts > self.timestamps[-1]:
+            self.timestamps.append(ts)
+            self.messages.append(message)
+        else:
+            start, pos = bisect_left(self.timestamps, ts), bisect_right(self.timestamps, ts)
+            key = _message_key(message)
+            if any(_message_key(known) == key for known in self.messages[start:pos]):
+                return False
+            self.timestamps.insert(pos, ts)
+            self.messages.insert(pos, message)
+        # Обрезаем пачкой при двукратном переполнении — амортизированно O(1) на сообщение.
+        if len(self.messages) > 2 * self.capacity:
+            del self.timestamps[:-self.capacity]
+            del self.messages[:-self.capacity]
+        return True
+
+    def page(self, limit, before=None):
+        oldest = max(0, len(self.messages) - self.capacity)
+        end = bisect_left(self.timestamps, before) if before else len(self.messages)
+        start = max(end - limit, oldest)
+        if start < end:
+            # Сообщения одной секунды не разрываются между страницами, иначе курсор 'before' их потеряет.
+            start = max(bisect_left(self.timestamps, self.timestamps[start]), oldest)
+        return self.messages[start:end]
+
+
+class MessageHistory:
+    """
+    Индекс последних сообщений по получателям: ('squad', отряд), ('private', UID), ('global', 'all').
+    Лист 'Сообщения' читается инкрементально: при старте целиком, дальше sync() дочитывает только строки,
+    добавленные после контрольной точки. Свои сообщения попадают в индекс сразу из log_message_to_sheet,
+    а их повторное появление при дочитывании листа отбрасывается.
+    """
+
+    def __init__(self, sheet_name, capacity=HISTORY_CAPACITY):
+        self.sheet_name = sheet_name
+        self.capacity = capacity
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._reader = None
+        self._checkpoint = None
+
+    def sync(self):
+        """
+        Дочитывает новые строки листа. Сообщения, которые уже есть в памяти (из снимка или отправленные,
+        пока хранилище подключалось), сохраняются. Возвращает число новых сообщений.
+        """
+        with self._sync_lock:
+            if self._reader is None:
+                self._reader = storage.tail_reader(self.sheet_name, self._checkpoint)
+            added = read = 0
+            for row in self._reader.iter_new_rows():
+                read += 1
+                if self.add({column: str(row.get(column, '')) for column in MESSAGE_COLUMNS}):
+                    added += 1
+            self._checkpoint = self._reader.checkpoint()
+        if read:
+            print(f"История сообщений: прочитано {read} новых строк, добавлено {added}.")
+        return added
+
+    def checkpoint(self):
+        """Контрольная точка дочитывания листа — для снимка."""
+        return self._checkpoint
+
+    def restore_checkpoint(self, checkpoint):
+        with self._sync_lock:
+            self._checkpoint = checkpoint
+            self._reader = None
+
+    def run_sync_loop(self, sleep=time.sleep, interval=SYNC_INTERVAL):
+        """Фоновое дочитывание листа: сообщения, записанные другими воркерами, появляются в истории."""
+        while True:
+            sleep(interval)
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"❌ Ошибка дочитывания истории сообщений: {e}")
+
+    def restore(self, messages):
+        """Заново строит индекс из списка сообщений; одинаковые сообщения учитываются один раз."""
+        unique = {_message_key(msg): msg for msg in messages}
+        with self._lock:
+            self._channels = {}
+        for msg in sorted(unique.values(), key=lambda msg: str(msg.get('Timestamp', ''))):
+            self.add(msg)
+
+    def export(self):
+        """Все сообщения индекса без повторов (личные лежат в двух каналах) — для снимка."""
+        with self._lock:
+            channels = list(self._channels.values())
+        seen = {}
+        for channel in channels:
+            for msg in channel.messages[-channel.capacity:]:
+                seen[id(msg)] = msg
+        return sorted(seen.values(), key=lambda msg: str(msg.get('Timestamp', '')))
+
+    def add(self, message):
+        """Добавляет сообщение в канал получателя; личные — также в канал отправителя. True — сообщение новое."""
+        recipient_type = message.get('Recipient_Type')
+        keys = [(recipient_type, message.get('Recipient_ID'))]
+        if recipient_type == 'private' and message.get('Sender_UID') != message.get('Recipient_ID'):
+            keys.append(('private', message.get('Sender_UID')))
+        added = False
+        with self._lock:
+            for key in keys:
+                channel = self._channels.get(key)
+                if channel is None:
+                    channel = self._channels[key] = _Channel(self.capacity)
+                added = channel.add(message) or added
+        return added
+
+    def page(self, recipient_type, recipient_id, limit, before=None):
+        """Последние limit сообщений получателя (строго раньше before, если задан), от старых к новым."""
+        with self._lock:
+            channel = self._channels.get((recipient_type, recipient_id))
+            return channel.page(limit, before) if channel else []
@@ -0,0 +1,230 @@
+import time
+import threading
+import functools
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонный счетчик. callback() -> {кортеж меток: значение} — значения берутся снаружи при выдаче."""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _current(self):
+        if self.callback is not None:
+            values = self.callback()
+            return values if isinstance(values, dict) else {(): values}
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        for labels, value in sorted(self._current().items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Gauge(Counter):
+    """Текущее значение: задается set() или вычисляется callback при каждой выдаче."""
+
+    type = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram:
+    """Гистограмма длительностей с накопительными корзинами, как в клиенте Prometheus."""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts, total = self._values.get(labels, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[labels] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self._values.items()}
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', _number(bound))])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class MetricsRegistry:
+    """Набор метрик процесса и их выдача в текстовом формате Prometheus (GET /metrics)."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), callback=None):
+        return self.register(Counter(name, documentation, labelnames, callback))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            try:
+                lines.extend(metric.samples())
+            except Exception as e:
+                print(f"❌ Ошибка сбора метрики {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# --- Метрики приложения ---
+COMMAND_SECONDS = registry.histogram(
+    "webterminal_command_seconds", "Время обработки terminal_input по командам.", ["command"])
+LOGIN_SECONDS = registry.histogram(
+    "webterminal_login_seconds", "Время обработки события login.")
+SHEETS_OPERATION_SECONDS = registry.histogram(
+    "webterminal_sheets_operation_seconds", "Время операций google_sheets_api по операции и листу.", ["operation", "sheet"])
+SHEETS_OPERATIONS = registry.counter(
+    "webterminal_sheets_operations_total", "Операции google_sheets_api по операции, листу и исходу.", ["operation", "sheet", "outcome"])
+SHEETS_API_CALL_SECONDS = registry.histogram(
+    "webterminal_sheets_api_call_seconds", "Время отдельных вызовов API (включая ожидание в пуле).", ["call"])
+SHEETS_API_CALLS = registry.counter(
+    "webterminal_sheets_api_calls_total", "Вызовы Google API через пул по методу и исходу.", ["call", "outcome"])
+CLIENT_RTT_SECONDS = registry.histogram(
+    "webterminal_client_rtt_seconds", "RTT до клиентов (pong_response -> подтверждение) по транспорту.", ["transport"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.5, 5.0))
+EVENT_LOOP_LAG = registry.gauge(
+    "webterminal_event_loop_lag_seconds", "Последняя измеренная задержка цикла событий.")
+EVENT_LOOP_LAG_SECONDS = registry.histogram(
+    "webterminal_event_loop_lag_seconds_distribution", "Распределение задержки цикла событий.",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+
+
+def timed(histogram, labels):
+    """Декоратор: время вызова попадает в histogram с метками labels(*args, **kwargs)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, *labels(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def _instrumented(fn, observe):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = fn(*args, **kwargs)
+            if result is not False:
+                outcome = 'ok'
+            return result
+        finally:
+            observe(args, outcome, time.perf_counter() - started)
+    return wrapper
+
+
+def _sheet_label(target):
+    """Лист операции: имя листа или, для пакета apply_writes, затронутые листы через запятую."""
+    if isinstance(target, str):
+        return target
+    if isinstance(target, (list, tuple)):
+        return ",".join(sorted({write[1] for write in target if len(write) > 1}))
+    return ''
+
+
+def instrument_sheets_api(module, operations):
+    """
+    Подменяет функции модуля google_sheets_api (и метод run его пула) обертками с замерами,
+    не трогая места вызова: storage обращается к ним через атрибуты модуля.
+    Исход 'error' — исключение или возврат False.
+    """
+    for name in operations:
+        def observe(args, outcome, elapsed, operation=name):
+            sheet = _sheet_label(args[0]) if args else ''
+            SHEETS_OPERATION_SECONDS.observe(elapsed, operation, sheet)
+            SHEETS_OPERATIONS.inc(operation, sheet, outcome)
+        setattr(module, name, _instrumented(getattr(module, name), observe))
+
+    run = module.pool.run
+
+    @functools.wraps(run)
+    def pool_run(fn, *args, **kwargs):
+        call = getattr(fn, '__name__', 'call')
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            result = run(fn, *args, **kwargs)
+            outcome = 'ok'
+            return result
+        finally:
+            SHEETS_API_CALL_SECONDS.observe(time.perf_counter() - started, call)
+            SHEETS_API_CALLS.inc(call, outcome)
+    module.pool.run = pool_run
+
+
+def run_loop_lag_probe(sleep=time.sleep, interval=0.5):
+    """Фоновый замер: насколько позже заказанного просыпается задача — задержка цикла событий eventlet."""
+    while True:
+        started = time.monotonic()
+        sleep(interval)
+        lag = max(0.0, time.monotonic() - started - interval)
+        EVENT_LOOP_LAG.set(lag)
+        EVENT_LOOP_LAG_SECONDS.observe(lag)
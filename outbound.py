@@ -0,0 +1,155 @@
+import os
+import time
+import threading
+from collections import deque
+
+# --- Настройки исходящей доставки ---
+FLUSH_INTERVAL_MS = int(os.environ.get('OUTBOUND_FLUSH_INTERVAL_MS', 15))
+QUEUE_LIMIT = int(os.environ.get('OUTBOUND_QUEUE_LIMIT', 200))
+# Пока в очереди engine.io у клиента столько пакетов, новые кадры ему не отправляются.
+CLIENT_HIGH_WATER = int(os.environ.get('OUTBOUND_CLIENT_HIGH_WATER', 32))
+# drop — у медленного клиента отбрасываются самые старые сообщения, disconnect — клиент отключается
+SLOW_CONSUMER_POLICY = os.environ.get('OUTBOUND_SLOW_CONSUMER', 'drop')
+CLEAR_MARKER = "<CLEAR_TERMINAL>\n"
+
+
+def coalesce(items):
+    """
+    Склеивает подряд идущие события одного типа: тексты terminal_output конкатенируются,
+    словари update_ui_state объединяются (поздние ключи побеждают). Порядок разных событий сохраняется.
+    """
+    frames = []
+    for event, payload in items:
+        if frames and frames[-1][0] == event:
+            last = frames[-1][1]
+            if event == 'terminal_output' and CLEAR_MARKER not in (last.get('output'), payload.get('output')):
+                frames[-1] = (event, {'output': last.get('output', '') + payload.get('output', '')})
+                continue
+            if event == 'update_ui_state':
+                frames[-1] = (event, {**last, **payload})
+                continue
+        frames.append((event, payload))
+    return frames
+
+
+class Outbound:
+    """
+    Исходящая доставка событий клиентам. Сообщения копятся в ограниченной очереди на sid
+    и раз в FLUSH_INTERVAL_MS уходят одним кадром: одно событие — как есть, несколько — событием 'batch'.
+    Клиенту, у которого не разобрана очередь engine.io, кадры не шлются, пока она не спадет;
+    если за это время переполнится и его очередь здесь, срабатывает политика медленного клиента.
+    Так один болтливый отряд не задерживает доставку остальным терминалам.
+    """
+
+    def __init__(self, emit, client_queue_depth=None, disconnect=None, flush_interval_ms=FLUSH_INTERVAL_MS,
+                 queue_limit=QUEUE_LIMIT, high_water=CLIENT_HIGH_WATER, policy=SLOW_CONSUMER_POLICY):
+        self.emit = emit
+        self.client_queue_depth = client_queue_depth
+        self.disconnect = disconnect
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.queue_limit = queue_limit
+        self.high_water = high_water
+        self.policy = policy
+        self.sent_frames = 0
+        self.sent_payloads = 0
+        self.deferred = 0
+        self.dropped = 0
+        self.disconnected = 0
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def send(self, sid, event, payload):
+        self.send_many((sid,), event, payload)
+
+    def send_many(self, sids, event, payload, skip_sid=None):
+        """Ставит событие в очереди нескольких клиентов (рассылка в отряд, всем, по роли)."""
+        slow = []
+        with self._lock:
+            for sid in sids:
+                if sid == skip_sid:
+                    continue
+                queue = self._queues.setdefault(sid, deque())
+                if len(queue) >= self.queue_limit:
+                    if self.policy == 'disconnect' and self.disconnect is not None:
+                        del self._queues[sid]
+                        self.dropped += len(queue)
+                        slow.append(sid)
+                        continue
+                    queue.popleft()
+                    self.dropped += 1
+                queue.append((event, payload))
+        self._wake.set()
+        for sid in slow:
+            self.disconnected += 1
+            print(f"⚠️ Клиент {sid} не успевает принимать сообщения и будет отключен.")
+            try:
+                self.disconnect(sid)
+            except Exception as e:
+                print(f"❌ Ошибка отключения медленного клиента {sid}: {e}")
+
+    def discard(self, sid):
+        """Убирает очередь отключившегося клиента."""
+        with self._lock:
+            self._queues.pop(sid, None)
+
+    def flush(self, sids=None):
+        """
+        Отправляет накопленное каждому клиенту (или только sids), чья очередь engine.io ниже порога.
+        Возвращает число кадров.
+        """
+        with self._lock:
+            sids = list(self._queues) if sids is None else [sid for sid in sids if sid in self._queues]
+        frames_sent = 0
+        for sid in sids:
+            if self.client_queue_depth is not None and self.client_queue_depth(sid) >= self.high_water:
+                self.deferred += 1
+                continue
+            with self._lock:
+                items = self._queues.pop(sid, None)
+            if not items:
+                continue
+            frames = coalesce(items)
+            try:
+                if len(frames) == 1:
+                    self.emit(frames[0][0], frames[0][1], sid)
+                else:
+                    self.emit('batch', [[event, payload] for event, payload in frames], sid)
+            except Exception as e:
+                print(f"❌ Ошибка отправки клиенту {sid}: {e}")
+                continue
+            frames_sent += 1
+            self.sent_payloads += len(items)
+        self.sent_frames += frames_sent
+        return frames_sent
+
+    def run_flush_loop(self, sleep=time.sleep):
+        """Фоновый цикл: ждет первое сообщение, дает окну набрать соседние и отправляет все разом."""
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Ошибка фоновой отправки сообщений: {e}")
+            with self._lock:
+                if self._queues:
+                    # Отложенные медленные клиенты — повторить на следующем окне.
+                    self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            depths = [len(queue) for queue in self._queues.values()]
+        return {
+            'queued_clients': len(depths),
+            'queued_payloads': sum(depths),
+            'max_queue_depth': max(depths, default=0),
+            'queue_limit': self.queue_limit,
+            'sent_frames': self.sent_frames,
+            'sent_payloads': self.sent_payloads,
+            'deferred': self.deferred,
+            'dropped': self.dropped,
+            'disconnected': self.disconnected,
+            'policy': self.policy,
+        }
@@ -0,0 +1,140 @@
+import threading
+
+GUEST_INFO = {'uid': None, 'callsign': None, 'role': 'guest', 'squad': None}
+SYNDICATE_ROOM = "syndicate_room"
+SQUAD_ROOM_ROLES = ("operative", "commander")
+
+
+def user_room(uid):
+    """Личная комната пользователя: в нее входят все его активные сессии."""
+    return f"user:{uid}"
+
+
+def has_squad(squad):
+    return bool(squad) and str(squad).lower() != 'none'
+
+
+class PresenceRegistry:
+    """
+    Реестр подключенных терминалов: sid -> данные сессии и обратные индексы
+    UID / отряд / роль -> множество sid. Все поиски получателей — O(1).
+    Индексы локальны для процесса; shared (см. shared_state) публикует присутствие
+    для остальных воркеров.
+    """
+
+    def __init__(self, shared=None):
+        self.shared = shared
+        self.sessions = {}
+        self.by_uid = {}
+        self.by_squad = {}
+        self.by_role = {}
+        # sid, подписанные на изменения доски контрактов (watch contracts); вход и выход подписку снимают.
+        self.watchers = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _add(index, key, sid):
+        index.setdefault(key, set()).add(sid)
+
+    @staticmethod
+    def _discard(index, key, sid):
+        sids = index.get(key)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del index[key]
+
+    def _unindex(self, sid, info):
+        if info['uid'] is not None:
+            self._discard(self.by_uid, info['uid'], sid)
+        if has_squad(info['squad']):
+            self._discard(self.by_squad, info['squad'], sid)
+        self._discard(self.by_role, info['role'], sid)
+        self.watchers.discard(sid)
+
+    def set_session(self, sid, uid=None, callsign=None, role='guest', squad=None):
+        """Регистрирует или обновляет сессию (подключение, вход, выход в гостя)."""
+        info = {'uid': None if uid is None else str(uid), 'callsign': callsign, 'role': role, 'squad': squad}
+        with self._lock:
+            previous = self.sessions.get(sid)
+            if previous is not None:
+                self._unindex(sid, previous)
+            self.sessions[sid] = info
+            if info['uid'] is not None:
+                self._add(self.by_uid, info['uid'], sid)
+            if has_squad(squad):
+                self._add(self.by_squad, squad, sid)
+            self._add(self.by_role, role, sid)
+        if self.shared is not None:
+            if previous is not None and previous['uid'] is not None and previous['uid'] != info['uid']:
+                self.shared.session_offline(sid, previous['uid'])
+            if info['uid'] is not None:
+                self.shared.session_online(sid, info['uid'])
+        return info
+
+    def connect(self, sid):
+        return self.set_session(sid, **GUEST_INFO)
+
+    def disconnect(self, sid):
+        with self._lock:
+            info = self.sessions.pop(sid, None)
+            if info is not None:
+                self._unindex(sid, info)
+        if self.shared is not None and info is not None and info['uid'] is not None:
+            self.shared.session_offline(sid, info['uid'])
+        return info
+
+    def get(self, sid):
+        return self.sessions.get(sid)
+
+    def watch(self, sid, enabled=True):
+        with self._lock:
+            if enabled and sid in self.sessions:
+                self.watchers.add(sid)
+            else:
+                self.watchers.discard(sid)
+
+    def watchers_by_audience(self):
+        """Подписчики доски по аудиториям: None — Синдикат (видит все), иначе отряд зрителя."""
+        audiences = {}
+        with self._lock:
+            for sid in self.watchers:
+                info = self.sessions[sid]
+                audiences.setdefault(None if info['role'] == 'syndicate' else info['squad'], []).append(sid)
+        return audiences
+
+    def sids_for_uid(self, uid):
+        return self.by_uid.get(str(uid), set())
+
+    def sids_for_squad(self, squad):
+        return self.by_squad.get(squad, set())
+
+    def sids_for_role(self, role):
+        return self.by_role.get(role, set())
+
+    def sids_for_room(self, room):
+        """
+        Локальные sid комнаты с теми же правилами, что у join_room при входе: None — все подключения,
+        user:<UID> — сессии пользователя, syndicate_room — Синдикат, иначе — оперативники и командир отряда.
+        """
+        if room is None:
+            return list(self.sessions)
+        if room == SYNDICATE_ROOM:
+            return list(self.sids_for_role('syndicate'))
+        if room.startswith(user_room('')):
+            return list(self.sids_for_uid(room[len(user_room('')):]))
+        sids = []
+        for sid in list(self.sids_for_squad(room)):
+            info = self.sessions.get(sid)
+            if info is not None and info['role'] in SQUAD_ROOM_ROLES:
+                sids.append(sid)
+        return sids
+
+    def is_online(self, uid):
+        if str(uid) in self.by_uid:
+            return True
+        return self.shared is not None and self.shared.is_online(str(uid))
+
+    def logged_in_sessions(self):
+        """Пары (sid, uid) локальных сессий с выполненным входом — для продления присутствия."""
+        return [(sid, info['uid']) for sid, info in list(self.sessions.items()) if info['uid'] is not None]
@@ -0,0 +1,106 @@
+import os
+import time
+import threading
+from collections import Counter
+
+# --- Настройки ограничения частоты команд (токенов в секунду и емкость корзины) ---
+SID_RATE = float(os.environ.get('RATE_LIMIT_SID_RATE', 2))
+SID_BURST = float(os.environ.get('RATE_LIMIT_SID_BURST', 20))
+UID_RATE = float(os.environ.get('RATE_LIMIT_UID_RATE', 3))
+UID_BURST = float(os.environ.get('RATE_LIMIT_UID_BURST', 30))
+# Общая корзина для команд, которые пишут в хранилище: бережет квоту Google Sheets API.
+GLOBAL_RATE = float(os.environ.get('RATE_LIMIT_GLOBAL_RATE', 5))
+GLOBAL_BURST = float(os.environ.get('RATE_LIMIT_GLOBAL_BURST', 30))
+# Сколько пользователей и гостевых sid хранит счетчик отклонений: при переполнении остается половина
+# с наибольшими счетчиками, иначе каждый новый гость оставлял бы запись навсегда.
+THROTTLED_USERS_LIMIT = int(os.environ.get('RATE_LIMIT_THROTTLED_USERS_LIMIT', 1000))
+
+
+class TokenBucket:
+    """Корзина токенов: пополняется со скоростью rate до capacity, команда забирает cost токенов."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, cost, now):
+        """0, если токенов хватает, иначе сколько секунд ждать."""
+        self._refill(now)
+        if self.tokens >= cost:
+            return 0.0
+        return (min(cost, self.capacity) - self.tokens) / self.rate
+
+    def take(self, cost):
+        self.tokens -= cost
+
+
+class RateLimiter:
+    """
+    Ограничитель команд терминала: корзины по sid и по UID плюс общая корзина хранилища.
+    Команда проходит, только если токенов хватает во всех своих корзинах, и только тогда они списываются,
+    поэтому отклоненная команда не тратит бюджет.
+    """
+
+    def __init__(self, sid_rate=SID_RATE, sid_burst=SID_BURST, uid_rate=UID_RATE, uid_burst=UID_BURST,
+                 global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST, throttled_users_limit=THROTTLED_USERS_LIMIT):
+        self.sid_rate, self.sid_burst = sid_rate, sid_burst
+        self.uid_rate, self.uid_burst = uid_rate, uid_burst
+        self.storage_bucket = TokenBucket(global_rate, global_burst)
+        self.allowed = 0
+        self.throttled = Counter()
+        self.throttled_users = Counter()
+        self.throttled_users_limit = max(2, throttled_users_limit)
+        self._sid_buckets = {}
+        self._uid_buckets = {}
+        self._lock = threading.Lock()
+
+    def throttle(self, sid, uid, cost, storage_cost=0):
+        """
+        None, если команду можно выполнить (токены списаны), иначе (область, секунд до повтора),
+        где область — 'sid', 'uid' или 'storage'.
+        """
+        now = time.monotonic()
+        with self._lock:
+            buckets = [('sid', self._sid_buckets.setdefault(sid, TokenBucket(self.sid_rate, self.sid_burst)), cost)]
+            if uid is not None:
+                buckets.append(('uid', self._uid_buckets.setdefault(str(uid), TokenBucket(self.uid_rate, self.uid_burst)), cost))
+            if storage_cost:
+                buckets.append(('storage', self.storage_bucket, storage_cost))
+            for scope, bucket, bucket_cost in buckets:
+                wait = bucket.wait_time(bucket_cost, now)
+                if wait > 0:
+                    self.throttled[scope] += 1
+                    self._count_throttled_user(str(uid) if uid is not None else f"sid:{sid}")
+                    return scope, wait
+            for _, bucket, bucket_cost in buckets:
+                bucket.take(bucket_cost)
+            self.allowed += 1
+            return None
+
+    def _count_throttled_user(self, key):
+        if key not in self.throttled_users and len(self.throttled_users) >= self.throttled_users_limit:
+            self.throttled_users = Counter(dict(self.throttled_users.most_common(self.throttled_users_limit // 2)))
+        self.throttled_users[key] += 1
+
+    def forget_sid(self, sid):
+        with self._lock:
+            self._sid_buckets.pop(sid, None)
+
+    def stats(self, top=5):
+        with self._lock:
+            self.storage_bucket._refill(time.monotonic())
+            return {
+                'allowed': self.allowed,
+                'throttled': dict(self.throttled),
+                'top_throttled': self.throttled_users.most_common(top),
+                'storage_tokens': round(self.storage_bucket.tokens, 1),
+                'storage_capacity': self.storage_bucket.capacity,
+                'tracked_sids': len(self._sid_buckets),
+                'tracked_uids': len(self._uid_buckets),
+            }
@@ -0,0 +1,85 @@
+import os
+import functools
+import threading
+from collections import OrderedDict
+
+# --- Размер кэша отрисованных ответов (число записей) ---
+RENDER_CACHE_SIZE = int(os.environ.get('RENDER_CACHE_SIZE', 512))
+
+
+class RenderCache:
+    """
+    LRU-кэш готовых ответов команд-списков. Ключ — (команда, роль, область: отряд/UID/позывной),
+    к ответу приложены версии листов DataStore, из которых он построен. Ответ годен, пока версии
+    этих листов не изменились; изменение листа сразу вытесняет ровно те записи, что от него зависят,
+    поэтому всплеск одинаковых запросов стоит одну отрисовку, а не одну на пользователя.
+    """
+
+    def __init__(self, data_store, capacity=RENDER_CACHE_SIZE):
+        self.data_store = data_store
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._by_sheet = {}
+        self._lock = threading.Lock()
+        data_store.sheet_listeners.append(self.invalidate)
+
+    def _versions(self, sheet_names):
+        return tuple(self.data_store.sheet_versions[sheet_name] for sheet_name in sheet_names)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for sheet_name in entry[0]:
+            keys = self._by_sheet.get(sheet_name)
+            if keys is not None:
+                keys.discard(key)
+
+    def get_or_render(self, key, sheet_names, render):
+        versions = self._versions(sheet_names)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == versions:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        # Версии сняты до отрисовки: если данные изменятся во время нее, запись просто не совпадет со следующим запросом.
+        output = render()
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (tuple(sheet_names), versions, output)
+            for sheet_name in sheet_names:
+                self._by_sheet.setdefault(sheet_name, set()).add(key)
+            while len(self._entries) > self.capacity:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        return output
+
+    def invalidate(self, sheet_names):
+        """Вытесняет ответы, построенные по измененным листам."""
+        with self._lock:
+            for sheet_name in sheet_names:
+                for key in list(self._by_sheet.pop(sheet_name, ())):
+                    self._drop(key)
+
+    def cached(self, scope, *sheet_names):
+        """
+        Декоратор обработчика команды: scope(ctx) — часть ключа, от которой зависит ответ
+        (отряд, UID, позывной), sheet_names — листы, из которых он строится.
+        """
+        def decorator(handler):
+            @functools.wraps(handler)
+            def wrapper(ctx, argv):
+                key = (handler.__name__, ctx.role, scope(ctx))
+                return self.get_or_render(key, sheet_names, lambda: handler(ctx, argv))
+            return wrapper
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'capacity': self.capacity, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,42 @@
+import os
+import hmac
+import hashlib
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+# --- Настройки токенов возобновления сессии ---
+RESUME_TOKEN_TTL = int(os.environ.get('RESUME_TOKEN_TTL', 12 * 3600))
+RESUME_TOKEN_SALT = "webterminal-resume"
+
+
+class ResumeTokens:
+    """
+    Подписанные токены возобновления: UID и отпечаток ключа доступа, подпись секретом приложения.
+    Переподключившийся клиент предъявляет токен при connect и сразу получает свою роль и комнаты,
+    без повторного ввода ключа и без обращения к хранилищу. Смена ключа пользователя делает токен недействительным.
+    Токен подписан, но читаем, а ключи доступа короткие — поэтому отпечаток считается HMAC с секретом
+    приложения: без секрета перебрать по нему ключ нельзя.
+    """
+
+    def __init__(self, secret_key, ttl=RESUME_TOKEN_TTL):
+        self.ttl = ttl
+        self.serializer = URLSafeTimedSerializer(secret_key, salt=RESUME_TOKEN_SALT)
+        self._fingerprint_key = f"{RESUME_TOKEN_SALT}:fingerprint:{secret_key}".encode('utf-8')
+
+    def fingerprint(self, key_digest):
+        """Отпечаток ключа по его хэшу (DataStore.key_digest)."""
+        return hmac.new(self._fingerprint_key, key_digest, hashlib.sha256).hexdigest()[:32]
+
+    def issue(self, uid, key_digest):
+        return self.serializer.dumps({'uid': str(uid), 'key': self.fingerprint(key_digest)})
+
+    def verify(self, token):
+        """(UID, отпечаток ключа) или None, если токен поддельный, просрочен или поврежден."""
+        if not token or not isinstance(token, str):
+            return None
+        try:
+            payload = self.serializer.loads(token, max_age=self.ttl)
+        except BadSignature:
+            return None
+        if not isinstance(payload, dict) or 'uid' not in payload or 'key' not in payload:
+            return None
+        return payload['uid'], payload['key']
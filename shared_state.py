@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import uuid
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# --- Общее состояние для нескольких воркеров/узлов (Redis). Без URL работает в памяти процесса. ---
+SHARED_STATE_URL = os.environ.get('SHARED_STATE_URL') or os.environ.get('REDIS_URL')
+KEY_PREFIX = os.environ.get('SHARED_STATE_PREFIX', 'webterminal')
+PRESENCE_TTL = float(os.environ.get('SHARED_PRESENCE_TTL', 60))
+HEARTBEAT_INTERVAL = PRESENCE_TTL / 3
+
+
+class LocalState:
+    """Однопроцессный режим: частоты в словаре процесса, межпроцессных событий нет."""
+
+    distributed = False
+
+    def __init__(self, default_frequencies):
+        self.worker_id = uuid.uuid4().hex
+        self._frequencies = default_frequencies
+
+    def frequencies(self):
+        return dict(self._frequencies)
+
+    def set_frequency(self, squad, frequency):
+        self._frequencies[squad] = frequency
+
+    def session_online(self, sid, uid):
+        pass
+
+    def session_offline(self, sid, uid):
+        pass
+
+    def is_online(self, uid):
+        return False
+
+    def publish(self, event, payload):
+        pass
+
+    def run_listener(self, handler):
+        pass
+
+    def run_heartbeat(self, sessions, sleep=time.sleep):
+        pass
+
+
+class RedisState:
+    """
+    Режим нескольких воркеров: частоты отрядов и присутствие пользователей хранятся в Redis,
+    события (сброс кэша, новые сообщения) рассылаются остальным воркерам через pub/sub.
+    Присутствие — sorted set sid'ов на UID со временем истечения; воркер продлевает свои
+    записи и срок жизни ключей раз в HEARTBEAT_INTERVAL, так что сессии упавшего воркера пропадают сами.
+    Соединение с Redis открывается при первом обращении: недоступный Redis не роняет импорт,
+    а частоты по умолчанию записываются фоновым слушателем, когда связь появится.
+    """
+
+    distributed = True
+
+    def __init__(self, url, default_frequencies, client=None):
+        self.worker_id = uuid.uuid4().hex
+        self._redis = client if client is not None else redis.Redis.from_url(url, decode_responses=True)
+        self._default_frequencies = dict(default_frequencies)
+        self._defaults_written = False
+        self._frequencies_key = f"{KEY_PREFIX}:frequencies"
+        self._events_channel = f"{KEY_PREFIX}:events"
+
+    def _write_defaults(self):
+        if self._defaults_written:
+            return
+        for squad, frequency in self._default_frequencies.items():
+            self._redis.hsetnx(self._frequencies_key, squad, frequency)
+        self._defaults_written = True
+
+    def _online_key(self, uid):
+        return f"{KEY_PREFIX}:online:{uid}"
+
+    def frequencies(self):
+        try:
+            return {**self._default_frequencies, **self._redis.hgetall(self._frequencies_key)}
+        except redis.RedisError as e:
+            print(f"⚠️ Частоты не прочитаны из Redis ({e}), используются значения по умолчанию.")
+            return dict(self._default_frequencies)
+
+    def set_frequency(self, squad, frequency):
+        self._redis.hset(self._frequencies_key, squad, frequency)
+
+    def session_online(self, sid, uid):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.zadd(self._online_key(uid), {sid: time.time() + PRESENCE_TTL})
+        pipe.expire(self._online_key(uid), int(PRESENCE_TTL) + 1)
+        pipe.execute()
+
+    def session_offline(self, sid, uid):
+        self._redis.zrem(self._online_key(uid), sid)
+
+    def is_online(self, uid):
+        return self._redis.zcount(self._online_key(uid), time.time(), '+inf') > 0
+
+    def publish(self, event, payload):
+        message = json.dumps({'worker': self.worker_id, 'event': event, 'payload': payload}, ensure_ascii=False)
+        self._redis.publish(self._events_channel, message)
+
+    def run_listener(self, handler):
+        """Слушает события других воркеров и передает их в handler(event, payload)."""
+        while True:
+            try:
+                self._write_defaults()
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._events_channel)
+                for message in pubsub.listen():
+                    data = json.loads(message['data'])
+                    if data.get('worker') == self.worker_id:
+                        continue
+                    try:
+                        handler(data['event'], data.get('payload') or {})
+                    except Exception as e:
+                        print(f"❌ Ошибка обработки события '{data.get('event')}': {e}")
+            except Exception as e:
+                print(f"❌ Потеряно соединение с Redis ({e}), переподключение...")
+                time.sleep(1)
+
+    def run_heartbeat(self, sessions, sleep=time.sleep):
+        """Продлевает присутствие локальных сессий. sessions() возвращает пары (sid, uid)."""
+        while True:
+            sleep(HEARTBEAT_INTERVAL)
+            try:
+                expires = time.time() + PRESENCE_TTL
+                pipe = self._redis.pipeline(transaction=False)
+                for sid, uid in sessions():
+                    pipe.zadd(self._online_key(uid), {sid: expires})
+                    pipe.zremrangebyscore(self._online_key(uid), '-inf', time.time())
+                    # Ключ живет, пока его продлевает хотя бы один воркер: после падения всех он удаляется сам.
+                    pipe.expire(self._online_key(uid), int(PRESENCE_TTL) + 1)
+                pipe.execute()
+            except Exception as e:
+                print(f"❌ Ошибка обновления присутствия в Redis: {e}")
+
+
+def create_shared_state(default_frequencies, url=SHARED_STATE_URL):
+    if not url:
+        return LocalState(default_frequencies)
+    if redis is None:
+        print("❌ SHARED_STATE_URL задан, но пакет 'redis' не установлен. Работаем в однопроцессном режиме.")
+        return LocalState(default_frequencies)
+    return RedisState(url, default_frequencies)
@@ -0,0 +1,94 @@
+import os
+import gzip
+import json
+import time
+import atexit
+
+# --- Настройки снимка данных ---
+# Пустой путь отключает снимок.
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', 'webterminal_snapshot.json.gz')
+SNAPSHOT_INTERVAL = float(os.environ.get('SNAPSHOT_INTERVAL', 60))
+# Снимок старше этого возраста (в секундах) при старте не используется.
+SNAPSHOT_MAX_AGE = float(os.environ.get('SNAPSHOT_MAX_AGE', 7 * 24 * 3600))
+SNAPSHOT_FORMAT = 1
+
+
+class Snapshotter:
+    """
+    Компактный локальный снимок данных (пользователи, контракты, запросы, последние сообщения).
+    При старте воркер поднимает данные из снимка и сразу начинает обслуживать клиентов, а сверка
+    с хранилищем идет в фоне. Снимок пишется периодически и при завершении процесса; запись атомарна
+    (временный файл + os.replace), так что параллельные воркеры и падение посреди записи его не портят.
+    """
+
+    def __init__(self, data_store, message_history, path=SNAPSHOT_PATH, interval=SNAPSHOT_INTERVAL, max_age=SNAPSHOT_MAX_AGE):
+        self.data_store = data_store
+        self.message_history = message_history
+        self.path = path
+        self.interval = interval
+        self.max_age = max_age
+        self.saved_at = None
+        self.restored_at = None
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def save(self):
+        """Пишет снимок. Пустые данные (хранилище так и не ответило) не затирают прошлый снимок."""
+        if not self.enabled or not self.data_store.users:
+            return False
+        snapshot = {'format': SNAPSHOT_FORMAT, 'saved_at': time.time(), **self.data_store.export_records(),
+                    'messages': self.message_history.export(), 'message_checkpoint': self.message_history.checkpoint()}
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            # В снимке есть ключи доступа — файл доступен только владельцу процесса.
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'), default=str)
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"❌ Ошибка записи снимка данных '{self.path}': {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+        self.saved_at = snapshot['saved_at']
+        return True
+
+    def restore(self):
+        """Загружает снимок в DataStore и историю сообщений. Возвращает возраст снимка в секундах или None."""
+        if not self.enabled or not os.path.exists(self.path):
+            return None
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Снимок данных '{self.path}' не прочитан: {e}")
+            return None
+        age = time.time() - float(snapshot.get('saved_at', 0))
+        if snapshot.get('format') != SNAPSHOT_FORMAT or age > self.max_age:
+            print(f"⚠️ Снимок данных '{self.path}' устарел или в другом формате — старт без него.")
+            return None
+        self.data_store.load_records(snapshot.get('users', []), snapshot.get('contracts', []), snapshot.get('requests', []))
+        self.message_history.restore(snapshot.get('messages', []))
+        # Лист сообщений дочитывается с места, на котором был сделан снимок, а не целиком.
+        if snapshot.get('message_checkpoint'):
+            self.message_history.restore_checkpoint(snapshot['message_checkpoint'])
+        self.restored_at = time.time()
+        print(f"✅ Данные подняты из снимка (возраст {age:.0f} с): {len(self.data_store.users)} пользователей, "
+              f"{len(self.data_store.contracts)} контрактов, {len(self.data_store.requests)} запросов.")
+        return age
+
+    def run_loop(self, sleep=time.sleep):
+        """Фоновый цикл периодической записи снимка."""
+        while True:
+            sleep(self.interval)
+            try:
+                self.save()
+            except Exception as e:
+                print(f"❌ Ошибка фоновой записи снимка: {e}")
+
+    def register_shutdown(self):
+        atexit.register(self.save)
@@ -4,7 +4,22 @@ const terminalOutput = document.getElementById('terminal-output');
 const terminalInput = document.getElementById('terminal-input');
 const prompt = '$ ';
 const TYPING_SPEED = 10;
+// Если в очереди вывода больше стольких символов, печать ускоряется пропорционально ее объему.
+const TYPING_CATCHUP_CHARS = 2000;
+// Сколько строк хранит экран терминала; лишние строки срезаются с начала пачкой по SCROLLBACK_SLACK.
+const SCROLLBACK_LINES = 2000;
+const SCROLLBACK_SLACK = 200;
+const OUTPUT_SAVE_DELAY_MS = 1000;
+const OUTPUT_STORAGE_KEY = 'stalker_terminal_terminalOutput';
 let isTyping = false;
+let outputQueue = [];
+let queuedChars = 0;
+let outputFrameRequested = false;
+let lastFrameTime = null;
+let promptPending = false;
+let scrollbackLineCount = 0;
+let outputSaveTimerId = null;
+let outputDirty = false;
 let commandHistory = [];
 let historyIndex = -1;
 const toggleSoundButton = document.getElementById('toggle-sound');
@@ -26,7 +41,15 @@ let soundEnabled = true;
 let uptimeSeconds = 0;
 let currentPing = '--';
 let pingIntervalId = null;
-const socket = io();
+const RESUME_TOKEN_STORAGE_KEY = 'stalker_terminal_resumeToken';
+// Токен возобновления уходит с каждым (пере)подключением: сервер сразу восстанавливает роль без повторного входа.
+const socket = io({
+    auth: function(cb) {
+        let token = null;
+        try { token = localStorage.getItem(RESUME_TOKEN_STORAGE_KEY); } catch (e) {}
+        cb(token ? { resume_token: token } : {});
+    }
+});
 const keyPressSounds = [new Audio('/static/audio/key_press_1.mp3'), new Audio('/static/audio/key_press_2.mp3'), new Audio('/static/audio/key_press_3.mp3')];
 const enterSounds = [new Audio('/static/audio/enter_1.mp3'), new Audio('/static/audio/enter_2.mp3'), new Audio('/static/audio/enter_3.mp3'), ];
 const commandDoneSound = new Audio('/static/audio/command_done.mp3');
@@ -52,7 +75,7 @@ function registerCommand(name, handler) {
 }
 
 registerCommand('clear', function() {
-    terminalOutput.value = '';
+    clearOutput();
     displayOutput(prompt, false, true);
     playSingleSound(commandDoneSound);
 });
@@ -65,7 +88,7 @@ function initializeTerminalDisplay() {
 function loadDataFromLocalStorage() {
     try {
         const savedHistory = JSON.parse(localStorage.getItem('stalker_terminal_commandHistory'));
-        const savedOutput = localStorage.getItem('stalker_terminal_terminalOutput');
+        const savedOutput = localStorage.getItem(OUTPUT_STORAGE_KEY);
         const savedSound = JSON.parse(localStorage.getItem('stalker_terminal_soundEnabled'));
         if (Array.isArray(savedHistory)) {
             commandHistory = savedHistory;
@@ -78,6 +101,8 @@ function loadDataFromLocalStorage() {
         }
         if (typeof savedOutput === 'string' && savedOutput.trim() !== '') {
             terminalOutput.value = savedOutput;
+            scrollbackLineCount = countLines(savedOutput);
+            trimScrollback();
             terminalOutput.scrollTop = terminalOutput.scrollHeight;
             return true;
         }
@@ -127,12 +152,19 @@ document.addEventListener('DOMContentLoaded', (event) => {
 
     if (rebootSystemButton) {
         rebootSystemButton.addEventListener('click', () => {
-            localStorage.removeItem('stalker_terminal_terminalOutput');
+            outputDirty = false;
+            localStorage.removeItem(OUTPUT_STORAGE_KEY);
             window.location.reload();
         });
     }
 });
 
+// Отложенное сохранение вывода не должно потеряться при закрытии или сворачивании вкладки.
+window.addEventListener('pagehide', saveOutputToLocalStorage);
+document.addEventListener('visibilitychange', () => {
+    if (document.hidden) saveOutputToLocalStorage();
+});
+
 terminalInput.addEventListener('keydown', function(event) {
     if (event.key.length === 1 && !event.ctrlKey && !event.altKey && !event.metaKey) {
         playRandomSound(keyPressSounds);
@@ -162,20 +194,27 @@ terminalInput.addEventListener('keydown', function(event) {
     }
 });
 
-socket.on('terminal_output', function(data) {
+function handleTerminalOutput(data) {
     if (data.output === "<CLEAR_TERMINAL>\n") {
-        terminalOutput.value = '';
+        clearOutput();
         displayOutput(prompt, false, true);
         playSingleSound(commandDoneSound);
         return;
     }
     displayOutput(data.output, true);
     playSingleSound(commandDoneSound);
-});
+}
 
-socket.on('update_ui_state', function(data) {
+function handleUiState(data) {
     const role = data.role;
     const showUiPanel = data.show_ui_panel;
+    try {
+        if (data.resume_token) {
+            localStorage.setItem(RESUME_TOKEN_STORAGE_KEY, data.resume_token);
+        } else if (role === 'guest') {
+            localStorage.removeItem(RESUME_TOKEN_STORAGE_KEY);
+        }
+    } catch (e) {}
     if (uiBottomPanel) {
         uiBottomPanel.classList.toggle('hidden', !showUiPanel);
     }
@@ -193,9 +232,29 @@ socket.on('update_ui_state', function(data) {
         if (betaFreqLine) betaFreqLine.classList.add('hidden');
         if (channelFrequencyElement) channelFrequencyElement.parentElement.classList.remove('hidden');
     }
+}
+
+function handleLoginFailure(data) {
+    displayOutput(data && data.message ? data.message : "❌ Ошибка входа.", true);
+    playSingleSound(commandDoneSound);
+}
+
+socket.on('terminal_output', handleTerminalOutput);
+socket.on('update_ui_state', handleUiState);
+socket.on('login_failure', handleLoginFailure);
+// Сервер склеивает несколько событий за короткое окно в один кадр: [[событие, данные], ...].
+// Каждое событие кадра уходит тем же обработчикам socket.on, что и отдельное событие.
+socket.on('batch', function(items) {
+    items.forEach(function(item) {
+        socket.listeners(item[0]).forEach(function(handler) {
+            handler(item[1]);
+        });
+    });
 });
 
-socket.on('pong_response', function() {
+// Подтверждение pong_response нужно серверу: по нему он сам измеряет RTT для команд ping и netstat.
+socket.on('pong_response', function(data, ack) {
+    if (typeof ack === 'function') ack();
     currentPing = Date.now() - window.pingStartTime;
     if (networkPingElement) {
         networkPingElement.textContent = `${currentPing}мс`;
@@ -235,35 +294,102 @@ function processCommand() {
     }
 }
 
+// Весь вывод идет через одну очередь и пишется в терминал раз в кадр (requestAnimationFrame):
+// сообщения, пришедшие во время печати, ждут своей очереди, а не теряются.
+// isInstant — текст целиком в ближайший кадр (эхо команды, приглашение), иначе — с эффектом печати.
 function displayOutput(text, addNewLine, isInstant = false) {
-    if (isTyping && !isInstant) return;
-    if (isInstant) {
-        terminalOutput.value += text;
-        if (addNewLine && !text.endsWith('\n')) {
-            terminalOutput.value += '\n';
+    if (addNewLine && !text.endsWith('\n')) {
+        text += '\n';
+    }
+    if (!isInstant) {
+        isTyping = true;
+    }
+    outputQueue.push({ text: text, offset: 0, typed: !isInstant });
+    queuedChars += text.length;
+    requestOutputFrame();
+}
+
+function clearOutput() {
+    outputQueue.push({ clear: true });
+    requestOutputFrame();
+}
+
+function requestOutputFrame() {
+    if (!outputFrameRequested) {
+        outputFrameRequested = true;
+        requestAnimationFrame(renderOutputFrame);
+    }
+}
+
+function renderOutputFrame(now) {
+    outputFrameRequested = false;
+    const elapsed = lastFrameTime === null ? 16 : Math.min(now - lastFrameTime, 250);
+    lastFrameTime = now;
+    // Печать идет кусками: за кадр набирается столько символов, сколько прошло TYPING_SPEED с прошлого кадра.
+    let budget = Math.max(1, Math.round(elapsed / TYPING_SPEED)) * (1 + Math.floor(queuedChars / TYPING_CATCHUP_CHARS));
+    let chunk = '';
+    while (outputQueue.length > 0) {
+        const item = outputQueue[0];
+        if (item.clear) {
+            outputQueue.shift();
+            chunk = '';
+            terminalOutput.value = '';
+            scrollbackLineCount = 0;
+            continue;
+        }
+        let take = item.text.length - item.offset;
+        if (item.typed) {
+            if (budget <= 0) break;
+            take = Math.min(take, budget);
+            budget -= take;
         }
-        terminalOutput.scrollTop = terminalOutput.scrollHeight;
+        chunk += item.text.substr(item.offset, take);
+        item.offset += take;
+        queuedChars -= take;
+        if (item.offset < item.text.length) break;
+        outputQueue.shift();
+        if (item.typed) promptPending = true;
+    }
+    // Приглашение — один раз после того, как весь ответ (все его куски) напечатан.
+    if (outputQueue.length === 0 && promptPending) {
+        promptPending = false;
+        chunk += prompt;
+    }
+    if (chunk) {
+        appendToScrollback(chunk);
+    }
+    if (outputQueue.length > 0) {
+        requestOutputFrame();
+    } else {
+        isTyping = false;
+        lastFrameTime = null;
         terminalInput.focus();
-        saveDataToLocalStorage();
-        return;
     }
-    isTyping = true;
-    let i = 0;
-    function typeChar() {
-        if (i < text.length) {
-            terminalOutput.value += text.charAt(i++);
-            terminalOutput.scrollTop = terminalOutput.scrollHeight;
-            setTimeout(typeChar, TYPING_SPEED);
-        } else {
-            if (addNewLine && !text.endsWith('\n')) {
-                terminalOutput.value += '\n';
-            }
-            isTyping = false;
-            displayOutput(prompt, false, true);
-            terminalInput.focus();
-        }
+}
+
+function countLines(text) {
+    let count = 0;
+    for (let i = text.indexOf('\n'); i !== -1; i = text.indexOf('\n', i + 1)) count++;
+    return count;
+}
+
+function appendToScrollback(text) {
+    terminalOutput.value += text;
+    scrollbackLineCount += countLines(text);
+    trimScrollback();
+    terminalOutput.scrollTop = terminalOutput.scrollHeight;
+    scheduleOutputSave();
+}
+
+function trimScrollback() {
+    if (scrollbackLineCount <= SCROLLBACK_LINES + SCROLLBACK_SLACK) return;
+    const value = terminalOutput.value;
+    let cut = 0;
+    for (let excess = scrollbackLineCount - SCROLLBACK_LINES; excess > 0; excess--) {
+        cut = value.indexOf('\n', cut) + 1;
     }
-    typeChar();
+    terminalOutput.value = value.slice(cut);
+    scrollbackLineCount = SCROLLBACK_LINES;
 }
 
 function updateSystemTimeAndUptime() {
@@ -282,7 +408,26 @@ function updateSystemTimeAndUptime() {
 function saveDataToLocalStorage() {
     try {
         localStorage.setItem('stalker_terminal_commandHistory', JSON.stringify(commandHistory));
-        localStorage.setItem('stalker_terminal_terminalOutput', terminalOutput.value);
         localStorage.setItem('stalker_terminal_soundEnabled', JSON.stringify(soundEnabled));
     } catch (e) {}
-}
\ No newline at end of file
+}
+
+// Вывод сохраняется не чаще раза в OUTPUT_SAVE_DELAY_MS и только если изменился; размер ограничен SCROLLBACK_LINES.
+function scheduleOutputSave() {
+    outputDirty = true;
+    if (outputSaveTimerId === null) {
+        outputSaveTimerId = setTimeout(saveOutputToLocalStorage, OUTPUT_SAVE_DELAY_MS);
+    }
+}
+
+function saveOutputToLocalStorage() {
+    if (outputSaveTimerId !== null) {
+        clearTimeout(outputSaveTimerId);
+        outputSaveTimerId = null;
+    }
+    if (!outputDirty) return;
+    outputDirty = false;
+    try {
+        localStorage.setItem(OUTPUT_STORAGE_KEY, terminalOutput.value);
+    } catch (e) {}
+}
@@ -0,0 +1,650 @@
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+
+import google_sheets_api
+
+# --- Константы для названий листов ---
+USERS_SHEET_NAME = "Пользователи"
+CONTRACTS_SHEET_NAME = "Контракты"
+REQUESTS_SHEET_NAME = "Запросы Клиентов"
+LOG_SHEET_NAME = "Логи"
+MESSAGES_SHEET_NAME = "Сообщения"
+
+# Колонка версии строки: растет на 1 при каждом изменении, по ней обнаруживаются конкурентные правки.
+VERSION_COLUMN = "Версия"
+WriteConflict = google_sheets_api.WriteConflict
+
+# --- Порядок колонок в листах (используется при добавлении строк) ---
+USER_COLUMNS = ["UID", "Ключ Доступа", "Роль", "Позывной", "Отряд"]
+CONTRACT_COLUMNS = ["ID", "Название", "Описание", "Награда", "Статус", "Назначено", VERSION_COLUMN]
+REQUEST_COLUMNS = ["ID Запроса", "UID Клиента", "Позывной Клиента", "Discord ID", "Причина", "Текст Запроса", "Статус", VERSION_COLUMN]
+LOG_COLUMNS = ["Timestamp", "Event_Type", "User_Info", "Message"]
+MESSAGE_COLUMNS = ["Timestamp", "Sender_UID", "Sender_Callsign", "Sender_Squad", "Recipient_Type", "Recipient_ID", "Message_Text"]
+
+# Лист -> (таблица SQLite, колонки, индексы). Колонки из индексов хранятся как TEXT.
+TABLES = {
+    USERS_SHEET_NAME: ("users", USER_COLUMNS, [("UID",)]),
+    CONTRACTS_SHEET_NAME: ("contracts", CONTRACT_COLUMNS, [("ID",), ("Назначено",)]),
+    REQUESTS_SHEET_NAME: ("requests", REQUEST_COLUMNS, [("ID Запроса",), ("UID Клиента",)]),
+    LOG_SHEET_NAME: ("logs", LOG_COLUMNS, [("Timestamp",)]),
+    MESSAGES_SHEET_NAME: ("messages", MESSAGE_COLUMNS, [("Recipient_Type", "Recipient_ID", "Timestamp")]),
+}
+
+# --- Выбор движка: sheets | sqlite | mirror (SQLite + асинхронная копия в Google Таблицы) ---
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'sheets')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'webterminal.db')
+MIRROR_RETRY_BASE_DELAY = float(os.environ.get('MIRROR_RETRY_BASE_DELAY', 1.0))
+MIRROR_RETRY_MAX_DELAY = float(os.environ.get('MIRROR_RETRY_MAX_DELAY', 60.0))
+MIRROR_IDLE_INTERVAL = float(os.environ.get('MIRROR_IDLE_INTERVAL', 1.0))
+# Сколько операций очереди репликации читается из базы за один проход.
+MIRROR_FLUSH_BATCH = int(os.environ.get('MIRROR_FLUSH_BATCH', 100))
+# Таблица SQLite с очередью репликации режима mirror: операции переживают перезапуск и не ограничены памятью.
+MIRROR_QUEUE_TABLE = "mirror_queue"
+TAIL_CHUNK_ROWS = google_sheets_api.TAIL_CHUNK_ROWS
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SheetsStorage:
+    """Движок поверх Google Таблиц: тонкая обертка над функциями google_sheets_api."""
+
+    name = "sheets"
+
+    def init(self):
+        return google_sheets_api.init_google_sheets()
+
+    def get_all_records(self, sheet_name):
+        return google_sheets_api.get_all_records(sheet_name)
+
+    def append_row(self, sheet_name, row_data):
+        return google_sheets_api.append_row(sheet_name, row_data)
+
+    def append_rows(self, sheet_name, rows):
+        return google_sheets_api.append_rows(sheet_name, rows)
+
+    def update_row_by_key(self, sheet_name, key_column, key_value, updated_fields):
+        return google_sheets_api.update_row_by_key(sheet_name, key_column, key_value, updated_fields)
+
+    def delete_row_by_key(self, sheet_name, key_column, key_value):
+        return google_sheets_api.delete_row_by_key(sheet_name, key_column, key_value)
+
+    def apply_writes(self, writes):
+        return google_sheets_api.apply_writes(writes)
+
+    def get_last_update_time(self):
+        return google_sheets_api.get_last_update_time()
+
+    def delete_leading_rows(self, sheet_name, keys, strict=True):
+        return google_sheets_api.delete_leading_rows(sheet_name, keys, strict)
+
+    def tail_reader(self, sheet_name, checkpoint=None):
+        return google_sheets_api.TailReader(sheet_name, checkpoint)
+
+    def invalidate_cache(self):
+        google_sheets_api.invalidate_cache()
+
+    def is_available(self):
+        return google_sheets_api.is_available()
+
+    def stats(self):
+        return {'sheets_pool': google_sheets_api.pool.stats()}
+
+
+class SQLiteStorage:
+    """
+    Локальный движок на SQLite в режиме WAL. Каждый лист — отдельная таблица с теми же
+    названиями колонок, порядок строк — порядок вставки, как в листе.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def init(self):
+        try:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            for table, columns, indexes in TABLES.values():
+                text_columns = {column for index in indexes for column in index}
+                column_defs = ", ".join(
+                    f"{_quote(column)} TEXT" if column in text_columns else _quote(column) for column in columns
+                )
+                self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({column_defs})")
+                # Базы, созданные до появления новых колонок (например, версии), дополняются ими.
+                existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+                for column in columns:
+                    if column not in existing:
+                        self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {_quote(column)}")
+                for index in indexes:
+                    index_name = f"idx_{table}_" + "_".join(str(columns.index(column)) for column in index)
+                    self._conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({', '.join(_quote(c) for c in index)})"
+                    )
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {MIRROR_QUEUE_TABLE} (id INTEGER PRIMARY KEY AUTOINCREMENT, operation TEXT, args TEXT)"
+            )
+            print(f"✅ Локальное хранилище SQLite: {self.path}")
+            return True
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка при инициализации SQLite '{self.path}': {e}")
+            return False
+
+    def _table(self, sheet_name):
+        table, columns, _ = TABLES[sheet_name]
+        return table, columns
+
+    def _key_clause(self, sheet_name, key_column):
+        _, _, indexes = TABLES[sheet_name]
+        if any(key_column in index for index in indexes):
+            return f"{_quote(key_column)} = ?"
+        return f"CAST({_quote(key_column)} AS TEXT) = ?"
+
+    def get_all_records(self, sheet_name):
+        try:
+            table, columns = self._table(sheet_name)
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT {', '.join(_quote(c) for c in columns)} FROM {table} ORDER BY rowid"
+                ).fetchall()
+            return [{column: ('' if value is None else value) for column, value in zip(columns, row)} for row in rows]
+        except (sqlite3.Error, KeyError) as e:
+            print(f"❌ Ошибка при получении данных из таблицы '{sheet_name}': {e}")
+            return []
+
+    def append_row(self, sheet_name, row_data):
+        return self.append_rows(sheet_name, [row_data])
+
+    def append_rows(self, sheet_name, rows):
+        if not rows:
+            return True
+        try:
+            table, columns = self._table(sheet_name)
+            width = len(columns)
+            values = [(list(row) + [''] * width)[:width] for row in rows]
+            with self._lock:
+                self._conn.executemany(
+                    f"INSERT INTO {table} VALUES ({', '.join('?' * width)})", values
+                )
+            return True
+        except (sqlite3.Error, KeyError) as e:
+            print(f"❌ Ошибка при добавлении строк в таблицу '{sheet_name}': {e}")
+            return False
+
+    def _update_row(self, sheet_name, key_column, key_value, updated_fields, expected=None):
+        """Обновляет первую строку с ключом; вызывается под self._lock. expected — {колонка: значение} для проверки."""
+        table, columns = self._table(sheet_name)
+        fields = {field: value for field, value in updated_fields.items() if field in columns}
+        checked = [column for column in (expected or {}) if column in columns]
+        selected = ", ".join(["rowid"] + [f"COALESCE(CAST({_quote(column)} AS TEXT), '')" for column in checked])
+        row = self._conn.execute(
+            f"SELECT {selected} FROM {table} WHERE {self._key_clause(sheet_name, key_column)} ORDER BY rowid LIMIT 1",
+            (str(key_value),)
+        ).fetchone()
+        if row is None:
+            print(f"⚠️ Строка с {key_column} = {key_value} не найдена в '{sheet_name}'.")
+            return False
+        for column, current in zip(checked, row[1:]):
+            if current != str(expected[column]):
+                raise WriteConflict(f"{sheet_name}/{key_value}: ожидалось '{expected[column]}', в базе '{current}'")
+        if fields:
+            assignments = ", ".join(f"{_quote(field)} = ?" for field in fields)
+            self._conn.execute(f"UPDATE {table} SET {assignments} WHERE rowid = ?", (*fields.values(), row[0]))
+        return True
+
+    def update_row_by_key(self, sheet_name, key_column, key_value, updated_fields):
+        try:
+            with self._lock:
+                return self._update_row(sheet_name, key_column, key_value, updated_fields)
+        except (sqlite3.Error, KeyError) as e:
+            print(f"❌ Ошибка при обновлении строки в таблице '{sheet_name}': {e}")
+            return False
+
+    def apply_writes(self, writes):
+        """Записи одной команды в одной транзакции: при ошибке или конфликте версий не применяется ничего."""
+        try:
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    for write in writes:
+                        if write[0] == "append":
+                            table, columns = self._table(write[1])
+                            self._conn.execute(
+                                f"INSERT INTO {table} VALUES ({', '.join('?' * len(columns))})",
+                                [write[2].get(column, '') for column in columns]
+                            )
+                        elif not self._update_row(*write[1:]):
+                            self._conn.execute("ROLLBACK")
+                            return False
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                self._conn.execute("COMMIT")
+            return True
+        except (sqlite3.Error, KeyError) as e:
+            print(f"❌ Ошибка при пакетной записи в SQLite: {e}")
+            return False
+
+    def delete_row_by_key(self, sheet_name, key_column, key_value):
+        try:
+            table, _ = self._table(sheet_name)
+            with self._lock:
+                cursor = self._conn.execute(
+                    f"DELETE FROM {table} WHERE rowid = (SELECT rowid FROM {table} "
+                    f"WHERE {self._key_clause(sheet_name, key_column)} ORDER BY rowid LIMIT 1)",
+                    (str(key_value),)
+                )
+            if cursor.rowcount == 0:
+                print(f"⚠️ Строка с {key_column} = {key_value} не найдена.")
+                return False
+            return True
+        except (sqlite3.Error, KeyError) as e:
+            print(f"❌ Ошибка при удалении строки из таблицы '{sheet_name}': {e}")
+            return False
+
+    def delete_leading_rows(self, sheet_name, keys, strict=True):
+        """Удаляет первые len(keys) строк таблицы, если их первая колонка совпадает с keys."""
+        if not keys:
+            return True
+        try:
+            table, columns = self._table(sheet_name)
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT rowid, CAST({_quote(columns[0])} AS TEXT) FROM {table} ORDER BY rowid LIMIT ?", (len(keys),)
+                ).fetchall()
+                if [value for _, value in rows] != [str(key) for key in keys]:
+                    print(f"⚠️ Начало таблицы '{sheet_name}' изменилось с момента чтения: строки не удалены.")
+                    return not strict
+                self._conn.execute(f"DELETE FROM {table} WHERE rowid <= ?", (rows[-1][0],))
+            return True
+        except (sqlite3.Error, KeyError) as e:
+            print(f"❌ Ошибка при удалении {len(keys)} строк из начала таблицы '{sheet_name}': {e}")
+            return False
+
+    def tail_reader(self, sheet_name, checkpoint=None):
+        return SQLiteTailReader(self, sheet_name, checkpoint)
+
+    def get_last_update_time(self):
+        """Счетчик data_version меняется, только когда базу изменило другое соединение."""
+        try:
+            with self._lock:
+                return str(self._conn.execute("PRAGMA data_version").fetchone()[0])
+        except sqlite3.Error:
+            return None
+
+    def invalidate_cache(self):
+        pass
+
+    def is_available(self):
+        return self._conn is not None
+
+    def stats(self):
+        return {}
+
+    def is_empty(self, sheet_name):
+        table, _ = self._table(sheet_name)
+        with self._lock:
+            return self._conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None
+
+    # --- Очередь репликации режима mirror ---
+
+    def queue_push(self, operation, args):
+        try:
+            with self._lock:
+                self._conn.execute(f"INSERT INTO {MIRROR_QUEUE_TABLE} (operation, args) VALUES (?, ?)",
+                                   (operation, json.dumps(args, ensure_ascii=False, default=str)))
+            return True
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"❌ Ошибка записи в очередь репликации ({operation}): {e}")
+            return False
+
+    def queue_peek(self, limit):
+        """Первые limit операций очереди: [(id, операция, аргументы), ...]."""
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT id, operation, args FROM {MIRROR_QUEUE_TABLE} ORDER BY id LIMIT ?", (limit,)
+                ).fetchall()
+            return [(row_id, operation, json.loads(args)) for row_id, operation, args in rows]
+        except (sqlite3.Error, ValueError) as e:
+            print(f"❌ Ошибка чтения очереди репликации: {e}")
+            return []
+
+    def queue_remove(self, last_id):
+        """Удаляет из очереди операции до last_id включительно."""
+        try:
+            with self._lock:
+                self._conn.execute(f"DELETE FROM {MIRROR_QUEUE_TABLE} WHERE id <= ?", (last_id,))
+            return True
+        except sqlite3.Error as e:
+            print(f"❌ Ошибка очистки очереди репликации: {e}")
+            return False
+
+    def queue_size(self):
+        try:
+            with self._lock:
+                return self._conn.execute(f"SELECT COUNT(*) FROM {MIRROR_QUEUE_TABLE}").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+
+class SQLiteTailReader:
+    """
+    Инкрементальное чтение таблицы SQLite с тем же интерфейсом, что у google_sheets_api.TailReader:
+    строки с rowid больше контрольного, пачками по chunk_rows. Если контрольной строки больше нет
+    (таблицу очистили или архивировали), чтение продолжается после последней строки не позже ее метки времени.
+    """
+
+    engine = "sqlite"
+
+    def __init__(self, store, sheet_name, checkpoint=None, chunk_rows=TAIL_CHUNK_ROWS):
+        self.store = store
+        self.sheet_name = sheet_name
+        self.chunk_rows = chunk_rows
+        self.rowid = 0
+        self.values = None
+        self.resyncs = 0
+        if checkpoint and checkpoint.get('engine') == self.engine:
+            self.rowid = int(checkpoint.get('rowid', 0))
+            self.values = checkpoint.get('values')
+
+    def checkpoint(self):
+        return {'engine': self.engine, 'rowid': self.rowid, 'values': self.values}
+
+    @staticmethod
+    def _text(row):
+        return ['' if value is None else str(value) for value in row]
+
+    def _resync(self, table, columns):
+        self.resyncs += 1
+        key = self.values[0] if self.values else ''
+        row = self.store._conn.execute(
+            f"SELECT rowid FROM {table} WHERE CAST({_quote(columns[0])} AS TEXT) <= ? ORDER BY rowid DESC LIMIT 1", (key,)
+        ).fetchone()
+        self.rowid = row[0] if row else 0
+        print(f"⚠️ Таблица '{self.sheet_name}' изменилась (удаление строк): чтение продолжено после rowid {self.rowid}.")
+
+    def iter_new_rows(self):
+        try:
+            table, columns = self.store._table(self.sheet_name)
+            selected = ", ".join(_quote(column) for column in columns)
+            if self.rowid and self.values is not None:
+                with self.store._lock:
+                    row = self.store._conn.execute(f"SELECT {selected} FROM {table} WHERE rowid = ?", (self.rowid,)).fetchone()
+                    if row is None or self._text(row) != self.values:
+                        self._resync(table, columns)
+        except (sqlite3.Error, KeyError) as e:
+            print(f"❌ Ошибка при чтении новых строк таблицы '{self.sheet_name}': {e}")
+            return
+        while True:
+            try:
+                with self.store._lock:
+                    rows = self.store._conn.execute(
+                        f"SELECT rowid, {selected} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                        (self.rowid, self.chunk_rows)
+                    ).fetchall()
+            except sqlite3.Error as e:
+                print(f"❌ Ошибка при чтении новых строк таблицы '{self.sheet_name}': {e}")
+                return
+            for row in rows:
+                self.rowid, self.values = row[0], self._text(row[1:])
+                yield dict(zip(columns, self.values))
+            if len(rows) < self.chunk_rows:
+                return
+
+
+class MirroredStorage:
+    """
+    Чтение и запись идут в SQLite, а каждая успешная запись в фоне повторяется в Google Таблицах.
+    Очередь репликации хранится в той же базе SQLite, поэтому переживает перезапуск и долгий обрыв связи.
+    Порядок операций сохраняется; при ошибке операция повторяется с экспоненциальной задержкой.
+    Если Google Таблицы недоступны при запуске, подключение (и заполнение пустых таблиц) повторяет фоновый цикл.
+    """
+
+    name = "mirror"
+
+    def __init__(self, primary, replica):
+        self.primary = primary
+        self.replica = replica
+        self._replica_ready = False
+        self._empty_tables = []
+        self._seeded = 0
+        self._pending_count = 0
+        self._wake = threading.Event()
+        self._retry_delay = 0.0
+
+    def init(self):
+        if not self.primary.init():
+            return False
+        self._empty_tables = [sheet_name for sheet_name in TABLES if self.primary.is_empty(sheet_name)]
+        self._pending_count = self.primary.queue_size()
+        if self._pending_count:
+            print(f"ℹ️ В очереди репликации {self._pending_count} операций с прошлого запуска.")
+        if not self.connect_replica():
+            print("⚠️ Google Таблицы недоступны: подключение будет повторяться, изменения копятся в очереди репликации.")
+        atexit.register(self.flush)
+        return True
+
+    def connect_replica(self):
+        """Подключает Google Таблицы и заполняет из них таблицы, пустые при запуске. True, если копия готова."""
+        if self._replica_ready:
+            return True
+        if not self.replica.init():
+            return False
+        for sheet_name in self._empty_tables:
+            _, columns, _ = TABLES[sheet_name]
+            records = self.replica.get_all_records(sheet_name)
+            self.primary.append_rows(sheet_name, [[record.get(column, '') for column in columns] for record in records])
+        if self._empty_tables:
+            # Запись своим соединением не меняет data_version SQLite: счетчик заполнений дает фоновому
+            # обновлению DataStore увидеть новые данные.
+            self._seeded += 1
+            self._empty_tables = []
+        self._replica_ready = True
+        return True
+
+    def _replicate(self, operation, *args):
+        if self.primary.queue_push(operation, args):
+            self._pending_count += 1
+        else:
+            print(f"⚠️ Операция {operation} ('{args[0]}') не будет скопирована в Google Таблицы.")
+        self._wake.set()
+
+    def get_all_records(self, sheet_name):
+        return self.primary.get_all_records(sheet_name)
+
+    def tail_reader(self, sheet_name, checkpoint=None):
+        return self.primary.tail_reader(sheet_name, checkpoint)
+
+    def append_row(self, sheet_name, row_data):
+        if not self.primary.append_row(sheet_name, row_data):
+            return False
+        self._replicate("append_rows", sheet_name, [row_data])
+        return True
+
+    def append_rows(self, sheet_name, rows):
+        if not self.primary.append_rows(sheet_name, rows):
+            return False
+        self._replicate("append_rows", sheet_name, rows)
+        return True
+
+    def update_row_by_key(self, sheet_name, key_column, key_value, updated_fields):
+        if not self.primary.update_row_by_key(sheet_name, key_column, key_value, updated_fields):
+            return False
+        self._replicate("update_row_by_key", sheet_name, key_column, key_value, updated_fields)
+        return True
+
+    def delete_row_by_key(self, sheet_name, key_column, key_value):
+        if not self.primary.delete_row_by_key(sheet_name, key_column, key_value):
+            return False
+        self._replicate("delete_row_by_key", sheet_name, key_column, key_value)
+        return True
+
+    def delete_leading_rows(self, sheet_name, keys, strict=True):
+        if not self.primary.delete_leading_rows(sheet_name, keys, strict):
+            return False
+        # Расхождение копии в Google Таблицах не должно навсегда останавливать очередь репликации.
+        self._replicate("delete_leading_rows", sheet_name, keys, False)
+        return True
+
+    def apply_writes(self, writes):
+        if not self.primary.apply_writes(writes):
+            return False
+        # Версии уже проверены локальной базой; копия в Google Таблицах просто повторяет запись.
+        self._replicate("apply_writes", [write[:5] + (None,) if write[0] == "update" else write for write in writes])
+        return True
+
+    def get_last_update_time(self):
+        version = self.primary.get_last_update_time()
+        return None if version is None else f"{version}.{self._seeded}"
+
+    def invalidate_cache(self):
+        self.replica.invalidate_cache()
+
+    def is_available(self):
+        # Запись идет в локальную базу, недоступность Google Таблиц лишь копит очередь репликации.
+        return self.primary.is_available()
+
+    def stats(self):
+        stats = self.replica.stats()
+        stats['mirror_pending'] = self.pending()
+        return stats
+
+    def pending(self):
+        return self._pending_count
+
+    def flush(self):
+        """Отправляет накопленные операции в Google Таблицы по порядку. Возвращает False при ошибке."""
+        if not self._replica_ready:
+            return False
+        while True:
+            batch = self.primary.queue_peek(MIRROR_FLUSH_BATCH)
+            if not batch:
+                return True
+            index = 0
+            while index < len(batch):
+                _, operation, args = batch[index]
+                # Подряд идущие добавления в один лист склеиваются в один append_rows.
+                if operation == "append_rows":
+                    rows = list(args[1])
+                    merged = 1
+                    while index + merged < len(batch):
+                        _, next_operation, next_args = batch[index + merged]
+                        if next_operation != "append_rows" or next_args[0] != args[0]:
+                            break
+                        rows.extend(next_args[1])
+                        merged += 1
+                    ok = self.replica.append_rows(args[0], rows)
+                else:
+                    merged = 1
+                    ok = getattr(self.replica, operation)(*args)
+                if not ok:
+                    return False
+                index += merged
+                if not self.primary.queue_remove(batch[index - 1][0]):
+                    return False
+                self._pending_count = max(0, self._pending_count - merged)
+
+    def run_replication_loop(self, sleep=time.sleep):
+        while True:
+            self._wake.wait(MIRROR_IDLE_INTERVAL)
+            self._wake.clear()
+            try:
+                if self.connect_replica() and self.flush():
+                    self._retry_delay = 0.0
+                    continue
+            except Exception as e:
+                print(f"❌ Ошибка репликации в Google Таблицы: {e}")
+            self._retry_delay = min(MIRROR_RETRY_MAX_DELAY, max(MIRROR_RETRY_BASE_DELAY, self._retry_delay * 2))
+            sleep(self._retry_delay)
+
+
+# --- Активный движок и функции-обертки с тем же интерфейсом, что у google_sheets_api ---
+engine = None
+# True после успешного init_storage(); до этого данные обслуживаются из снимка, а записи недоступны.
+initialized = False
+
+
+def create_engine(backend=STORAGE_BACKEND):
+    if backend == "sqlite":
+        return SQLiteStorage()
+    if backend == "mirror":
+        return MirroredStorage(SQLiteStorage(), SheetsStorage())
+    return SheetsStorage()
+
+
+def init_storage(backend=STORAGE_BACKEND):
+    global engine, initialized
+    engine = create_engine(backend)
+    initialized = bool(engine.init())
+    return initialized
+
+
+def is_ready():
+    return initialized
+
+
+def run_replication_loop(sleep=time.sleep):
+    """Фоновая репликация для режима mirror; для остальных движков сразу завершается."""
+    if isinstance(engine, MirroredStorage):
+        engine.run_replication_loop(sleep)
+
+
+def get_all_records(sheet_name):
+    return engine.get_all_records(sheet_name)
+
+
+def append_row(sheet_name, row_data):
+    return engine.append_row(sheet_name, row_data)
+
+
+def append_rows(sheet_name, rows):
+    return engine.append_rows(sheet_name, rows)
+
+
+def update_row_by_key(sheet_name, key_column, key_value, updated_fields):
+    return engine.update_row_by_key(sheet_name, key_column, key_value, updated_fields)
+
+
+def delete_row_by_key(sheet_name, key_column, key_value):
+    return engine.delete_row_by_key(sheet_name, key_column, key_value)
+
+
+def delete_leading_rows(sheet_name, keys):
+    """Удаляет заархивированное начало листа-журнала: первые строки, чья первая колонка совпадает с keys."""
+    return engine.delete_leading_rows(sheet_name, keys)
+
+
+def apply_writes(writes):
+    """Атомарно применяет записи одной команды. Бросает WriteConflict при несовпадении версии строки."""
+    return engine.apply_writes(writes)
+
+
+def get_last_update_time():
+    return engine.get_last_update_time()
+
+
+def tail_reader(sheet_name, checkpoint=None):
+    """Инкрементальный читатель листа-журнала: iter_new_rows() отдает только строки, добавленные после контрольной точки."""
+    return engine.tail_reader(sheet_name, checkpoint)
+
+
+def invalidate_cache():
+    engine.invalidate_cache()
+
+
+def is_available():
+    return initialized and engine.is_available()
+
+
+def stats():
+    return engine.stats() if initialized else {'initialized': False}
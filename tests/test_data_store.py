@@ -0,0 +1,38 @@
+import storage
+from data_store import DataStore
+from storage import CONTRACTS_SHEET_NAME, CONTRACT_COLUMNS, SQLiteStorage, VERSION_COLUMN
+
+
+def make_store(tmp_path, monkeypatch):
+    engine = SQLiteStorage(str(tmp_path / "terminal.db"))
+    assert engine.init()
+    monkeypatch.setattr(storage, 'engine', engine)
+    contract = {'ID': 1, 'Название': 'C1', 'Описание': '', 'Награда': '100', 'Статус': 'Активен',
+                'Назначено': 'None', VERSION_COLUMN: 1}
+    engine.append_rows(CONTRACTS_SHEET_NAME, [[contract[column] for column in CONTRACT_COLUMNS]])
+    data_store = DataStore()
+    data_store.load_records([], [dict(contract)], [])
+    return data_store, engine
+
+
+def test_update_replaces_record_instead_of_mutating(tmp_path, monkeypatch):
+    data_store, _ = make_store(tmp_path, monkeypatch)
+    before = data_store.get_contract(1)
+    assert data_store.update_contract(1, {'Статус': 'Назначен', 'Назначено': 'alpha'})
+    after = data_store.get_contract(1)
+    assert before['Статус'] == 'Активен' and before[VERSION_COLUMN] == 1
+    assert after['Статус'] == 'Назначен' and after[VERSION_COLUMN] == 2
+    assert list(data_store.contracts_by_squad['alpha'].values()) == [after]
+
+
+def test_conflict_leaves_cache_untouched(tmp_path, monkeypatch):
+    data_store, engine = make_store(tmp_path, monkeypatch)
+    # Другой воркер успел поднять версию строки.
+    engine.update_row_by_key(CONTRACTS_SHEET_NAME, 'ID', 1, {VERSION_COLUMN: 5})
+    before = data_store.get_contract(1)
+    mutation = data_store.mutation()
+    mutation.update_contract(1, {'Статус': 'Назначен'})
+    monkeypatch.setattr(data_store, 'refresh', lambda *args: None)
+    assert not mutation.commit()
+    assert mutation.conflict
+    assert data_store.get_contract(1) is before and before['Статус'] == 'Активен'
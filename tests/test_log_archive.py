@@ -0,0 +1,48 @@
+import os
+
+import storage
+from log_archive import LogArchive
+from storage import LOG_SHEET_NAME, SQLiteStorage
+
+
+def make_archive(tmp_path, monkeypatch, rows):
+    engine = SQLiteStorage(str(tmp_path / "terminal.db"))
+    assert engine.init()
+    monkeypatch.setattr(storage, 'engine', engine)
+    monkeypatch.setattr(storage, 'initialized', True)
+    engine.append_rows(LOG_SHEET_NAME, rows)
+    return LogArchive(str(tmp_path / "archive"), max_rows=20, max_age=10 * 365 * 24 * 3600, keep_rows=10), engine
+
+
+def log_rows(start, count):
+    return [[f"2026-01-01 10:{i // 60:02d}:{i % 60:02d}", "X", "UID: 1", f"row {i}"] for i in range(start, start + count)]
+
+
+def test_rotate_and_query_read_only_new_rows(tmp_path, monkeypatch):
+    archive, engine = make_archive(tmp_path, monkeypatch, log_rows(0, 30))
+    reads = []
+    tail_reader = engine.tail_reader
+    monkeypatch.setattr(engine, 'tail_reader', lambda *args: reads.append(args) or tail_reader(*args))
+
+    assert archive.rotate_all()[LOG_SHEET_NAME] == 20
+    engine.append_rows(LOG_SHEET_NAME, log_rows(30, 5))
+    records, total = archive.query(LOG_SHEET_NAME, '2026-01-01', '2026-01-01', limit=100)
+
+    assert total == 35
+    assert [record['Message'] for record in records] == [f"row {i}" for i in range(35)]
+    # Лист читается одним TailReader: ротация и запрос дочитывают строки с его контрольной точки.
+    assert [args[0] for args in reads].count(LOG_SHEET_NAME) == 1
+    assert [record['Message'] for record in archive._live[LOG_SHEET_NAME][1]] == [f"row {i}" for i in range(20, 35)]
+
+
+def test_failed_rotation_survives_missing_archive_file(tmp_path, monkeypatch, capsys):
+    archive, engine = make_archive(tmp_path, monkeypatch, log_rows(0, 30))
+    monkeypatch.setattr(storage, 'delete_leading_rows', lambda *args: False)
+
+    def remove(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, 'remove', remove)
+    assert archive.rotate_all()[LOG_SHEET_NAME] == 0
+    assert "Ошибка удаления неудавшегося архива" in capsys.readouterr().out
+    assert archive.entries == []
@@ -0,0 +1,25 @@
+from outbound import Outbound
+
+
+def test_flush_sid_sends_chunks_as_separate_frames():
+    sent = []
+    outbound = Outbound(lambda event, payload, sid: sent.append((event, payload, sid)))
+    outbound.send('sid-2', 'terminal_output', {'output': 'другой\n'})
+    for chunk in ('строки 1-10\n', 'строки 11-20\n'):
+        outbound.send('sid-1', 'terminal_output', {'output': chunk})
+        assert outbound.flush(('sid-1',)) == 1
+    assert sent == [
+        ('terminal_output', {'output': 'строки 1-10\n'}, 'sid-1'),
+        ('terminal_output', {'output': 'строки 11-20\n'}, 'sid-1'),
+    ]
+    # Очереди других клиентов ждут общего окна отправки.
+    assert outbound.flush() == 1
+    assert sent[-1] == ('terminal_output', {'output': 'другой\n'}, 'sid-2')
+
+
+def test_flush_sid_respects_client_high_water():
+    sent = []
+    outbound = Outbound(lambda event, payload, sid: sent.append((event, payload, sid)), lambda sid: 100, high_water=10)
+    outbound.send('sid-1', 'terminal_output', {'output': 'x\n'})
+    assert outbound.flush(('sid-1',)) == 0
+    assert sent == [] and outbound.stats()['queued_payloads'] == 1
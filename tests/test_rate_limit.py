@@ -0,0 +1,14 @@
+from rate_limit import RateLimiter
+
+
+def test_throttled_guests_are_capped():
+    limiter = RateLimiter(sid_rate=0.001, sid_burst=1, throttled_users_limit=10)
+    for _ in range(5):
+        limiter.throttle('sid-busy', None, 1)
+    for number in range(100):
+        sid = f"sid-{number}"
+        limiter.throttle(sid, None, 1)
+        limiter.throttle(sid, None, 1)
+    assert len(limiter.throttled_users) <= 10
+    assert limiter.stats(top=1)['top_throttled'] == [('sid:sid-busy', 4)]
+    assert limiter.throttled['sid'] == 104
@@ -0,0 +1,36 @@
+import hashlib
+
+from data_store import DataStore
+from resume_tokens import ResumeTokens
+
+SECRET_KEY = "test-secret"
+ACCESS_KEY = "a1b2c3d4"
+
+
+def make_store(key=ACCESS_KEY):
+    data_store = DataStore()
+    data_store.load_records([{'UID': '7', 'Ключ Доступа': key, 'Роль': 'operative', 'Позывной': 'Wolf', 'Отряд': 'alpha'}], [], [])
+    return data_store
+
+
+def test_token_payload_does_not_reveal_key_hash():
+    data_store, tokens = make_store(), ResumeTokens(SECRET_KEY)
+    token = tokens.issue('7', data_store.key_digest('7'))
+    # Токен подписан, но читаем: содержимое доступно любому, у кого он есть.
+    payload = tokens.serializer.loads(token)
+    key_sha256 = hashlib.sha256(ACCESS_KEY.encode('utf-8')).hexdigest()
+    assert payload['key'] not in key_sha256
+    assert not key_sha256.startswith(payload['key'][:16])
+    # Перебор ключей по открытому SHA-256 не находит совпадения с отпечатком.
+    assert all(hashlib.sha256(candidate.encode('utf-8')).hexdigest()[:len(payload['key'])] != payload['key']
+               for candidate in (ACCESS_KEY, ACCESS_KEY.upper(), ''))
+    # Другой секрет — другой отпечаток того же ключа.
+    assert ResumeTokens("other-secret").fingerprint(data_store.key_digest('7')) != payload['key']
+
+
+def test_token_resumes_until_key_changes():
+    tokens = ResumeTokens(SECRET_KEY)
+    token = tokens.issue('7', make_store().key_digest('7'))
+    uid, fingerprint = tokens.verify(token)
+    assert make_store().resume_user(uid, fingerprint, tokens.fingerprint)['Позывной'] == 'Wolf'
+    assert make_store(key="ffff0000").resume_user(uid, fingerprint, tokens.fingerprint) is None
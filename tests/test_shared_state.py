@@ -0,0 +1,113 @@
+import time
+import threading
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+import shared_state
+from shared_state import RedisState
+from presence import PresenceRegistry
+from outbound import Outbound
+from delivery import Delivery
+
+DEFAULT_FREQUENCIES = {'alpha': '142.7', 'beta': '148.3'}
+
+
+def make_worker(server):
+    return RedisState(None, DEFAULT_FREQUENCIES, client=fakeredis.FakeRedis(server=server, decode_responses=True))
+
+
+def start_listener(worker, handler=None):
+    received = []
+
+    def handle(event, payload):
+        received.append((event, payload))
+        if handler is not None:
+            handler(event, payload)
+
+    threading.Thread(target=worker.run_listener, args=(handle,), daemon=True).start()
+    deadline = time.time() + 5
+    while not worker._redis.pubsub_numsub(worker._events_channel)[0][1]:
+        assert time.time() < deadline, "слушатель не подписался на канал событий"
+        time.sleep(0.01)
+    return received
+
+
+def wait_for(received, count):
+    deadline = time.time() + 5
+    while len(received) < count and time.time() < deadline:
+        time.sleep(0.01)
+    return received
+
+
+def test_events_reach_other_worker():
+    server = fakeredis.FakeServer()
+    first, second = make_worker(server), make_worker(server)
+    received_first = start_listener(first)
+    received_second = start_listener(second)
+
+    message = {'sender_uid': '1', 'text': 'привет'}
+    first.publish('message', message)
+    first.publish('deliver', {'room': 'alpha', 'event': 'terminal_output', 'payload': {'output': 'x\n'}, 'skip_sid': None})
+    first.publish('invalidate', {'version': 3, 'sheets': ['Контракты']})
+
+    assert wait_for(received_second, 3) == [
+        ('message', message),
+        ('deliver', {'room': 'alpha', 'event': 'terminal_output', 'payload': {'output': 'x\n'}, 'skip_sid': None}),
+        ('invalidate', {'version': 3, 'sheets': ['Контракты']}),
+    ]
+    # Свои события воркер не обрабатывает.
+    time.sleep(0.1)
+    assert received_first == []
+
+
+def test_defaults_written_by_listener():
+    server = fakeredis.FakeServer()
+    worker = make_worker(server)
+    assert worker.frequencies() == DEFAULT_FREQUENCIES
+    start_listener(worker)
+    worker.set_frequency('alpha', '150.0')
+    assert make_worker(server).frequencies() == {'alpha': '150.0', 'beta': '148.3'}
+
+
+def test_presence_keys_expire():
+    server = fakeredis.FakeServer()
+    worker = make_worker(server)
+    worker.session_online('sid-1', '7')
+    assert worker.is_online('7')
+    ttl = worker._redis.ttl(worker._online_key('7'))
+    assert 0 < ttl <= shared_state.PRESENCE_TTL + 1
+    worker.session_offline('sid-1', '7')
+    assert not worker.is_online('7')
+
+
+def make_delivery_worker(server):
+    """Набор обработчиков одного воркера, как в WebTerminal: присутствие, outbound и рассылка поверх общего Redis."""
+    shared = make_worker(server)
+    presence = PresenceRegistry(shared)
+    sent = []
+    outbound = Outbound(lambda event, payload, sid: sent.append((event, payload, sid)))
+    return shared, presence, outbound, Delivery(presence, outbound, shared), sent
+
+
+def test_deliver_reaches_sid_on_other_worker():
+    server = fakeredis.FakeServer()
+    shared_a, presence_a, outbound_a, delivery_a, sent_a = make_delivery_worker(server)
+    shared_b, presence_b, outbound_b, delivery_b, sent_b = make_delivery_worker(server)
+    presence_b.set_session('sid-b', '5', 'Fox', 'operative', 'alpha')
+    presence_b.set_session('sid-b2', '6', 'Owl', 'operative', 'beta')
+
+    def handle_shared_event(event, payload):
+        if event == 'deliver':
+            delivery_b.receive(payload)
+
+    received_b = start_listener(shared_b, handle_shared_event)
+
+    delivery_a.deliver('alpha', 'terminal_output', {'output': 'x\n'})
+    wait_for(received_b, 1)
+    outbound_a.flush()
+    outbound_b.flush()
+
+    assert sent_b == [('terminal_output', {'output': 'x\n'}, 'sid-b')]
+    assert sent_a == []